@@ -33,7 +33,7 @@ setup(
         'Topic :: Internet :: WWW/HTTP :: Dynamic Content',
     ],
     install_requires=[
-        'PIL==1.1.7',
+        'Pillow>=2.4.0',
         'django-yapi',
         'django-yutils'
     ]
@@ -11,8 +11,12 @@ admin.site.register(Place, PlaceAdmin)
 
 
 class RatingAdmin(admin.ModelAdmin):
-    list_display = ('place', 'average', 'reviews', 'relative')
+    list_display = ('place', 'average', 'reviews', 'relative_rating')
     search_fields = ('place__name',)
+    
+    def relative_rating(self, obj):
+        return obj.get_relative()
+    relative_rating.short_description = 'Relative'
 admin.site.register(Rating, RatingAdmin)
 
 
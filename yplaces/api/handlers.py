@@ -1,7 +1,6 @@
 import logging
 from django.conf import settings
 from django.core.exceptions import ObjectDoesNotExist
-from django.db.models import Q
 from django.http.response import HttpResponse, HttpResponseForbidden
 from django.template import Context
 from django.template.loader import get_template
@@ -14,8 +13,17 @@ from yapi.response import HTTPStatus, Response
 from yutils.email import EmailMessage
 
 from serializers import PlaceSerializer, PhotoSerializer, ReviewSerializer
+from streaming import StreamingResponse
+from yplaces.autocomplete import AutocompleteIndex, autocomplete_index
+from yplaces.clustering import Clustering
 from yplaces.forms import PlaceForm, PhotoForm, ReviewForm
+from yplaces.markers import Markers
 from yplaces.models import Place, Photo, Review
+from yplaces.pagination import CursorPaginator
+from yplaces.processing import get_processor as get_photo_processor
+from yplaces.ranking import Ranking
+from yplaces.search import get_backend as get_search_backend
+from yplaces.spatial import nearest_index
 
 # Instantiate logger.
 logger = logging.getLogger(__name__)
@@ -139,6 +147,61 @@ class PlacesHandler(Resource):
                             serializer=None,
                             status=HTTPStatus.CLIENT_ERROR_400_BAD_REQUEST)
         
+        ###
+        # Non paginated results are streamed, either as a JSON array (default) or as newline delimited JSON.
+        output = request.GET.get('format', 'json')
+        try:
+            StreamingResponse.formats.keys().index(output)
+            if output != 'json' and pagination:
+                raise ValueError
+        except ValueError:
+            return Response(request=request,
+                            data={ 'message': 'Invalid parameters', 'parameters': { 'format': ['Invalid value'] } },
+                            serializer=None,
+                            status=HTTPStatus.CLIENT_ERROR_400_BAD_REQUEST)
+        
+        ###
+        # Optionally, only some fields can be requested (and fetched).
+        try:
+            serializer = PlaceSerializer(fields=PlaceSerializer.parse_fields(request.GET.get('fields', '')))
+        except ValueError:
+            return Response(request=request,
+                            data={ 'message': 'Invalid parameters', 'parameters': { 'fields': ['Invalid value'] } },
+                            serializer=None,
+                            status=HTTPStatus.CLIENT_ERROR_400_BAD_REQUEST)
+        
+        ###
+        # Optionally, results can be paginated with cursors (sorted by name) instead of page numbers (an empty cursor for the first
+        # page, followed by the returned 'next'/'prev' ones), in which case counting all of them is optional.
+        cursor = request.GET.get('cursor', None)
+        try:
+            total = request.GET.get('total', 'false')
+            ['true', 'false'].index(total)
+            total = (total.lower() == 'true')
+        except ValueError:
+            return Response(request=request,
+                            data={ 'message': 'Invalid parameters', 'parameters': { 'total': ['Invalid value'] } },
+                            serializer=None,
+                            status=HTTPStatus.CLIENT_ERROR_400_BAD_REQUEST)
+        
+        ###
+        # Optionally, results can be ordered by distance to the given coordinates (nearest first) or by relevance (i.e. how well
+        # they match the searched name and location, how near they are to the given coordinates and how well rated they are).
+        order = request.GET.get('order', '')
+        if order != '':
+            try:
+                ['distance', 'relevance'].index(order)
+                if (order == 'distance' and not request.GET.get('latLng', None)) or cursor is not None:
+                    raise ValueError
+                if order == 'relevance' and not pagination:
+                    raise ValueError
+                filters['order'] = order
+            except ValueError:
+                return Response(request=request,
+                                data={ 'message': 'Invalid parameters', 'parameters': { 'order': ['Invalid value'] } },
+                                serializer=None,
+                                status=HTTPStatus.CLIENT_ERROR_400_BAD_REQUEST)
+        
         ###
         # Radius search.
         latLng = request.GET.get('latLng', None)
@@ -169,40 +232,337 @@ class PlacesHandler(Resource):
                                 data={ 'message': 'Invalid parameters', 'parameters': { 'radius': ['Invalid value'] } },
                                 serializer=None,
                                 status=HTTPStatus.CLIENT_ERROR_400_BAD_REQUEST)
-                
+            
             # Filter results by radius search.
             filters['latLng'] = request.GET.get('latLng', None)
             filters['radius'] = radius
-            results = Place.search_radius(latLng=latLng, radius=radius, querySet=results)
+            results = Place.search_radius(latLng=latLng, radius=radius, querySet=results, annotate=True, order=(order == 'distance'))
+        
+        ###
+        # Name and location (address, city, state or country), ranked by relevance when no other order applies.
+        name = request.GET.get('name', '')
+        if name != '':
+            filters['name'] = name
+        location = request.GET.get('location', '')
+        if location != '':
+            filters['location'] = location
+        results = get_search_backend().search(results, name=name, location=location, rank=(cursor is None and order != 'distance'))
+        
+        #
+        # Return.
+        #
+        if request.auth:
+            user = request.auth['user']
+        else:
+            user = None
+        if order == 'relevance':
+            ranking = Ranking(name=name, location=location, latLng=latLng, radius=filters.get('radius', None))
+            return Response(request=request,
+                            data=ranking.get_results(request, results, user, filters, serializer),
+                            serializer=None,
+                            status=HTTPStatus.SUCCESS_200_OK)
+        if cursor is not None:
+            try:
+                return Response(request=request,
+                                data=CursorPaginator(('name', 'id'), serializer=serializer).get_results(request, results, user, filters, total),
+                                serializer=None,
+                                status=HTTPStatus.SUCCESS_200_OK)
+            except ValueError:
+                return Response(request=request,
+                                data={ 'message': 'Invalid parameters', 'parameters': { 'cursor': ['Invalid value'] } },
+                                serializer=None,
+                                status=HTTPStatus.CLIENT_ERROR_400_BAD_REQUEST)
+        if not pagination:
+            return StreamingResponse(request=request,
+                                     data=results,
+                                     serializer=serializer,
+                                     format=output,
+                                     status=HTTPStatus.SUCCESS_200_OK)
+        return Response(request=request,
+                        data=results,
+                        filters=filters,
+                        serializer=serializer,
+                        status=HTTPStatus.SUCCESS_200_OK)
+
+
 
+class PlacesNearestHandler(Resource):
+    """
+    API endpoint handler.
+    """
+    # HTTP methods allowed.
+    allowed_methods = ['GET']
+    
+    # Maximum number of Places that can be requested.
+    max_results = 100
+    
+    def get(self, request):
+        """
+        Process GET request.
+        """
+        filters = {}
+        
         ###
-        # Name.
+        # Coordinates (required).
         try:
-            name = request.GET['name']
-            if name != '':
-                results = results.filter(Q(name__icontains=name))
-                filters['name'] = name
-        except KeyError:
-            pass
+            latLng = [float(i) for i in request.GET['latLng'].split(',')]
+            if len(latLng) != 2:
+                raise ValueError
+            latLng = (latLng[0], latLng[1])
+            filters['latLng'] = request.GET['latLng']
+        except (KeyError, ValueError):
+            return Response(request=request,
+                            data={ 'message': 'Invalid parameters', 'parameters': { 'latLng': ['Invalid value'] } },
+                            serializer=None,
+                            status=HTTPStatus.CLIENT_ERROR_400_BAD_REQUEST)
         
         ###
-        # Location.
+        # Number of Places (defaults to 10).
         try:
-            location = request.GET['location']
-            if location != '':
-                results = results.filter(Q(address__icontains=location) | Q(city__icontains=location) | Q(state__icontains=location) | Q(country__icontains=location))
-                filters['location'] = location
+            k = int(request.GET.get('k', 10))
+            if k <= 0 or k > self.max_results:
+                raise ValueError
+            filters['k'] = k
+        except ValueError:
+            return Response(request=request,
+                            data={ 'message': 'Invalid parameters', 'parameters': { 'k': ['Invalid value'] } },
+                            serializer=None,
+                            status=HTTPStatus.CLIENT_ERROR_400_BAD_REQUEST)
+        
+        if request.auth:
+            user = request.auth['user']
+        else:
+            user = None
+        serializer = PlaceSerializer()
+        
+        # Fetch nearest Places from the index, keeping its order (and skipping those deactivated, e.g. by other
+        # processes, since it was built).
+        nearest = nearest_index.nearest(latLng, k)
+        places = serializer.prepare(Place.objects.filter(active=True), user).in_bulk([pk for pk, distance in nearest])
+        results = []
+        for pk, distance in nearest:
+            if pk in places:
+                places[pk].distance_km = distance
+                results.append(places[pk])
+        
+        #
+        # Return.
+        #
+        return Response(request=request,
+                        data={ 'collection': serializer.to_simple_many(results, user), 'filters': filters },
+                        serializer=None,
+                        status=HTTPStatus.SUCCESS_200_OK)
+
+
+
+class PlacesAutocompleteHandler(Resource):
+    """
+    API endpoint handler.
+    """
+    # HTTP methods allowed.
+    allowed_methods = ['GET']
+    
+    # Maximum number of Places (and cities) that can be requested.
+    max_results = AutocompleteIndex.TOP_SIZE
+    
+    def get(self, request):
+        """
+        Process GET request.
+        """
+        filters = {}
+        
+        ###
+        # Prefix (required).
+        try:
+            prefix = request.GET['q']
+            filters['q'] = prefix
         except KeyError:
-            pass
+            return Response(request=request,
+                            data={ 'message': 'Invalid parameters', 'parameters': { 'q': ['Invalid value'] } },
+                            serializer=None,
+                            status=HTTPStatus.CLIENT_ERROR_400_BAD_REQUEST)
+        
+        ###
+        # Number of Places and cities (defaults to 5).
+        try:
+            k = int(request.GET.get('k', 5))
+            if k <= 0 or k > self.max_results:
+                raise ValueError
+            filters['k'] = k
+        except ValueError:
+            return Response(request=request,
+                            data={ 'message': 'Invalid parameters', 'parameters': { 'k': ['Invalid value'] } },
+                            serializer=None,
+                            status=HTTPStatus.CLIENT_ERROR_400_BAD_REQUEST)
+        
+        #
+        # Return (best rated Places first, then cities with most Places first).
+        #
+        results = autocomplete_index.to_simple(prefix, k)
+        results['filters'] = filters
+        return Response(request=request,
+                        data=results,
+                        serializer=None,
+                        status=HTTPStatus.SUCCESS_200_OK)
+
+
+class PlacesClustersHandler(Resource):
+    """
+    API endpoint handler.
+    """
+    # HTTP methods allowed.
+    allowed_methods = ['GET']
+    
+    # Maximum number of tiles a single request can span.
+    max_tiles = 64
+    
+    def get(self, request):
+        """
+        Process GET request.
+        """
+        filters = {}
+        
+        ###
+        # Viewport bounds, i.e. south-west and north-east corners (required).
+        try:
+            bounds = [float(i) for i in request.GET['bounds'].split(',')]
+            if len(bounds) != 4 or abs(bounds[0]) > 90 or abs(bounds[2]) > 90 or bounds[0] > bounds[2]:
+                raise ValueError
+            bounds = ((bounds[0], bounds[1]), (bounds[2], bounds[3]))
+            filters['bounds'] = request.GET['bounds']
+        except (KeyError, ValueError):
+            return Response(request=request,
+                            data={ 'message': 'Invalid parameters', 'parameters': { 'bounds': ['Invalid value'] } },
+                            serializer=None,
+                            status=HTTPStatus.CLIENT_ERROR_400_BAD_REQUEST)
+        
+        ###
+        # Map zoom level (required).
+        try:
+            zoom = int(request.GET['zoom'])
+            if zoom < Clustering.min_zoom or zoom > Clustering.max_zoom:
+                raise ValueError
+            filters['zoom'] = zoom
+        except (KeyError, ValueError):
+            return Response(request=request,
+                            data={ 'message': 'Invalid parameters', 'parameters': { 'zoom': ['Invalid value'] } },
+                            serializer=None,
+                            status=HTTPStatus.CLIENT_ERROR_400_BAD_REQUEST)
+        
+        # Viewport can't be too big for the given zoom.
+        clustering = Clustering(zoom)
+        if len(clustering.tiles(bounds)) > self.max_tiles:
+            return Response(request=request,
+                            data={ 'message': 'Invalid parameters', 'parameters': { 'zoom': ['Too high for the given bounds'] } },
+                            serializer=None,
+                            status=HTTPStatus.CLIENT_ERROR_400_BAD_REQUEST)
         
         #
         # Return.
         #
+        results = clustering.viewport(bounds)
+        results['filters'] = filters
         return Response(request=request,
                         data=results,
-                        filters=filters,
-                        serializer=PlaceSerializer,
-                        pagination=pagination,
+                        serializer=None,
+                        status=HTTPStatus.SUCCESS_200_OK)
+
+
+
+class PlacesMarkersHandler(Resource):
+    """
+    API endpoint handler.
+    """
+    # HTTP methods allowed.
+    allowed_methods = ['GET']
+    
+    def get(self, request):
+        """
+        Process GET request.
+        """
+        ###
+        # Format, i.e. JSON (default) or binary.
+        output = request.GET.get('format', 'json')
+        try:
+            Markers.formats.keys().index(output)
+        except ValueError:
+            return Response(request=request,
+                            data={ 'message': 'Invalid parameters', 'parameters': { 'format': ['Invalid value'] } },
+                            serializer=None,
+                            status=HTTPStatus.CLIENT_ERROR_400_BAD_REQUEST)
+        markers = Markers(output)
+        
+        # Client already has the current feed.
+        etag = markers.get_etag()
+        if request.META.get('HTTP_IF_NONE_MATCH', None) == etag:
+            response = HttpResponse(status=HTTPStatus.REDIRECTION_304_NOT_MODIFIED)
+        
+        # Return (already encoded).
+        else:
+            response = HttpResponse(content=markers.get_content(),
+                                    status=HTTPStatus.SUCCESS_200_OK,
+                                    content_type=Markers.formats[markers.format])
+        response['ETag'] = etag
+        response['Cache-Control'] = 'no-cache'
+        return response
+
+
+
+class PlacesHeatmapHandler(Resource):
+    """
+    API endpoint handler.
+    """
+    # HTTP methods allowed.
+    allowed_methods = ['GET']
+    
+    # Maximum number of grid cells a single request can span.
+    max_cells = 10000
+    
+    def get(self, request):
+        """
+        Process GET request.
+        """
+        filters = {}
+        
+        ###
+        # Bounds, i.e. south-west and north-east corners (required).
+        try:
+            bounds = [float(i) for i in request.GET['bounds'].split(',')]
+            if len(bounds) != 4 or bounds[0] > bounds[2] or bounds[1] > bounds[3]:
+                raise ValueError
+            bounds = ((bounds[0], bounds[1]), (bounds[2], bounds[3]))
+            filters['bounds'] = request.GET['bounds']
+        except (KeyError, ValueError):
+            return Response(request=request,
+                            data={ 'message': 'Invalid parameters', 'parameters': { 'bounds': ['Invalid value'] } },
+                            serializer=None,
+                            status=HTTPStatus.CLIENT_ERROR_400_BAD_REQUEST)
+        
+        ###
+        # Grid resolution, in degrees (required).
+        try:
+            resolution = float(request.GET['resolution'])
+            if resolution <= 0:
+                raise ValueError
+            
+            # Limit the size of the grid.
+            rows = (bounds[1][0] - bounds[0][0]) / resolution + 1
+            columns = (bounds[1][1] - bounds[0][1]) / resolution + 1
+            if rows * columns > self.max_cells:
+                raise ValueError
+            filters['resolution'] = resolution
+        except (KeyError, ValueError):
+            return Response(request=request,
+                            data={ 'message': 'Invalid parameters', 'parameters': { 'resolution': ['Invalid value'] } },
+                            serializer=None,
+                            status=HTTPStatus.CLIENT_ERROR_400_BAD_REQUEST)
+        
+        #
+        # Return.
+        #
+        return Response(request=request,
+                        data={ 'cells': Place.aggregate_grid(bounds, resolution, Place.objects.filter(active=True)), 'filters': filters },
+                        serializer=None,
                         status=HTTPStatus.SUCCESS_200_OK)
         
         
@@ -218,9 +578,24 @@ class PlaceIdHandler(Resource):
         """
         Process GET request.
         """
+        ###
+        # Optionally, only some fields can be requested (and fetched).
+        try:
+            serializer = PlaceSerializer(fields=PlaceSerializer.parse_fields(request.GET.get('fields', '')))
+        except ValueError:
+            return Response(request=request,
+                            data={ 'message': 'Invalid parameters', 'parameters': { 'fields': ['Invalid value'] } },
+                            serializer=None,
+                            status=HTTPStatus.CLIENT_ERROR_400_BAD_REQUEST)
+        
+        if request.auth:
+            user = request.auth['user']
+        else:
+            user = None
+        
         # Check if instance with given ID exists.
         try:
-            instance = Place.objects.get(pk=pk)
+            instance = serializer.prepare(Place.objects.all(), user).get(pk=pk)
         except ObjectDoesNotExist:
             return HttpResponse(status=HTTPStatus.CLIENT_ERROR_404_NOT_FOUND)
         
@@ -233,7 +608,7 @@ class PlaceIdHandler(Resource):
         # Return.
         return Response(request=request,
                         data=instance,
-                        serializer=PlaceSerializer,
+                        serializer=serializer,
                         status=HTTPStatus.SUCCESS_200_OK)
     
     @authentication_classes([SessionAuthentication, ApiKeyAuthentication])
@@ -272,6 +647,54 @@ class PlaceIdHandler(Resource):
                             status=HTTPStatus.CLIENT_ERROR_400_BAD_REQUEST)
 
 
+
+class PlaceNearbyHandler(Resource):
+    """
+    API endpoint handler.
+    """
+    # HTTP methods allowed.
+    allowed_methods = ['GET']
+    
+    def get(self, request, pk):
+        """
+        Process GET request.
+        """
+        # Check if Place with given ID exists.
+        try:
+            place = Place.objects.get(pk=pk)
+        except ObjectDoesNotExist:
+            return HttpResponse(status=HTTPStatus.CLIENT_ERROR_404_NOT_FOUND)
+        
+        # **************** IMPORTANT ***************
+        # Only _staff_ users can access stuff of inactive places.
+        # ******************************************
+        if not place.active and (not request.user or not request.user.is_staff):
+            return HttpResponse(status=HTTPStatus.CLIENT_ERROR_404_NOT_FOUND)
+        
+        if request.auth:
+            user = request.auth['user']
+        else:
+            user = None
+        serializer = PlaceSerializer()
+        
+        # Precomputed neighbours, nearest first.
+        neighbours = list(place.neighbours.values_list('neighbour', 'distance'))
+        places = serializer.prepare(Place.objects.all(), user).in_bulk([pk for pk, distance in neighbours])
+        results = []
+        for pk, distance in neighbours:
+            if pk in places:
+                places[pk].distance_km = distance
+                results.append(places[pk])
+        
+        #
+        # Return.
+        #
+        return Response(request=request,
+                        data={ 'collection': serializer.to_simple_many(results, user) },
+                        serializer=None,
+                        status=HTTPStatus.SUCCESS_200_OK)
+
+
 class PhotosHandler(Resource):
     """
     API endpoint handler.
@@ -300,20 +723,21 @@ class PhotosHandler(Resource):
         # Provided data is valid.
         if form.is_valid():
             
-            # Save photo.
+            # Save photo (processed in the background).
             try:
                 photo = Photo.new(place=place, photo_file=form.cleaned_data['file'], user=request.auth['user'])
+                get_photo_processor().submit(photo)
             except IOError:
                 return Response(request=request,
                             data={ 'message': 'Error uploading place photo #1' },
                             serializer=None,
                             status=HTTPStatus.SERVER_ERROR_500_INTERNAL_SERVER_ERROR)    
             
-            # Return.
+            # Return (the photo's state tells when it's ready).
             return Response(request=request,
                             data=photo,
                             serializer=PhotoSerializer,
-                            status=HTTPStatus.SUCCESS_201_CREATED)
+                            status=HTTPStatus.SUCCESS_202_ACCEPTED)
         
         # Form didn't validate!
         else:
@@ -338,6 +762,16 @@ class PhotosHandler(Resource):
         if not place.active and (not request.user or not request.user.is_staff):
             return HttpResponse(status=HTTPStatus.CLIENT_ERROR_404_NOT_FOUND)
         
+        ###
+        # Optionally, only some fields can be requested (and fetched).
+        try:
+            serializer = PhotoSerializer(fields=PhotoSerializer.parse_fields(request.GET.get('fields', '')))
+        except ValueError:
+            return Response(request=request,
+                            data={ 'message': 'Invalid parameters', 'parameters': { 'fields': ['Invalid value'] } },
+                            serializer=None,
+                            status=HTTPStatus.CLIENT_ERROR_400_BAD_REQUEST)
+        
         # Lets start with all.
         results = place.photo_set.all()
         
@@ -346,7 +780,7 @@ class PhotosHandler(Resource):
         #
         return Response(request=request,
                         data=results,
-                        serializer=PhotoSerializer,
+                        serializer=serializer,
                         status=HTTPStatus.SUCCESS_200_OK)
 
 
@@ -462,7 +896,7 @@ class ReviewsHandler(Resource):
             # Provided data is valid.
             if review_form.is_valid() and photo_form.is_valid():
                 
-                # Save photo.
+                # Save photo (processed in the background).
                 try:
                     photo = Photo.new(place=place, photo_file=photo_form.cleaned_data['file'], user=request.auth['user'])
                     
@@ -472,12 +906,13 @@ class ReviewsHandler(Resource):
                     # Link photo.
                     review.photo = photo
                     review.save()
+                    get_photo_processor().submit(photo)
                     
-                    # Return.
+                    # Return (the photo's state tells when it's ready).
                     return Response(request=request,
                                     data=review,
                                     serializer=ReviewSerializer,
-                                    status=HTTPStatus.SUCCESS_201_CREATED)
+                                    status=HTTPStatus.SUCCESS_202_ACCEPTED)
                     
                 except IOError:
                     return Response(request=request,
@@ -508,15 +943,54 @@ class ReviewsHandler(Resource):
         if not place.active and (not request.user or not request.user.is_staff):
             return HttpResponse(status=HTTPStatus.CLIENT_ERROR_404_NOT_FOUND)
         
+        ###
+        # Optionally, only some fields can be requested (and fetched).
+        try:
+            serializer = ReviewSerializer(fields=ReviewSerializer.parse_fields(request.GET.get('fields', '')))
+        except ValueError:
+            return Response(request=request,
+                            data={ 'message': 'Invalid parameters', 'parameters': { 'fields': ['Invalid value'] } },
+                            serializer=None,
+                            status=HTTPStatus.CLIENT_ERROR_400_BAD_REQUEST)
+        
         # Lets start with all.
         results = place.review_set.all()
         
+        ###
+        # Optionally, results can be paginated with cursors instead of page numbers (an empty cursor for the first
+        # page, followed by the returned 'next'/'prev' ones), in which case counting all of them is optional.
+        cursor = request.GET.get('cursor', None)
+        try:
+            total = request.GET.get('total', 'false')
+            ['true', 'false'].index(total)
+            total = (total.lower() == 'true')
+        except ValueError:
+            return Response(request=request,
+                            data={ 'message': 'Invalid parameters', 'parameters': { 'total': ['Invalid value'] } },
+                            serializer=None,
+                            status=HTTPStatus.CLIENT_ERROR_400_BAD_REQUEST)
+        
         #
         # Return.
         #
+        if cursor is not None:
+            if request.auth:
+                user = request.auth['user']
+            else:
+                user = None
+            try:
+                return Response(request=request,
+                                data=CursorPaginator(('-date', '-id'), serializer=serializer).get_results(request, results, user, None, total),
+                                serializer=None,
+                                status=HTTPStatus.SUCCESS_200_OK)
+            except ValueError:
+                return Response(request=request,
+                                data={ 'message': 'Invalid parameters', 'parameters': { 'cursor': ['Invalid value'] } },
+                                serializer=None,
+                                status=HTTPStatus.CLIENT_ERROR_400_BAD_REQUEST)
         return Response(request=request,
                         data=results,
-                        serializer=ReviewSerializer,
+                        serializer=serializer,
                         status=HTTPStatus.SUCCESS_200_OK)
         
         
@@ -1,129 +1,380 @@
 import logging
 from django.conf import settings
+from django.core.cache import cache
+from django.core.paginator import Page
 from django.core.urlresolvers import reverse
+from django.db.models.query import QuerySet
 from django.utils.text import slugify
 from yapi.serializers import BaseSerializer
 
+from yplaces import imaging
+from yplaces.instrumentation import timed
+from yplaces.models import place_generation
+from yplaces.versions import Generation
+
 # Instantiate logger.
 logger = logging.getLogger(__name__)
 
 
-class PlaceSerializer(BaseSerializer):
+class UrlTemplate(object):
     """
-    Adds methods required for instance serialization.
+    Absolute URL reversed only once (with placeholder arguments), which can then be built for any arguments
+    with simple string formatting.
     """
+    
+    # Templates already compiled, by URL name.
+    templates = {}
+    
+    # Placeholder for the N-th argument (must be matched by the URL patterns' numeric groups).
+    placeholder = '9081726354%d'
+    
+    def __init__(self, name, count):
+        """
+        Constructor.
+        """
+        placeholders = [self.placeholder % i for i in range(count)]
+        template = (settings.HOST_URL + reverse(settings.YPLACES['api_url_namespace'] + ':yplaces:' + name, args=placeholders)).replace('%', '%%')
+        for placeholder in placeholders:
+            template = template.replace(placeholder, '%s', 1)
+        self.template = template
+    
+    @classmethod
+    def get(cls, name, count=1):
+        """
+        Returns the (compiled) template of the given URL name.
+        """
+        if name not in cls.templates:
+            cls.templates[name] = UrlTemplate(name, count)
+        return cls.templates[name]
+    
+    def build(self, *args):
+        """
+        Returns the URL for the given arguments.
+        """
+        return self.template % args
+
+
+class BatchSerializer(BaseSerializer):
+    """
+    Serializer that serializes collections (QuerySets or Pages) with a fixed number of queries, by fetching
+    the relations used by to_simple() along with the objects.
+    
+    Only some of the fields can be serialized (e.g. MySerializer(fields=['id', 'name'])), in which case only
+    the columns and relations they require are fetched.
+    """
+    
+    # Fields to serialize (None for all).
+    fields = None
+    
+    # Model columns and relations required by each field (the primary key is always fetched).
+    field_columns = {}
+    field_relations = {}
+    
+    # Columns always fetched and fields only serialized for staff users.
+    required_columns = ()
+    staff_fields = ()
+    
+    @classmethod
+    def parse_fields(cls, value):
+        """
+        Parses a comma separated list of field names (e.g. from the request's parameters), returning None if empty.
+        Raises ValueError for unknown fields.
+        """
+        if value == '':
+            return None
+        fields = value.split(',')
+        for field in fields:
+            if field not in cls.field_columns:
+                raise ValueError
+        return fields
+    
+    def get_fields(self, user=None):
+        """
+        Returns the set of fields to serialize for the given user.
+        """
+        fields = set(self.fields or self.field_columns.keys())
+        if not user or not user.is_staff:
+            fields.difference_update(self.staff_fields)
+        return fields
+    
+    def prepare(self, queryset, user=None):
+        """
+        Returns the given QuerySet, fetching the columns and relations required to serialize its objects.
+        """
+        columns = set(self.required_columns)
+        relations = set()
+        for field in self.get_fields(user):
+            columns.update(self.field_columns[field])
+            relations.update(self.field_relations.get(field, ()))
+        
+        # Only defer columns if some fields were left out.
+        if self.fields:
+            queryset = queryset.only(*columns)
+        if relations:
+            queryset = queryset.select_related(*relations)
+        return queryset
+    
+    def to_simple_many(self, data, user=None):
+        """
+        Serializes the given QuerySet, Page or list of objects.
+        """
+        if isinstance(data, Page):
+            data = data.object_list
+        if isinstance(data, QuerySet):
+            data = self.prepare(data, user)
+        objects = list(data)
+        with timed('serialization'):
+            return [self.to_simple(obj, user) for obj in objects]
+    
+    def serialize(self, data, user=None):
+        """
+        Please refer to the interface documentation.
+        """
+        # Data is a QuerySet.
+        if isinstance(data, QuerySet) or isinstance(data, Page):
+            return self.to_simple_many(data, user)
         
+        # Data is an Object instance.
+        else:
+            with timed('serialization'):
+                return self.to_simple(data, user)
+
+
+class PlaceSerializer(BatchSerializer):
+    """
+    Adds methods required for instance serialization.
+    
+    Settings (YPLACES):
+        place_cache_timeout: For how long (seconds) the Places' full representations are cached (default: 0, i.e. not cached).
+                             They are invalidated whenever the Place, its rating, photos or reviews change.
+    """
+    # Fields serialized as they are.
+    model_fields = ('name', 'address', 'postal_code', 'city', 'state', 'country', 'latitude', 'longitude',
+                    'email', 'phone_number', 'website', 'description', 'active')
+    
+    field_columns = dict([(field, (field,)) for field in model_fields] + [
+        ('id', ()), ('url', ()), ('slug', ('name',)), ('photos', ()), ('reviews', ()), ('nearby', ()), ('rating', ()),
+        ('profile_image_url', ()), ('marker_image_url', ()), ('distance_km', ()), ('relevance', ()),
+        ('created_at', ('created_at',)), ('created_by', ('created_by',))
+    ])
+    field_relations = { 'rating': ('rating',), 'created_by': ('created_by',) }
+    required_columns = ('active',)
+    staff_fields = ('created_at', 'created_by', 'active')
+    
+    # Fields that depend on the request (i.e. calculated by the search), serialized when present.
+    search_fields = ('distance_km', 'relevance')
+    
     def to_simple(self, obj, user=None):
         """
         Please refer to the interface documentation.
         """
+        fields = self.get_fields(user)
+        
         # Build response.
-        simple = {
-            'id': obj.pk,
-            'url': settings.HOST_URL + reverse(settings.YPLACES['api_url_namespace'] + ':yplaces:id', args=[obj.pk]),
-            'name': obj.name,
-            'slug': slugify(obj.name),
-            'address': obj.address,
-            'postal_code': obj.postal_code,
-            'city': obj.city,
-            'state': obj.state,
-            'country': obj.country,
-            'latitude': obj.latitude,
-            'longitude': obj.longitude,
-            'email': obj.email,
-            'phone_number': obj.phone_number,
-            'website': obj.website,
-            'description': obj.description,
-            'photos': {
-                'url': settings.HOST_URL + reverse(settings.YPLACES['api_url_namespace'] + ':yplaces:photos', args=[obj.pk])
-            },
-            'reviews': {
-                'url': settings.HOST_URL + reverse(settings.YPLACES['api_url_namespace'] + ':yplaces:reviews', args=[obj.pk])
-            },
-            'rating': obj.get_rating_value(),
-            'profile_image_url': settings.HOST_URL + settings.STATIC_URL + 'yplaces/images/default_place_picture.png',
-            'marker_image_url': obj.get_marker_image_url()
-        }
+        simple = dict([(field, getattr(obj, field)) for field in self.model_fields if field in fields])
+        if 'id' in fields:
+            simple['id'] = obj.pk
+        if 'url' in fields:
+            simple['url'] = UrlTemplate.get('id').build(obj.pk)
+        if 'slug' in fields:
+            simple['slug'] = slugify(obj.name)
+        if 'photos' in fields:
+            simple['photos'] = { 'url': UrlTemplate.get('photos').build(obj.pk) }
+        if 'reviews' in fields:
+            simple['reviews'] = { 'url': UrlTemplate.get('reviews').build(obj.pk) }
+        if 'nearby' in fields:
+            simple['nearby'] = { 'url': UrlTemplate.get('nearby').build(obj.pk) }
+        if 'rating' in fields:
+            simple['rating'] = obj.get_rating_value()
+        if 'profile_image_url' in fields:
+            simple['profile_image_url'] = settings.HOST_URL + settings.STATIC_URL + 'yplaces/images/default_place_picture.png'
+        if 'marker_image_url' in fields:
+            simple['marker_image_url'] = obj.get_marker_image_url()
+        
+        # Distance to the searched coordinates (i.e. radius search) and relevance, when calculated by the search.
+        for field in self.search_fields:
+            if field in fields and hasattr(obj, field):
+                simple[field] = getattr(obj, field)
         
         # If user is staff, add aditional info.
-        if user and user.is_staff:
-            simple.update({
-                'created_at': obj.created_at.strftime('%Y-%m-%d %H:%M:%S'),
-                'created_by': {
-                    'email': obj.created_by.email
-                },
-                'active': obj.active
-            })
+        if 'created_at' in fields:
+            simple['created_at'] = obj.created_at.strftime('%Y-%m-%d %H:%M:%S')
+        if 'created_by' in fields:
+            simple['created_by'] = { 'email': obj.created_by.email }
         
         # Return.
         return simple
+    
+    def to_simple_many(self, data, user=None):
+        """
+        Please refer to the interface documentation. When enabled, the (full) representations are fetched from
+        the cache at once, and only the missing ones are serialized.
+        """
+        timeout = settings.YPLACES.get('place_cache_timeout', 0)
+        if not timeout or self.fields:
+            return super(PlaceSerializer, self).to_simple_many(data, user)
+        
+        if isinstance(data, Page):
+            data = data.object_list
+        if isinstance(data, QuerySet):
+            data = self.prepare(data, user)
+        places = list(data)
+        with timed('serialization'):
+            return self.to_simple_cached(places, user, timeout)
+    
+    def to_simple_cached(self, places, user, timeout):
+        """
+        Returns the representations of the given Places, fetched from the cache at once (serializing only the missing ones).
+        """
+        # Cache keys, from the Places' current generations (and the user's representation).
+        variant = 'staff' if user and user.is_staff else 'public'
+        generations = Generation.get_many([place_generation(place.pk) for place in places])
+        keys = ['yplaces:place:%d:%d:%s' % (place.pk, generation, variant) for place, generation in zip(places, generations)]
+        cached = cache.get_many(keys)
+        
+        # Serialize (and cache) the missing ones.
+        missing = {}
+        for place, key in zip(places, keys):
+            if key not in cached:
+                simple = self.to_simple(place, user)
+                for field in self.search_fields:
+                    simple.pop(field, None)
+                missing[key] = simple
+        if missing:
+            cache.set_many(missing, timeout)
+            cached.update(missing)
+        
+        # Return (with the fields that depend on the request).
+        results = []
+        for place, key in zip(places, keys):
+            simple = dict(cached[key])
+            for field in self.search_fields:
+                if hasattr(place, field):
+                    simple[field] = getattr(place, field)
+            results.append(simple)
+        return results
 
 
-class PhotoSerializer(BaseSerializer):
+class PhotoSerializer(BatchSerializer):
     """
     Adds methods required for instance serialization.
     """
-        
+    field_columns = { 'id': (), 'url': (), 'image_url': ('file',), 'sizes': ('file', 'width', 'state'), 'srcset': ('file', 'width', 'state'),
+                      'formats': ('file', 'width', 'state', 'formats'), 'state': ('state',), 'added_by': ('added_by',), 'added_at': ('added_at',) }
+    field_relations = { 'added_by': ('added_by',) }
+    required_columns = ('place',)
+    
+    @staticmethod
+    def formats_to_simple(photo):
+        """
+        Returns the formats the given Photo is available in (in order of preference), with the MIME type and renditions
+        of each one.
+        """
+        simple = []
+        for name in photo.get_formats():
+            sizes = photo.get_size_urls(name)
+            simple.append({
+                'format': name,
+                'type': imaging.FORMATS[name][1],
+                'sizes': dict([(str(width), url) for width, url in sizes]),
+                'srcset': ', '.join(['%s %dw' % (url, width) for width, url in sizes])
+            })
+        return simple
+    
     def to_simple(self, obj, user=None):
         """
         Please refer to the interface documentation.
         """
+        fields = self.get_fields(user)
+        
         # Build response.
-        simple = {
-            'id': obj.pk,
-            'url': settings.HOST_URL + reverse(settings.YPLACES['api_url_namespace'] + ':yplaces:photo_id', args=[obj.place.pk, obj.pk]),
-            'image_url': obj.file.url,
-            'added_by': {
+        simple = {}
+        if 'id' in fields:
+            simple['id'] = obj.pk
+        if 'url' in fields:
+            simple['url'] = UrlTemplate.get('photo_id', 2).build(obj.place_id, obj.pk)
+        if 'image_url' in fields:
+            simple['image_url'] = obj.file.url
+        if 'sizes' in fields or 'srcset' in fields:
+            sizes = obj.get_size_urls()
+            if 'sizes' in fields:
+                simple['sizes'] = dict([(str(width), url) for width, url in sizes])
+            if 'srcset' in fields:
+                simple['srcset'] = ', '.join(['%s %dw' % (url, width) for width, url in sizes])
+        if 'formats' in fields:
+            simple['formats'] = PhotoSerializer.formats_to_simple(obj)
+        if 'state' in fields:
+            simple['state'] = obj.get_state()
+        if 'added_by' in fields:
+            simple['added_by'] = {
                 'name': obj.added_by.name,
                 'photo_url': obj.added_by.get_photo_url()
-            },
-            'added_at': obj.added_at.strftime('%Y-%m-%d %H:%M:%S')
-        }
+            }
+        if 'added_at' in fields:
+            simple['added_at'] = obj.added_at.strftime('%Y-%m-%d %H:%M:%S')
         
         # Return.
         return simple
-    
-    
-class ReviewSerializer(BaseSerializer):
+
+
+class ReviewSerializer(BatchSerializer):
     """
     Adds methods required for instance serialization.
     """
-        
+    field_columns = { 'id': (), 'url': (), 'user': ('user',), 'date': ('date',), 'rating': ('rating',), 'comment': ('comment',),
+                      'photo': ('photo',), 'place': () }
+    field_relations = { 'user': ('user',), 'photo': ('photo',), 'place': ('place__rating',) }
+    required_columns = ('place',)
+    
     def to_simple(self, obj, user=None):
         """
         Please refer to the interface documentation.
         """
+        fields = self.get_fields(user)
+        
         # Build response.
-        simple = {
-            'id': obj.pk,
-            'url': settings.HOST_URL + reverse(settings.YPLACES['api_url_namespace'] + ':yplaces:review_id', args=[obj.place.pk, obj.pk]),
-            'user': {
+        simple = {}
+        if 'id' in fields:
+            simple['id'] = obj.pk
+        if 'url' in fields:
+            simple['url'] = UrlTemplate.get('review_id', 2).build(obj.place_id, obj.pk)
+        if 'user' in fields:
+            simple['user'] = {
                 'name': obj.user.name,
                 'photo_url': obj.user.get_photo_url()
-            },
-            'date': obj.date.strftime('%Y-%m-%d %H:%M:%S'),
-            'rating': obj.rating,
-            'comment': obj.comment,
-            'photo': None,
-            'place': {
-                'name': obj.place.name,
-                'url': settings.HOST_URL + reverse(settings.YPLACES['api_url_namespace'] + ':yplaces:id', args=[obj.place.pk]),
-                'rating': { 'average': 0, 'reviews': 0 }
             }
-        }
+        if 'date' in fields:
+            simple['date'] = obj.date.strftime('%Y-%m-%d %H:%M:%S')
+        if 'rating' in fields:
+            simple['rating'] = obj.rating
+        if 'comment' in fields:
+            simple['comment'] = obj.comment
         
         # Review's photo.
-        if obj.photo:
-            simple['photo'] = {
-                'id': obj.photo.pk,
-                'url': settings.HOST_URL + reverse(settings.YPLACES['api_url_namespace'] + ':yplaces:photo_id', args=[obj.place.pk, obj.photo.pk]),
-                'image_url': obj.photo.file.url
-            }
+        if 'photo' in fields:
+            simple['photo'] = None
+            if obj.photo_id:
+                simple['photo'] = {
+                    'id': obj.photo_id,
+                    'url': UrlTemplate.get('photo_id', 2).build(obj.place_id, obj.photo_id),
+                    'image_url': obj.photo.file.url,
+                    'state': obj.photo.get_state()
+                }
+                sizes = obj.photo.get_size_urls()
+                simple['photo']['sizes'] = dict([(str(width), url) for width, url in sizes])
+                simple['photo']['srcset'] = ', '.join(['%s %dw' % (url, width) for width, url in sizes])
+                simple['photo']['formats'] = PhotoSerializer.formats_to_simple(obj.photo)
         
-        # Place's rating.
-        rating = obj.place.get_rating()
-        if rating:
-            simple['place']['rating'] = { 'average': rating.average, 'reviews': rating.reviews }
+        # Place (and its rating).
+        if 'place' in fields:
+            simple['place'] = {
+                'name': obj.place.name,
+                'url': UrlTemplate.get('id').build(obj.place_id),
+                'rating': { 'average': 0, 'reviews': 0 }
+            }
+            rating = obj.place.get_rating()
+            if rating:
+                simple['place']['rating'] = { 'average': rating.average, 'reviews': rating.reviews }
         
         # Return.
-        return simple
\ No newline at end of file
+        return simple
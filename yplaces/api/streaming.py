@@ -0,0 +1,90 @@
+import json
+import logging
+from django.http.response import StreamingHttpResponse
+
+# Instantiate logger.
+logger = logging.getLogger(__name__)
+
+
+def iterate_batches(queryset, batch_size):
+    """
+    Iterates over the given QuerySet in batches (lists) of at most the given size, so that only one batch is in
+    memory at a time. Unordered QuerySets are walked by primary key (i.e. WHERE pk > last ORDER BY pk LIMIT size),
+    whose cost doesn't grow with the position; ordered ones are sliced.
+    """
+    # Keyset.
+    if not queryset.ordered:
+        queryset = queryset.order_by('pk')
+        last = None
+        while True:
+            if last is None:
+                batch = list(queryset[:batch_size])
+            else:
+                batch = list(queryset.filter(pk__gt=last)[:batch_size])
+            if batch:
+                yield batch
+            if len(batch) < batch_size:
+                return
+            last = batch[-1].pk
+    
+    # Offset.
+    else:
+        start = 0
+        while True:
+            batch = list(queryset[start:start + batch_size])
+            if batch:
+                yield batch
+            if len(batch) < batch_size:
+                return
+            start += batch_size
+
+
+class StreamingResponse(StreamingHttpResponse):
+    """
+    Streams a QuerySet, serialized in batches, either as a JSON array (the same content as a non paginated
+    response) or as newline delimited JSON (one object per line), so that memory stays flat whatever its size.
+    """
+    
+    # Formats and respective content types.
+    formats = {
+        'json': 'application/json',
+        'ndjson': 'application/x-ndjson'
+    }
+    
+    # Number of objects fetched and serialized at a time.
+    batch_size = 500
+    
+    def __init__(self, request, data, serializer, status, format='json'):
+        """
+        Constructor.
+        """
+        # Check if serializer is instantiated.
+        if isinstance(serializer, type):
+            serializer = serializer()
+        
+        # If request was authenticated, fetch respective user.
+        if request.auth:
+            user = request.auth['user']
+        else:
+            user = None
+        
+        super(StreamingResponse, self).__init__(streaming_content=self.stream(data, serializer, user, format),
+                                                status=status,
+                                                content_type=self.formats[format])
+    
+    def stream(self, data, serializer, user, format):
+        """
+        Yields the encoded objects, batch by batch.
+        """
+        first = True
+        if format == 'json':
+            yield '['
+        for batch in iterate_batches(serializer.prepare(data, user), self.batch_size):
+            chunk = [json.dumps(simple) for simple in serializer.to_simple_many(batch, user)]
+            if format == 'json':
+                yield ('' if first else ',') + ','.join(chunk)
+            else:
+                yield '\n'.join(chunk) + '\n'
+            first = False
+        if format == 'json':
+            yield ']'
@@ -1,12 +1,18 @@
 from django.conf.urls import patterns, url
 
-from handlers import PlacesHandler, PlaceIdHandler, ReviewsHandler, ReviewIdHandler, PhotosHandler, PhotoIdHandler
+from handlers import PlacesHandler, PlacesNearestHandler, PlacesAutocompleteHandler, PlacesClustersHandler, PlacesMarkersHandler, PlacesHeatmapHandler, PlaceIdHandler, PlaceNearbyHandler, ReviewsHandler, ReviewIdHandler, PhotosHandler, PhotoIdHandler
 
 urlpatterns = patterns('',
                        
     # Places.
     url(r'^/?$', PlacesHandler.as_view(), name='index'),
+    url(r'^/nearest/?$', PlacesNearestHandler.as_view(), name='nearest'),
+    url(r'^/autocomplete/?$', PlacesAutocompleteHandler.as_view(), name='autocomplete'),
+    url(r'^/clusters/?$', PlacesClustersHandler.as_view(), name='clusters'),
+    url(r'^/markers/?$', PlacesMarkersHandler.as_view(), name='markers'),
+    url(r'^/heatmap/?$', PlacesHeatmapHandler.as_view(), name='heatmap'),
     url(r'^/(?P<pk>[0-9]+)/?$', PlaceIdHandler.as_view(), name='id'),
+    url(r'^/(?P<pk>[0-9]+)/nearby/?$', PlaceNearbyHandler.as_view(), name='nearby'),
     url(r'^/(?P<pk>[0-9]+)/photos/?$', PhotosHandler.as_view(), name='photos'),
     url(r'^/(?P<pk>[0-9]+)/photos/(?P<photo_pk>[0-9]+)/?$', PhotoIdHandler.as_view(), name='photo_id'),
     url(r'^/(?P<pk>[0-9]+)/reviews/?$', ReviewsHandler.as_view(), name='reviews'),
@@ -0,0 +1,220 @@
+import bisect
+import heapq
+import logging
+import threading
+import time
+from array import array
+from django.db.models.signals import post_delete, post_save
+from django.utils.text import slugify
+
+from models import Place, Rating, places_generation, ratings_generation
+from utils import Text
+from versions import Generation
+
+# Instantiate logger.
+logger = logging.getLogger(__name__)
+
+
+class AutocompleteIndex(object):
+    """
+    Process-local index that answers "which are the best rated active Places (and the cities with most Places) whose
+    name has a word that starts with this prefix".
+    
+    Each Place is keyed by its (accent folded) name from the start of each of its words, and all keys are kept in a
+    sorted list (with the respective Place IDs in a parallel array), so that the keys with a given prefix are a range
+    found by binary search. As the ranges of short prefixes are long, their best Places are precomputed. Changes made in
+    this process are applied incrementally (like in 'yplaces.spatial.NearestIndex'), changes made by other processes are
+    detected through the Places' generation, and ranks (i.e. relative ratings) are refreshed at most once per
+    RANK_REFRESH seconds after ratings change. Cities are only refreshed on rebuilds.
+    """
+    
+    # Rebuild when the pending changes exceed this fraction of the indexed Places (or the minimum below).
+    REBUILD_RATIO = 0.1
+    REBUILD_MINIMUM = 64
+    
+    # Minimum interval (seconds) between rebuilds caused by rating changes.
+    RANK_REFRESH = 60
+    
+    # Prefixes up to this length have their best Places precomputed (up to TOP_SIZE).
+    PRECOMPUTED = 2
+    TOP_SIZE = 20
+    
+    # Keys (and prefixes) are truncated to this length.
+    MAX_KEY_LENGTH = 32
+    
+    def __init__(self):
+        """
+        Constructor.
+        """
+        self.lock = threading.RLock()
+        self.generation = None
+        self.ratings_generation = None
+        self.built_at = 0
+        self.places = {}
+        self.keys = []
+        self.key_places = array('l')
+        self.top = {}
+        self.city_keys = []
+        self.cities = []
+        self.overflow = {}
+        self.removed = set()
+    
+    def get_keys(self, name):
+        """
+        Returns the keys of the given Place name (i.e. the folded name from the start of each of its words).
+        """
+        words = Text.fold(name).split()
+        return set([' '.join(words[i:])[:self.MAX_KEY_LENGTH] for i in range(len(words))])
+    
+    def build(self):
+        """
+        (Re)builds the index with all active Places.
+        """
+        with self.lock:
+            generation, ratings = Generation.get_many([places_generation, ratings_generation])
+            places = {}
+            keys = []
+            cities = {}
+            for pk, name, city, country, rank in Place.objects.filter(active=True).values_list('pk', 'name', 'city', 'country', 'rating__' + Rating.get_ranking_field()).iterator():
+                places[pk] = (name, city, country, rank or 0)
+                keys.extend([(key, pk) for key in self.get_keys(name)])
+                entry = cities.setdefault((city, country), [Text.fold(city), 0])
+                entry[1] += 1
+            keys.sort()
+            
+            # Store.
+            self.places = places
+            self.keys = [key for key, pk in keys]
+            self.key_places = array('l', [pk for key, pk in keys])
+            self.top = {}
+            for start in range(len(self.keys)):
+                for length in range(self.PRECOMPUTED + 1):
+                    prefix = self.keys[start][:length]
+                    if prefix not in self.top:
+                        self.top[prefix] = self.best(set(self.key_places[start:self.range(prefix)[1]]), self.TOP_SIZE)
+            cities = sorted([(key, count, city, country) for (city, country), (key, count) in cities.items()])
+            self.city_keys = [city[0] for city in cities]
+            self.cities = [city[1:] for city in cities]
+            self.overflow = {}
+            self.removed = set()
+            self.generation = generation
+            self.ratings_generation = ratings
+            self.built_at = time.time()
+            logger.debug('Autocomplete index built with ' + str(len(places)) + ' places (generation ' + str(generation) + ')')
+    
+    def is_stale(self):
+        """
+        Checks if the index was never built, if other processes changed the Places, if enough changes are pending or
+        if ratings changed since the last refresh of the ranks.
+        """
+        if self.generation is None:
+            return True
+        generation, ratings = Generation.get_many([places_generation, ratings_generation])
+        pending = len(self.overflow) + len(self.removed)
+        return self.generation != generation or pending > max(self.REBUILD_MINIMUM, self.REBUILD_RATIO * len(self.places)) or \
+            (self.ratings_generation != ratings and time.time() - self.built_at > self.RANK_REFRESH)
+    
+    def update(self, pk, name=None, city=None, country=None, active=False):
+        """
+        Applies the change of a single Place, made by this process.
+        """
+        with self.lock:
+            # Nothing to update.
+            if self.generation is None:
+                return
+            
+            # The change has already bumped the generation (see 'yplaces.spatial.NearestIndex.update').
+            generation = places_generation.get()
+            if generation != self.generation + 1:
+                self.generation = None
+                return
+            self.generation = generation
+            
+            # Apply change (keeping the Place's rank).
+            rank = self.places.pop(pk, (None, None, None, 0))[3]
+            self.removed.add(pk)
+            self.overflow.pop(pk, None)
+            if active:
+                self.places[pk] = (name, city, country, rank)
+                self.overflow[pk] = self.get_keys(name)
+    
+    def range(self, prefix):
+        """
+        Returns the (start, end) range of the keys that start with the given prefix.
+        """
+        return (bisect.bisect_left(self.keys, prefix), bisect.bisect_left(self.keys, prefix + '\xff'))
+    
+    def best(self, pks, k):
+        """
+        Returns the k best ranked of the given Place IDs (best first).
+        """
+        return heapq.nlargest(k, pks, key=lambda pk: (self.places[pk][3], -pk))
+    
+    def complete(self, prefix, k, cities_k=None):
+        """
+        Returns the k best ranked Places (as (ID, name, city, country) tuples) and the cities_k (defaults to k) cities
+        with most Places (as (name, country, Places) tuples) that match the given prefix.
+        """
+        with self.lock:
+            if self.is_stale():
+                self.build()
+            
+            prefix = ' '.join(Text.fold(prefix).split())[:self.MAX_KEY_LENGTH]
+            removed = self.removed
+            
+            # Places: precomputed (unless too many of them were removed since), or from the range of the prefix's keys.
+            pks = None
+            top = self.top.get(prefix, None)
+            if len(prefix) <= self.PRECOMPUTED and top is not None:
+                pks = [pk for pk in top if pk not in removed]
+                if len(pks) < k and len(top) == self.TOP_SIZE:
+                    pks = None
+            if pks is None:
+                start, end = self.range(prefix)
+                pks = [pk for pk in set(self.key_places[start:end]) if pk not in removed]
+            
+            # Pending changes.
+            for pk, keys in self.overflow.items():
+                for key in keys:
+                    if key.startswith(prefix):
+                        pks.append(pk)
+                        break
+            places = [(pk,) + self.places[pk][:3] for pk in self.best(pks, k)]
+            
+            # Cities.
+            start = bisect.bisect_left(self.city_keys, prefix)
+            end = bisect.bisect_left(self.city_keys, prefix + '\xff')
+            cities = heapq.nlargest(k if cities_k is None else cities_k, self.cities[start:end])
+            
+            # Return.
+            return (places, [(city, country, count) for count, city, country in cities])
+    
+    def to_simple(self, prefix, k, cities_k=None):
+        """
+        Returns the results of the given prefix, ready to be serialized.
+        """
+        places, cities = self.complete(prefix, k, cities_k)
+        return {
+            'places': [{ 'id': pk, 'name': name, 'slug': slugify(name), 'city': city, 'country': country } for pk, name, city, country in places],
+            'cities': [{ 'name': city, 'country': country, 'places': count } for city, country, count in cities]
+        }
+
+
+# Index of this process.
+autocomplete_index = AutocompleteIndex()
+
+
+def update_autocomplete_index(sender, instance, **kwargs):
+    """
+    Keeps the index up to date with the changes made by this process.
+    """
+    autocomplete_index.update(instance.pk, instance.name, instance.city, instance.country, instance.active)
+post_save.connect(update_autocomplete_index, sender=Place)
+
+
+def remove_from_autocomplete_index(sender, instance, **kwargs):
+    """
+    Keeps the index up to date with the Places deleted by this process.
+    """
+    autocomplete_index.update(instance.pk)
+post_delete.connect(remove_from_autocomplete_index, sender=Place)
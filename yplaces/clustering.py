@@ -0,0 +1,145 @@
+import logging
+import math
+from django.conf import settings
+from django.core.cache import cache
+from django.utils.text import slugify
+
+from models import Place, places_generation, ratings_generation
+from versions import Generation
+
+# Instantiate logger.
+logger = logging.getLogger(__name__)
+
+
+class Clustering(object):
+    """
+    Groups Places, for a given map zoom level, in a grid of cells aligned with tiles (at zoom Z the world
+    is split in tiles of 360/2^Z degrees), so that each tile can be clustered, and cached, on its own.
+    
+    Settings (YPLACES):
+        cluster_grid_size: Number of cells per tile side (default: 4).
+        cluster_threshold: Cells with fewer Places than this return the Places themselves (default: 5).
+        cluster_cache_timeout: For how long (seconds) clustered tiles are cached (default: 600). Tiles are also
+                               invalidated whenever a Place or a rating changes (clusters are led by their
+                               top-rated Place).
+    """
+    
+    # Zoom levels.
+    min_zoom = 0
+    max_zoom = 21
+    
+    def __init__(self, zoom):
+        """
+        Constructor.
+        """
+        self.zoom = zoom
+        self.tile_size = 360.0 / (2 ** zoom)
+        self.grid_size = settings.YPLACES.get('cluster_grid_size', 4)
+        self.threshold = settings.YPLACES.get('cluster_threshold', 5)
+        self.timeout = settings.YPLACES.get('cluster_cache_timeout', 600)
+        self.marker_image_url = Place().get_marker_image_url()
+        self.generations = Generation.get_many([places_generation, ratings_generation])
+    
+    def tiles(self, bounds):
+        """
+        Returns the (x, y) coordinates of the tiles that cover the given bounds (south-west and north-east corners).
+        """
+        (sw_lat, sw_lng), (ne_lat, ne_lng) = bounds
+        
+        # Viewport crosses the antimeridian.
+        if ne_lng < sw_lng:
+            ne_lng += 360
+        
+        columns = 2 ** self.zoom
+        rows = max(1, columns // 2)
+        min_x = int(math.floor((sw_lng + 180) / self.tile_size))
+        max_x = int(math.floor((ne_lng + 180) / self.tile_size))
+        min_y = max(0, int(math.floor((sw_lat + 90) / self.tile_size)))
+        max_y = min(rows - 1, int(math.floor((ne_lat + 90) / self.tile_size)))
+        
+        # Return (the same tile isn't returned twice when the viewport is wider than the world).
+        tiles = []
+        for x in range(min_x, min(max_x, min_x + columns - 1) + 1):
+            for y in range(min_y, max_y + 1):
+                tiles.append((x % columns, y))
+        return tiles
+    
+    def tile(self, x, y):
+        """
+        Returns the clusters and Places of the given tile, from the cache if possible.
+        """
+        key = 'yplaces:clusters:%d:%d:%d:%d:%d' % (self.generations[0], self.generations[1], self.zoom, x, y)
+        result = cache.get(key)
+        if result is None:
+            result = self.cluster(x, y)
+            cache.set(key, result, self.timeout)
+        return result
+    
+    def cluster(self, x, y):
+        """
+        Clusters the (active) Places of the given tile.
+        """
+        min_lng = x * self.tile_size - 180
+        min_lat = y * self.tile_size - 90
+        cell_size = self.tile_size / self.grid_size
+        
+        # Group Places by cell.
+        cells = {}
+        places = Place.objects.filter(active=True,
+                                      latitude__gte=min_lat, latitude__lt=min_lat + self.tile_size,
+                                      longitude__gte=min_lng, longitude__lt=min_lng + self.tile_size)
+        for place in places.values_list('pk', 'name', 'latitude', 'longitude', 'rating__average', 'rating__reviews').iterator():
+            cell = (int((place[2] - min_lat) / cell_size), int((place[3] - min_lng) / cell_size))
+            cells.setdefault(cell, []).append(place)
+        
+        # Build clusters (or list Places, in sparse cells).
+        clusters = []
+        singles = []
+        for members in cells.values():
+            if len(members) < self.threshold:
+                singles.extend([self.to_simple(member) for member in members])
+                continue
+            
+            latitudes = [member[2] for member in members]
+            longitudes = [member[3] for member in members]
+            top = max(members, key=lambda member: (member[4] or 0, member[5] or 0))
+            clusters.append({
+                'latitude': sum(latitudes) / len(members),
+                'longitude': sum(longitudes) / len(members),
+                'count': len(members),
+                'bounds': {
+                    'minLat': min(latitudes),
+                    'maxLat': max(latitudes),
+                    'minLng': min(longitudes),
+                    'maxLng': max(longitudes)
+                },
+                'top': self.to_simple(top)
+            })
+        
+        # Return.
+        return { 'clusters': clusters, 'places': singles }
+    
+    def to_simple(self, place):
+        """
+        Lightweight representation of a Place (from its values list).
+        """
+        return {
+            'id': place[0],
+            'name': place[1],
+            'slug': slugify(place[1]),
+            'latitude': place[2],
+            'longitude': place[3],
+            'rating': { 'average': float(place[4] or 0), 'reviews': place[5] or 0 },
+            'marker_image_url': self.marker_image_url
+        }
+    
+    def viewport(self, bounds):
+        """
+        Returns the clusters and Places for the given bounds (south-west and north-east corners).
+        """
+        result = { 'clusters': [], 'places': [] }
+        for x, y in self.tiles(bounds):
+            tile = self.tile(x, y)
+            result['clusters'].extend(tile['clusters'])
+            result['places'].extend(tile['places'])
+        return result
@@ -1,6 +1,7 @@
 import logging
 from django import forms
 
+import imaging
 from models import Place, Review
 
 # Instantiate logger.
@@ -13,15 +14,28 @@ class PlaceForm(forms.ModelForm):
     """
     class Meta:
         model = Place
-        
+
 
 class PhotoForm(forms.Form):
     """
     Form for Place's photos.
     """
     file = forms.ImageField()
-        
-        
+    
+    def clean_file(self):
+        """
+        Rejects images with too many pixels (e.g. decompression bombs), from their header, before they're decoded.
+        """
+        photo_file = self.cleaned_data['file']
+        try:
+            imaging.check_size(imaging.get_size(photo_file))
+        except imaging.ImageTooLarge:
+            raise forms.ValidationError('Image too large (maximum: %d megapixels)' % (imaging.get_max_pixels() // 1000000))
+        finally:
+            photo_file.seek(0)
+        return photo_file
+
+
 class ReviewForm(forms.ModelForm):
     """
     Fields required to create/update Reviews.
@@ -0,0 +1,181 @@
+from PIL import Image
+import logging
+from django.conf import settings
+
+# Instantiate logger.
+logger = logging.getLogger(__name__)
+
+# EXIF tag of the orientation, and the transpositions that turn each of its values upright.
+ORIENTATION_TAG = 0x0112
+ORIENTATIONS = {
+    2: [Image.FLIP_LEFT_RIGHT],
+    3: [Image.ROTATE_180],
+    4: [Image.FLIP_TOP_BOTTOM],
+    5: [Image.ROTATE_90, Image.FLIP_TOP_BOTTOM],
+    6: [Image.ROTATE_270],
+    7: [Image.ROTATE_270, Image.FLIP_TOP_BOTTOM],
+    8: [Image.ROTATE_90]
+}
+
+# Formats photos are saved in: extension (appended to the JPEG's name, see 'get_path'), MIME type, default quality and
+# other encoder options.
+FORMATS = {
+    'jpeg': ('jpg', 'image/jpeg', 85, { 'progressive': True, 'optimize': True }),
+    'webp': ('webp', 'image/webp', 80, { 'method': 4 }),
+    'avif': ('avif', 'image/avif', 60, {})
+}
+
+
+class ImageTooLarge(IOError):
+    """
+    Raised for images with more pixels than allowed (e.g. decompression bombs, which are tiny files that decode into
+    huge images).
+    """
+    pass
+
+
+def get_max_pixels():
+    """
+    Returns the maximum number of pixels of the images that are decoded (YPLACES setting 'photo_max_pixels', default 64
+    megapixels).
+    """
+    return settings.YPLACES.get('photo_max_pixels', 64000000)
+
+
+def get_formats():
+    """
+    Returns the formats, besides JPEG, photos are also saved in (YPLACES setting 'photo_formats', default AVIF and WebP,
+    in order of preference), among those the installed Pillow can encode.
+    """
+    Image.init()
+    return [name for name in settings.YPLACES.get('photo_formats', ('avif', 'webp')) if name in FORMATS and name.upper() in Image.SAVE]
+
+
+def check_formats():
+    """
+    Logs a warning for each of the configured formats (see 'get_formats') that is unknown or that the installed Pillow
+    can't encode, as photos are silently not saved in them.
+    """
+    supported = get_formats()
+    for name in settings.YPLACES.get('photo_formats', ('avif', 'webp')):
+        if name not in supported:
+            logger.warning('Photos won\'t be saved as ' + name + ' (' + ('not supported by the installed Pillow' if name in FORMATS else 'unknown format') + ')')
+
+
+def get_quality(name):
+    """
+    Returns the quality of the given format's encoding (YPLACES setting 'photo_quality', e.g. { 'webp': 75 }, defaults
+    to the qualities above).
+    """
+    return settings.YPLACES.get('photo_quality', {}).get(name, FORMATS[name][2])
+
+
+def get_path(path, name):
+    """
+    Returns the path (or storage name) of the image in the given JPEG's path saved in the given format.
+    """
+    if name == 'jpeg':
+        return path
+    return path + '.' + FORMATS[name][0]
+
+
+def save(im, path, name='jpeg'):
+    """
+    Saves the given image in the given format (progressive and optimized, when JPEG), with its configured quality.
+    """
+    im.save(path, format=name.upper(), quality=get_quality(name), **FORMATS[name][3])
+
+
+def check_size(size):
+    """
+    Raises ImageTooLarge if an image with the given width and height has more pixels than allowed.
+    """
+    if size[0] * size[1] > get_max_pixels():
+        raise ImageTooLarge('Image too large: ' + str(size[0]) + 'x' + str(size[1]))
+
+
+def get_orientation(im):
+    """
+    Returns the EXIF orientation of the given image (1, i.e. upright, if it has none).
+    """
+    try:
+        return (im._getexif() or {}).get(ORIENTATION_TAG, 1)
+    except Exception:
+        return 1
+
+
+def fit(size, box):
+    """
+    Returns the given size scaled down, if necessary, to fit the given box (keeping the aspect ratio). A box's width or
+    height of None doesn't constrain it.
+    """
+    scale = min([1.0] + [float(limit) / value for value, limit in zip(size, box) if limit])
+    return tuple([max(1, int(value * scale)) for value in size])
+
+
+def load(path, box=None, draft=True):
+    """
+    Opens the image in the given file (path or file object), upright (i.e. with its EXIF orientation applied) and in a
+    mode that can be saved as JPEG. When the image is going to be scaled down to fit the given box, JPEGs are decoded
+    at the smallest scale (1/2, 1/4 or 1/8) that is still larger than that, which takes a fraction of the time and
+    memory of decoding them at full size. Raises ImageTooLarge for images with too many pixels (before decoding them)
+    or IOError if the file isn't a valid image.
+    """
+    im = Image.open(path)
+    check_size(im.size)
+    orientation = get_orientation(im)
+    
+    # Decode (the box is upright, the stored image may not be).
+    if box:
+        if orientation > 4:
+            box = (box[1], box[0])
+        if draft:
+            im.draft(im.mode, fit(im.size, box))
+    im.load()
+    
+    # Turn upright.
+    for method in ORIENTATIONS.get(orientation, []):
+        im = im.transpose(method)
+    
+    # JPEG has no transparency nor palettes.
+    if im.mode not in ('RGB', 'L'):
+        im = im.convert('RGB')
+    return im
+
+
+def resize(path, size, draft=True):
+    """
+    Resizes the image in the given file, if necessary, to fit the given (maximum) width and height, re-encoding it as
+    (progressive) JPEG. Returns the resulting width and height. Raises IOError if the file isn't a valid image (or is
+    too large, see 'load').
+    """
+    im = load(path, size, draft)
+    im.thumbnail(size, Image.ANTIALIAS)
+    save(im, path)
+    return im.size
+
+
+def get_size(path):
+    """
+    Returns the width and height of the image in the given file (path or file object, read from its header).
+    """
+    return Image.open(path).size
+
+
+def render(path, renditions, draft=True):
+    """
+    Saves, from the image in the given file (decoded once, at the smallest scale the widest rendition allows), renditions
+    with the given widths (keeping the aspect ratio, each resized once for all its formats), given as a list of (width,
+    path, format) tuples.
+    """
+    im = load(path, (max([rendition[0] for rendition in renditions]), None), draft)
+    resized = {}
+    for width, rendition_path, name in sorted(renditions, reverse=True):
+        if width not in resized:
+            height = max(1, int(round(float(im.size[1]) * width / im.size[0])))
+            resized = { width: im if width == im.size[0] else im.resize((width, height), Image.ANTIALIAS) }
+        save(resized[width], rendition_path, name)
+
+
+# Check the configured formats once, when loaded.
+check_formats()
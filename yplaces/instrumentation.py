@@ -0,0 +1,151 @@
+import logging
+import threading
+import time
+from django.conf import settings
+from django.db import connection
+from django.utils.importlib import import_module
+
+# Instantiate logger.
+logger = logging.getLogger(__name__)
+
+# Metrics of the request being processed by each thread.
+_local = threading.local()
+
+
+class LocalCollector(object):
+    """
+    Metrics sink that keeps the metrics of every request in memory (e.g. for tests and benchmarks).
+    """
+    
+    def __init__(self):
+        """
+        Constructor.
+        """
+        self.lock = threading.Lock()
+        self.records = []
+    
+    def record(self, metrics):
+        """
+        Stores the given request metrics.
+        """
+        with self.lock:
+            self.records.append(metrics)
+    
+    def clear(self):
+        """
+        Discards all metrics.
+        """
+        with self.lock:
+            self.records = []
+
+
+# Metrics sink of this process (when configured with a dotted path).
+_sink = None
+
+
+def get_sink():
+    """
+    Returns the configured metrics sink (i.e. an object with a 'record(metrics)' method), if any. When configured with
+    the dotted path of a class, its instance (created once per process) is returned.
+    """
+    global _sink
+    sink = settings.YPLACES.get('metrics_sink', None)
+    if isinstance(sink, basestring):
+        if _sink is None:
+            module, name = sink.rsplit('.', 1)
+            _sink = getattr(import_module(module), name)
+            if isinstance(_sink, type):
+                _sink = _sink()
+        sink = _sink
+    return sink
+
+
+class timed(object):
+    """
+    Context manager that adds the time spent in its block to the given metric of the request being processed
+    (if it is being instrumented), e.g. "with timed('serialization'): ...". Nested blocks of the same metric
+    are only counted once.
+    """
+    
+    def __init__(self, metric):
+        """
+        Constructor.
+        """
+        self.metric = metric
+    
+    def __enter__(self):
+        metrics = getattr(_local, 'metrics', None)
+        self.outermost = metrics is not None and metrics.get(self.metric + '_start') is None
+        if self.outermost:
+            metrics[self.metric + '_start'] = time.time()
+    
+    def __exit__(self, *args):
+        metrics = getattr(_local, 'metrics', None)
+        if self.outermost and metrics is not None:
+            start = metrics.pop(self.metric + '_start')
+            metrics[self.metric] = metrics.get(self.metric, 0) + (time.time() - start) * 1000
+
+
+class InstrumentationMiddleware(object):
+    """
+    Records, for each request handled by the yplaces views and API handlers, the number of SQL queries, the time
+    spent in the database and serializing (ms), the total time (ms) and the response size (bytes). They're sent
+    to the metrics sink (see the 'metrics_sink' setting) and, in DEBUG mode, added to the response headers
+    (X-Yplaces-Queries, X-Yplaces-DB-Time, X-Yplaces-Serialization-Time, X-Yplaces-Time and X-Yplaces-Size).
+    
+    Queries are counted with Django's debug cursor, so the SQL of instrumented requests is kept (until the next
+    request) even when DEBUG is off.
+    """
+    
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        """
+        Start measuring, if the view belongs to yplaces.
+        """
+        if not view_func.__module__.startswith('yplaces.'):
+            return None
+        request._yplaces_debug_cursor = connection.use_debug_cursor
+        connection.use_debug_cursor = True
+        _local.metrics = {
+            'path': request.path,
+            'view': view_func.__module__ + '.' + view_func.__name__,
+            'start': time.time(),
+            'queries_start': len(connection.queries),
+            'serialization': 0
+        }
+        return None
+    
+    def process_response(self, request, response):
+        """
+        Finish measuring and report.
+        """
+        metrics = getattr(_local, 'metrics', None)
+        if metrics is None or not hasattr(request, '_yplaces_debug_cursor'):
+            return response
+        _local.metrics = None
+        connection.use_debug_cursor = request._yplaces_debug_cursor
+        
+        # Metrics.
+        queries = connection.queries[metrics.pop('queries_start'):]
+        metrics.update({
+            'status': response.status_code,
+            'queries': len(queries),
+            'db_time': sum([float(query['time']) for query in queries]) * 1000,
+            'time': (time.time() - metrics.pop('start')) * 1000,
+            'size': None if response.streaming else len(response.content)
+        })
+        
+        # Report.
+        sink = get_sink()
+        if sink:
+            try:
+                sink.record(metrics)
+            except Exception:
+                logger.warning('Unable to record request metrics', exc_info=1)
+        if settings.DEBUG:
+            response['X-Yplaces-Queries'] = str(metrics['queries'])
+            response['X-Yplaces-DB-Time'] = '%.1f' % metrics['db_time']
+            response['X-Yplaces-Serialization-Time'] = '%.1f' % metrics['serialization']
+            response['X-Yplaces-Time'] = '%.1f' % metrics['time']
+            if metrics['size'] is not None:
+                response['X-Yplaces-Size'] = str(metrics['size'])
+        return response
@@ -0,0 +1,43 @@
+import logging
+from optparse import make_option
+from django.core.management.base import BaseCommand
+
+from yplaces.models import Place
+from yplaces.utils import Geo
+
+# Instantiate logger.
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    """
+    Computes the geohash of existing Places (e.g. created before the field existed).
+    """
+    help = 'Computes the geohash of Places whose stored geohash is missing or out of date.'
+    option_list = BaseCommand.option_list + (
+        make_option('--batch-size', dest='batch_size', type='int', default=1000,
+                    help='Number of Places fetched per query (default: 1000).'),
+    )
+    
+    def handle(self, *args, **options):
+        """
+        Walks the Places table in primary key order, updating only the rows that changed.
+        """
+        batch_size = options['batch_size']
+        last_pk = 0
+        updated = 0
+        while True:
+            batch = list(Place.objects.filter(pk__gt=last_pk).order_by('pk').values_list('pk', 'latitude', 'longitude', 'geohash')[:batch_size])
+            if not batch:
+                break
+            
+            # Update geohash without calling save() (i.e. no signals, no other fields touched).
+            for pk, latitude, longitude, geohash in batch:
+                new_geohash = Geo.geohash(latitude, longitude)
+                if new_geohash != geohash:
+                    Place.objects.filter(pk=pk).update(geohash=new_geohash)
+                    updated += 1
+            last_pk = batch[-1][0]
+        
+        # Done.
+        self.stdout.write('Updated %d Place geohash(es).' % updated)
@@ -0,0 +1,137 @@
+import json
+import logging
+import os
+import resource
+import shutil
+import tempfile
+import time
+from optparse import make_option
+from django.core.management.base import BaseCommand, CommandError
+
+from yplaces import imaging
+from yplaces.models import Photo
+
+# Instantiate logger.
+logger = logging.getLogger(__name__)
+
+
+def process(path, folder, draft):
+    """
+    Processes a copy (in the given folder) of the image in the given file like an uploaded photo (see 'Photo.process'),
+    returning how long it took (ms) and the resulting width and height.
+    """
+    name = os.path.join(folder, 'photo.jpg')
+    shutil.copyfile(path, name)
+    start = time.time()
+    size = imaging.resize(name, Photo.max_size, draft)
+    widths = [width for width in Photo.get_rendition_widths() if width < size[0]] + [size[0]]
+    imaging.render(name, [(width, imaging.get_path(os.path.join(folder, '%d.jpg' % width), format), format)
+                          for width in widths for format in ['jpeg'] + imaging.get_formats() if width < size[0] or format != 'jpeg'], draft)
+    return ((time.time() - start) * 1000, size)
+
+
+class Command(BaseCommand):
+    """
+    Benchmarks the processing of uploaded photos (resizing, renditions and formats) over a corpus of sample images,
+    reporting the time and peak memory (RSS) of each one. Each image is processed in a process of its own (forked, so
+    Unix only), whose peak RSS is only that image's.
+    """
+    args = '<image or folder> [<image or folder> ...]'
+    help = 'Benchmarks the processing of uploaded photos over the given sample images, reporting time and peak RSS.'
+    option_list = BaseCommand.option_list + (
+        make_option('--repeat', dest='repeat', type='int', default=3,
+                    help='Number of times each image is processed (default: 3), reporting the fastest.'),
+        make_option('--full-decode', action='store_false', dest='draft', default=True,
+                    help='Decode JPEGs at full size (i.e. without draft mode), for comparison.'),
+        make_option('--output', dest='output', default=None,
+                    help='Write the results, as JSON, to the given file.'),
+    )
+    
+    # Extensions of the images found in folders.
+    extensions = ('.jpg', '.jpeg', '.png', '.gif', '.bmp', '.tif', '.tiff', '.webp')
+    
+    def handle(self, *args, **options):
+        """
+        Run.
+        """
+        paths = []
+        for arg in args:
+            if os.path.isdir(arg):
+                paths += sorted([os.path.join(arg, name) for name in os.listdir(arg) if os.path.splitext(name)[1].lower() in self.extensions])
+            else:
+                paths.append(arg)
+        if not paths:
+            raise CommandError('No sample images given.')
+        
+        # Run.
+        results = { 'draft': options['draft'], 'max_pixels': imaging.get_max_pixels(), 'formats': imaging.get_formats(), 'images': {} }
+        self.stdout.write('%-40s %11s %11s %10s %10s' % ('', 'Size', 'Result', 'Time (ms)', 'Peak (MB)'))
+        for path in paths:
+            runs = [self.measure(path, options['draft']) for i in range(max(1, options['repeat']))]
+            failed = [run for run in runs if 'error' in run]
+            if failed:
+                result = failed[0]
+                self.stdout.write('%-40s %s' % (os.path.basename(path)[:40], result['error']))
+            else:
+                result = min(runs, key=lambda run: run['ms'])
+                result['peak_mb'] = max([run['peak_mb'] for run in runs])
+                self.stdout.write('%-40s %11s %11s %10.1f %10.1f' % (os.path.basename(path)[:40], '%dx%d' % tuple(result['original']),
+                                                                     '%dx%d' % tuple(result['size']), result['ms'], result['peak_mb']))
+            results['images'][path] = result
+        
+        # Summary.
+        measured = [result for result in results['images'].values() if 'error' not in result]
+        if measured:
+            self.stdout.write('%d image(s): %.1f ms and %.1f MB on average, %.1f MB at most.' % (len(measured),
+                              sum([result['ms'] for result in measured]) / len(measured),
+                              sum([result['peak_mb'] for result in measured]) / len(measured),
+                              max([result['peak_mb'] for result in measured])))
+        
+        # Save.
+        if options['output']:
+            with open(options['output'], 'w') as output:
+                json.dump(results, output, indent=2, sort_keys=True)
+            self.stdout.write('Results written to ' + options['output'])
+    
+    def measure(self, path, draft):
+        """
+        Processes the given image in a child process, returning its time (ms), peak RSS (MB, over the RSS it started
+        with), original and resulting size (or the error that prevented processing it).
+        """
+        read, write = os.pipe()
+        pid = os.fork()
+        
+        # Child.
+        if pid == 0:
+            os.close(read)
+            folder = tempfile.mkdtemp()
+            try:
+                start_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+                try:
+                    original = imaging.get_size(path)
+                    ms, size = process(path, folder, draft)
+                    result = { 'ms': ms, 'original': original, 'size': size, 'start_rss': start_rss }
+                except IOError as e:
+                    result = { 'error': str(e) }
+                os.write(write, json.dumps(result))
+            finally:
+                shutil.rmtree(folder, ignore_errors=True)
+                os._exit(0)
+        
+        # Parent.
+        os.close(write)
+        data = ''
+        chunk = os.read(read, 65536)
+        while chunk:
+            data += chunk
+            chunk = os.read(read, 65536)
+        os.close(read)
+        usage = os.wait4(pid, 0)[2]
+        if not data:
+            return { 'error': 'Processing crashed' }
+        result = json.loads(data)
+        if 'error' not in result:
+            # Linux reports KB, OS X bytes.
+            unit = 1024.0 * 1024 if os.uname()[0] == 'Darwin' else 1024.0
+            result['peak_mb'] = (usage.ru_maxrss - result.pop('start_rss')) / unit
+        return result
@@ -0,0 +1,54 @@
+import logging
+import time
+from optparse import make_option
+from django.core.management.base import BaseCommand
+from django.db import connection
+
+from yplaces.api.serializers import PlaceSerializer, PhotoSerializer, ReviewSerializer
+from yplaces.models import Place, Photo, Review
+
+# Instantiate logger.
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    """
+    Compares the number of queries (and time) taken to serialize pages of Places, Photos and Reviews one object
+    at a time and in batch.
+    """
+    help = 'Compares the queries and time taken to serialize pages of Places, Photos and Reviews, one at a time and in batch.'
+    option_list = BaseCommand.option_list + (
+        make_option('--page-sizes', dest='page_sizes', default='10,30,100',
+                    help='Comma separated list of page sizes (default: 10,30,100).'),
+    )
+    
+    def handle(self, *args, **options):
+        """
+        Run.
+        """
+        page_sizes = [int(size) for size in options['page_sizes'].split(',')]
+        cases = [('Places', PlaceSerializer(), Place.objects.filter(active=True)),
+                 ('Photos', PhotoSerializer(), Photo.objects.all()),
+                 ('Reviews', ReviewSerializer(), Review.objects.all())]
+        
+        # Record queries, whatever the DEBUG setting.
+        debug_cursor = connection.use_debug_cursor
+        connection.use_debug_cursor = True
+        try:
+            self.stdout.write('%-8s %6s %16s %16s %12s %12s' % ('', 'Page', 'Queries (single)', 'Queries (batch)', 'ms (single)', 'ms (batch)'))
+            for name, serializer, queryset in cases:
+                for size in page_sizes:
+                    single = self.measure(lambda: [serializer.to_simple(obj) for obj in queryset[:size]])
+                    batch = self.measure(lambda: serializer.to_simple_many(queryset[:size]))
+                    self.stdout.write('%-8s %6d %16d %16d %12.1f %12.1f' % (name, size, single[0], batch[0], single[1], batch[1]))
+        finally:
+            connection.use_debug_cursor = debug_cursor
+    
+    def measure(self, function):
+        """
+        Returns the number of queries and time (ms) taken by the given function.
+        """
+        start_queries = len(connection.queries)
+        start = time.time()
+        function()
+        return (len(connection.queries) - start_queries, (time.time() - start) * 1000)
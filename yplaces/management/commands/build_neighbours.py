@@ -0,0 +1,26 @@
+import logging
+from optparse import make_option
+from django.core.management.base import BaseCommand
+
+from yplaces.models import Neighbour
+
+# Instantiate logger.
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    """
+    (Re)builds the precomputed neighbours (i.e. nearby places) of all active Places.
+    """
+    help = 'Rebuilds the nearby places of all active Places.'
+    option_list = BaseCommand.option_list + (
+        make_option('--batch-size', dest='batch_size', type='int', default=1000,
+                    help='Number of neighbours inserted per query (default: 1000).'),
+    )
+    
+    def handle(self, *args, **options):
+        """
+        Rebuild.
+        """
+        places = Neighbour.build_all(batch_size=options['batch_size'])
+        self.stdout.write('Built the neighbours of %d Place(s).' % places)
@@ -0,0 +1,78 @@
+import logging
+from multiprocessing.pool import ThreadPool
+from optparse import make_option
+from django.core.management.base import BaseCommand
+from django.db import connection
+
+from yplaces import imaging
+from yplaces.models import Photo
+
+# Instantiate logger.
+logger = logging.getLogger(__name__)
+
+
+def fill_sizes():
+    """
+    Saves the width and height of the photos stored before they were, read from their files' headers (without loading
+    the Photos, as loading one without them reads its file). Returns how many were filled and how many failed.
+    """
+    storage = Photo._meta.get_field('file').storage
+    filled = failed = 0
+    for pk, name in Photo.objects.filter(width__isnull=True).order_by('pk').values_list('pk', 'file').iterator():
+        try:
+            width, height = imaging.get_size(storage.path(name))
+            Photo.objects.filter(pk=pk).update(width=width, height=height)
+            filled += 1
+        except (IOError, OSError):
+            failed += 1
+            logger.error('Error reading the size of photo ' + str(pk), exc_info=1)
+    return filled, failed
+
+
+def build(pk, missing_only):
+    """
+    Builds the renditions (and formats) of the Photo with the given ID. Returns whether it succeeded.
+    """
+    try:
+        photo = Photo.objects.get(pk=pk)
+        photo.build_renditions(missing_only=missing_only)
+        photo.save(update_fields=['formats'])
+        return True
+    except:
+        logger.error('Error building the renditions of photo ' + str(pk), exc_info=1)
+        return False
+    finally:
+        # Threads have connections of their own.
+        connection.close()
+
+
+class Command(BaseCommand):
+    """
+    Builds the renditions (see the 'photo_sizes' and 'photo_formats' settings) of the existing (ready) photos, in
+    parallel, e.g. after upgrading or changing the sizes or formats. The sizes of the photos stored before they were
+    saved are filled in first.
+    """
+    help = 'Builds the renditions of the existing photos.'
+    option_list = BaseCommand.option_list + (
+        make_option('--workers', dest='workers', type='int', default=4,
+                    help='Number of photos processed in parallel (default: 4).'),
+        make_option('--all', action='store_false', dest='missing_only', default=True,
+                    help='Rebuild all renditions, instead of only the missing ones.'),
+    )
+    
+    def handle(self, *args, **options):
+        """
+        Build.
+        """
+        filled, failed = fill_sizes()
+        if filled or failed:
+            self.stdout.write('Filled in the sizes of %d photo(s) (%d failed).' % (filled, failed))
+        
+        pks = list(Photo.objects.filter(state=Photo.READY).order_by('pk').values_list('pk', flat=True))
+        pool = ThreadPool(options['workers'])
+        try:
+            results = pool.map(lambda pk: build(pk, options['missing_only']), pks, chunksize=16)
+        finally:
+            pool.close()
+            pool.join()
+        self.stdout.write('Built the renditions of %d photo(s) (%d failed).' % (results.count(True), results.count(False)))
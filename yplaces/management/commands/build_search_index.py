@@ -0,0 +1,30 @@
+import logging
+from optparse import make_option
+from django.core.management.base import BaseCommand
+
+from yplaces.models import Place
+from yplaces.search import get_backend
+
+# Instantiate logger.
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    """
+    Creates (if needed) the index of the configured search backend and (re)indexes all Places.
+    """
+    help = 'Creates the search index (if needed) and reindexes all Places.'
+    option_list = BaseCommand.option_list + (
+        make_option('--setup-only', action='store_true', dest='setup_only', default=False,
+                    help='Only create the index, without (re)indexing the Places.'),
+    )
+    
+    def handle(self, *args, **options):
+        """
+        Build.
+        """
+        backend = get_backend()
+        backend.setup()
+        if not options['setup_only']:
+            backend.rebuild()
+            self.stdout.write('Indexed %d Place(s) with %s.' % (Place.objects.count(), backend.__class__.__name__))
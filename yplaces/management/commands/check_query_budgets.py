@@ -0,0 +1,82 @@
+import logging
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.core.urlresolvers import reverse
+from django.db import connection
+from django.db.models import Count
+from django.test.client import Client
+from django.utils.text import slugify
+
+from yplaces.models import Place
+
+# Instantiate logger.
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    """
+    Requests the main pages and API endpoints and checks that the number of SQL queries each one runs stays
+    within its budget (which doesn't depend on the number of results, so N+1 queries show up as failures).
+    """
+    help = 'Checks the number of SQL queries of the main pages and API endpoints against their budgets.'
+    
+    # Maximum number of queries per endpoint (API calls include the one that logs them).
+    budgets = {
+        'views.index': 3,
+        'views.place_slug': 6,
+        'PlacesHandler.get': 4,
+        'PlacesHandler.get (radius)': 4,
+        'PlacesHandler.get (cursor)': 2,
+        'PlaceIdHandler.get': 2,
+        'PlaceNearbyHandler.get': 4,
+        'PhotosHandler.get': 5,
+        'ReviewsHandler.get': 6,
+        'ReviewsHandler.get (cursor)': 4,
+    }
+    
+    def handle(self, *args, **options):
+        """
+        Run.
+        """
+        # The Place with the most reviews.
+        places = Place.objects.filter(active=True).annotate(count=Count('review')).order_by('-count')
+        if not places:
+            raise CommandError('There are no active Places (seed the database first).')
+        place = places[0]
+        api = settings.YPLACES['api_url_namespace'] + ':yplaces:'
+        requests = [
+            ('views.index', reverse('yplaces:index'), {}),
+            ('views.place_slug', reverse('yplaces:slug', args=[place.pk, slugify(place.name)]), {}),
+            ('PlacesHandler.get', reverse(api + 'index'), {}),
+            ('PlacesHandler.get (radius)', reverse(api + 'index'), { 'latLng': '%f,%f' % (place.latitude, place.longitude), 'radius': 5 }),
+            ('PlacesHandler.get (cursor)', reverse(api + 'index'), { 'cursor': '' }),
+            ('PlaceIdHandler.get', reverse(api + 'id', args=[place.pk]), {}),
+            ('PlaceNearbyHandler.get', reverse(api + 'nearby', args=[place.pk]), {}),
+            ('PhotosHandler.get', reverse(api + 'photos', args=[place.pk]), {}),
+            ('ReviewsHandler.get', reverse(api + 'reviews', args=[place.pk]), {}),
+            ('ReviewsHandler.get (cursor)', reverse(api + 'reviews', args=[place.pk]), { 'cursor': '' }),
+        ]
+        
+        # Record queries, whatever the DEBUG setting (they're reset when each request starts).
+        client = Client(HTTP_USER_AGENT='yplaces')
+        debug_cursor = connection.use_debug_cursor
+        connection.use_debug_cursor = True
+        failures = []
+        try:
+            for name, url, params in requests:
+                response = client.get(url, params)
+                queries = len(connection.queries)
+                status = 'OK'
+                if response.status_code != 200:
+                    status = 'HTTP %d' % response.status_code
+                    failures.append(name)
+                elif queries > self.budgets[name]:
+                    status = 'OVER BUDGET'
+                    failures.append(name)
+                self.stdout.write('%-30s %3d / %-3d %s' % (name, queries, self.budgets[name], status))
+        finally:
+            connection.use_debug_cursor = debug_cursor
+        
+        # Fail.
+        if failures:
+            raise CommandError('%d endpoint(s) failed: %s' % (len(failures), ', '.join(failures)))
@@ -0,0 +1,35 @@
+import logging
+from django.core.management.base import BaseCommand
+
+from yplaces.models import Photo, PhotoFile
+
+# Instantiate logger.
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    """
+    Moves the files of the (ready) photos stored before they were named after their contents to their contents' names
+    (see 'Photo.store'), so that identical photos share the same file, e.g. after upgrading.
+    """
+    help = 'Stores the existing photos under the hash of their contents, sharing the files of identical ones.'
+    
+    def handle(self, *args, **options):
+        """
+        Store.
+        """
+        stored = set(PhotoFile.objects.values_list('name', flat=True))
+        pks = [pk for pk, name in Photo.objects.filter(state=Photo.READY).order_by('pk').values_list('pk', 'file') if name not in stored]
+        new = duplicates = failed = 0
+        for pk in pks:
+            try:
+                photo = Photo.objects.get(pk=pk)
+                if photo.store():
+                    new += 1
+                else:
+                    duplicates += 1
+                photo.save(update_fields=['file', 'formats'])
+            except (IOError, OSError):
+                failed += 1
+                logger.error('Error storing photo ' + str(pk), exc_info=1)
+        self.stdout.write('Stored %d photo(s): %d new, %d duplicate(s) (%d failed).' % (len(pks), new, duplicates, failed))
@@ -0,0 +1,193 @@
+import bisect
+import logging
+import math
+import random
+from cStringIO import StringIO
+from optparse import make_option
+
+from PIL import Image
+from django.contrib.auth import get_user_model
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from yplaces.models import Place, Rating, Photo, Review, Neighbour, places_generation, ratings_generation
+from yplaces.search import get_backend as get_search_backend
+from yplaces.utils import Geo
+
+# Instantiate logger.
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    """
+    Creates a reproducible (for the same options) synthetic dataset, for benchmarks: Places clustered around
+    "cities" of very different sizes, reviews whose number per Place follows a long-tailed distribution, and
+    photos (small generated images) for some of the Places.
+    """
+    help = 'Creates a reproducible synthetic dataset of Places, reviews and photos (e.g. for run_benchmarks).'
+    option_list = BaseCommand.option_list + (
+        make_option('--places', dest='places', type='int', default=1000,
+                    help='Number of Places (default: 1000).'),
+        make_option('--cities', dest='cities', type='int', default=0,
+                    help='Number of clusters the Places are spread around (default: one per 1000 Places, at least 5).'),
+        make_option('--users', dest='users', type='int', default=100,
+                    help='Number of users writing reviews and adding photos (default: 100).'),
+        make_option('--reviews', dest='reviews', type='float', default=5,
+                    help='Average number of reviews per Place (default: 5).'),
+        make_option('--photos', dest='photos', type='float', default=0.1,
+                    help='Fraction of Places with a photo (default: 0.1).'),
+        make_option('--inactive', dest='inactive', type='float', default=0.05,
+                    help='Fraction of inactive Places (default: 0.05).'),
+        make_option('--seed', dest='seed', type='int', default=1,
+                    help='Random seed (default: 1).'),
+        make_option('--batch-size', dest='batch_size', type='int', default=1000,
+                    help='Number of rows inserted per query (default: 1000).'),
+    )
+    
+    # Relative frequency of each rating value.
+    rating_weights = [(1, 5), (2, 8), (3, 20), (4, 37), (5, 30)]
+    
+    # Password of the synthetic users (e.g. for benchmarking requests that require authentication).
+    password = 'synthetic'
+    
+    def handle(self, *args, **options):
+        """
+        Generate.
+        """
+        self.random = random.Random(options['seed'])
+        self.batch_size = options['batch_size']
+        users = self.create_users(options['users'])
+        cities = self.create_cities(options['cities'] or max(5, options['places'] // 1000))
+        
+        # Places, reviews and photos, batch by batch.
+        created = reviews = photos = 0
+        while created < options['places']:
+            size = min(self.batch_size, options['places'] - created)
+            with transaction.commit_on_success():
+                places = self.create_places(created, size, cities, users, options['inactive'])
+                reviews += self.create_reviews(places, users, options['reviews'])
+                photos += self.create_photos(places, users, options['photos'])
+            created += size
+            self.stdout.write('%d Place(s)...' % created)
+        
+        # Derived data (bulk inserts don't send signals).
+        Rating.refresh_relative_all()
+        Neighbour.build_all(batch_size=self.batch_size)
+        get_search_backend().rebuild()
+        places_generation.bump()
+        ratings_generation.bump()
+        self.stdout.write('Created %d Place(s), %d review(s) and %d photo(s).' % (created, reviews, photos))
+    
+    def create_users(self, count):
+        """
+        Returns the synthetic users, creating the missing ones.
+        """
+        User = get_user_model()
+        users = []
+        for i in range(count):
+            fields = { User.USERNAME_FIELD: 'synthetic%d@example.com' % i }
+            try:
+                users.append(User.objects.get(**fields))
+            except User.DoesNotExist:
+                user = User(**fields)
+                if hasattr(user, 'name'):
+                    user.name = 'Synthetic User %d' % i
+                user.set_password(self.password)
+                user.save()
+                users.append(user)
+        return users
+    
+    def create_cities(self, count):
+        """
+        Returns the clusters' centers, spreads (degrees) and weights (Zipf-like, so a few cities have most Places).
+        """
+        cities = []
+        for rank in range(1, count + 1):
+            cities.append((self.random.uniform(-55, 65), self.random.uniform(-180, 180),
+                           self.random.uniform(0.02, 0.3), 1.0 / rank))
+        return cities
+    
+    def create_places(self, offset, count, cities, users, inactive):
+        """
+        Creates the given number of Places, returning their (id, active) pairs.
+        """
+        indexes = range(len(cities))
+        weights = self.cumulate([city[3] for city in cities])
+        places = []
+        for i in range(offset, offset + count):
+            city = self.choose(indexes, weights)
+            latitude, longitude, spread, weight = cities[city]
+            latitude = max(-89.9, min(89.9, self.random.gauss(latitude, spread)))
+            longitude = ((self.random.gauss(longitude, spread / max(0.1, math.cos(math.radians(latitude)))) + 180) % 360) - 180
+            places.append(Place(name='Synthetic Place %d' % i,
+                                address='Street %d' % self.random.randint(1, 500),
+                                postal_code='%04d' % self.random.randint(0, 9999),
+                                city='City %d' % city,
+                                state='State',
+                                country='Country',
+                                latitude=latitude,
+                                longitude=longitude,
+                                description='Synthetic place.',
+                                created_by=self.random.choice(users),
+                                active=self.random.random() >= inactive,
+                                geohash=Geo.geohash(latitude, longitude)))
+        Place.objects.bulk_create(places)
+        
+        # Fetch the IDs of the Places just created (bulk inserts don't set them).
+        return list(Place.objects.order_by('-pk').values_list('pk', 'active')[:count])[::-1]
+    
+    def create_reviews(self, places, users, average):
+        """
+        Creates the reviews (and respective ratings) of the given Places, returning how many were created.
+        """
+        values = [value for value, weight in self.rating_weights]
+        weights = self.cumulate([weight for value, weight in self.rating_weights])
+        reviews = []
+        ratings = []
+        for pk, active in places:
+            # Long-tailed: most Places have a few reviews, some have many.
+            count = int(self.random.expovariate(1.0 / average)) if average > 0 else 0
+            histogram = {}
+            for i in range(count):
+                value = self.choose(values, weights)
+                histogram[value] = histogram.get(value, 0) + 1
+                reviews.append(Review(place_id=pk, user=self.random.choice(users), rating=value, comment='Synthetic review.'))
+            rating = Rating(place_id=pk)
+            rating.set_histogram(histogram)
+            rating.refresh_values()
+            ratings.append(rating)
+        Review.objects.bulk_create(reviews)
+        Rating.objects.bulk_create(ratings)
+        return len(reviews)
+    
+    def create_photos(self, places, users, fraction):
+        """
+        Creates one photo (a small generated image) for a fraction of the given Places, returning how many were created.
+        """
+        photos = []
+        for pk, active in places:
+            if self.random.random() < fraction:
+                image = Image.new('RGB', (64, 48), tuple([self.random.randint(0, 255) for i in range(3)]))
+                content = StringIO()
+                image.save(content, format='JPEG')
+                name = default_storage.save('yplaces/photos/synthetic_%d.jpg' % pk, ContentFile(content.getvalue()))
+                photos.append(Photo(place_id=pk, file=name, width=64, height=48, added_by=self.random.choice(users)))
+        Photo.objects.bulk_create(photos)
+        return len(photos)
+    
+    def cumulate(self, weights):
+        """
+        Returns the cumulative sums of the given weights (see 'choose').
+        """
+        cumulative = []
+        for weight in weights:
+            cumulative.append((cumulative[-1] if cumulative else 0) + weight)
+        return cumulative
+    
+    def choose(self, items, cumulative):
+        """
+        Returns one of the given items, chosen randomly according to their (cumulative) weights.
+        """
+        return items[min(len(items) - 1, bisect.bisect(cumulative, self.random.uniform(0, cumulative[-1])))]
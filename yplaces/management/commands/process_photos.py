@@ -0,0 +1,50 @@
+import datetime
+import logging
+import time
+from optparse import make_option
+from django.core.management.base import BaseCommand
+
+from yplaces.models import Photo
+from yplaces.processing import process_photo
+
+# Instantiate logger.
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    """
+    Processes the photos waiting to be processed, i.e. the worker of 'yplaces.processing.QueueProcessor'. With other
+    processors, it can be run once to process photos left waiting by processes that stopped. Photos claimed by a
+    process that stopped while processing them are only processed again with '--older-than'.
+    """
+    help = 'Processes the photos waiting to be processed, continuously or once.'
+    option_list = BaseCommand.option_list + (
+        make_option('--once', action='store_true', dest='once', default=False,
+                    help='Process the waiting photos and exit.'),
+        make_option('--interval', dest='interval', type='float', default=2,
+                    help='Seconds between checks for waiting photos (default: 2).'),
+        make_option('--older-than', dest='older_than', type='int', default=0,
+                    help='Only process photos uploaded at least these seconds ago (default: 0), including those '
+                         'claimed by processes that stopped while processing them.'),
+    )
+    
+    def handle(self, *args, **options):
+        """
+        Process.
+        """
+        processed = 0
+        while True:
+            waiting = Photo.objects.filter(state=Photo.PROCESSING)
+            if options['older_than']:
+                added_before = datetime.datetime.now() - datetime.timedelta(seconds=options['older_than'])
+                Photo.objects.filter(state=Photo.CLAIMED, added_at__lt=added_before).update(state=Photo.PROCESSING)
+                waiting = waiting.filter(added_at__lt=added_before)
+            pks = list(waiting.order_by('pk').values_list('pk', flat=True))
+            for pk in pks:
+                if process_photo(pk, attempts=1):
+                    processed += 1
+            if options['once']:
+                break
+            if not pks:
+                time.sleep(options['interval'])
+        self.stdout.write('Processed %d photo(s).' % processed)
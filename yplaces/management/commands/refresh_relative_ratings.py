@@ -0,0 +1,21 @@
+import logging
+from django.core.management.base import BaseCommand
+
+from yplaces.models import Rating
+
+# Instantiate logger.
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    """
+    Recalculates the relative rating of all Places (e.g. scheduled to run periodically).
+    """
+    help = 'Recalculates the relative rating of all Places with a single UPDATE.'
+    
+    def handle(self, *args, **options):
+        """
+        Refresh.
+        """
+        updated = Rating.refresh_relative_all()
+        self.stdout.write('Refreshed %d rating(s).' % updated)
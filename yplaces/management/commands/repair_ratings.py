@@ -0,0 +1,61 @@
+import logging
+from optparse import make_option
+from django.core.management.base import BaseCommand
+from django.db.models import Count
+
+from yplaces.models import Rating, Review
+
+# Instantiate logger.
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    """
+    Verifies (and optionally repairs) the Places' ratings against their reviews.
+    """
+    help = 'Verifies the Places\' ratings against their reviews, repairing them with --repair.'
+    option_list = BaseCommand.option_list + (
+        make_option('--repair', action='store_true', dest='repair', default=False,
+                    help='Fix the ratings that don\'t match the reviews.'),
+    )
+    
+    def handle(self, *args, **options):
+        """
+        Compares the stored ratings with the aggregates of all reviews, calculated with a single GROUP BY.
+        """
+        # Number of reviews per Place and rating value.
+        expected = {}
+        for place, value, count in Review.objects.values_list('place', 'rating').annotate(count=Count('id')).order_by():
+            expected.setdefault(place, {})[value] = count
+        
+        # Stored ratings (those whose totals don't match their own histogram are out of date, whatever the reviews).
+        stored = {}
+        for rating in Rating.objects.all():
+            histogram = dict([(value, count) for value, count in rating.get_histogram().items() if count > 0])
+            if rating.reviews != sum(histogram.values()) or rating.total != sum([value * count for value, count in histogram.items()]):
+                histogram = None
+            stored[rating.place_id] = histogram
+        
+        # Compare.
+        mismatches = []
+        for place in set(expected.keys()) | set(stored.keys()):
+            if expected.get(place, {}) != stored.get(place, {}):
+                mismatches.append(place)
+        self.stdout.write('%d rating(s) out of date.' % len(mismatches))
+        
+        # Repair.
+        if options['repair'] and mismatches:
+            missing = []
+            for place in mismatches:
+                rating = Rating(place_id=place)
+                rating.set_histogram(expected.get(place, {}))
+                rating.refresh_values()
+                
+                # Update existing or create missing ones (in bulk, at the end).
+                if place in stored:
+                    fields = ['total', 'reviews', 'average', 'relative'] + ['stars_%d' % value for value, label in Review.RATING_VALUES]
+                    Rating.objects.filter(place=place).update(**dict([(field, getattr(rating, field)) for field in fields]))
+                else:
+                    missing.append(rating)
+            Rating.objects.bulk_create(missing)
+            self.stdout.write('Repaired %d rating(s).' % len(mismatches))
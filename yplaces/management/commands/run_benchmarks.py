@@ -0,0 +1,273 @@
+import datetime
+import json
+import logging
+import os
+import platform
+import random
+import resource
+import time
+from optparse import make_option
+
+import django
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.core.urlresolvers import reverse
+from django.db import connection
+from django.test.client import Client
+from django.utils.text import slugify
+
+from generate_dataset import Command as GenerateDataset
+from yplaces.models import Place, Photo, Review
+
+# Instantiate logger.
+logger = logging.getLogger(__name__)
+
+
+def percentile(values, p):
+    """
+    Returns the given percentile (nearest rank) of the given values.
+    """
+    values = sorted(values)
+    return values[max(0, int(-(-p * len(values) // 100)) - 1)]
+
+
+class Command(BaseCommand):
+    """
+    Benchmarks every API handler and page (plus radius searches and rating refreshes) against the current database,
+    e.g. one created with generate_dataset at different scales, reporting latency percentiles, queries and peak memory
+    (RSS) per scenario, optionally as JSON in order to compare releases. Each scenario runs in a process of its own
+    (forked, so Unix only), whose peak RSS is only that scenario's.
+    """
+    help = 'Benchmarks the API handlers and pages against the current database, reporting latency, queries and peak RSS.'
+    option_list = BaseCommand.option_list + (
+        make_option('--requests', dest='requests', type='int', default=50,
+                    help='Number of measured requests per scenario (default: 50).'),
+        make_option('--warmup', dest='warmup', type='int', default=5,
+                    help='Number of requests per scenario before measuring (default: 5).'),
+        make_option('--scenarios', dest='scenarios', default='',
+                    help='Comma separated list of scenarios to run (default: all).'),
+        make_option('--writes', action='store_true', dest='writes', default=False,
+                    help='Also benchmark requests that change data (creating and deleting reviews).'),
+        make_option('--seed', dest='seed', type='int', default=1,
+                    help='Random seed used to pick Places (default: 1).'),
+        make_option('--output', dest='output', default=None,
+                    help='Write the results, as JSON, to the given file.'),
+    )
+    
+    def handle(self, *args, **options):
+        """
+        Run.
+        """
+        self.random = random.Random(options['seed'])
+        self.api = settings.YPLACES['api_url_namespace'] + ':yplaces:'
+        
+        # Sample of Places (and respective reviews and photos) the requests are made for.
+        pks = list(Place.objects.filter(active=True).order_by('?').values_list('pk', flat=True)[:100])
+        if not pks:
+            raise CommandError('There are no active Places (see generate_dataset).')
+        self.places = list(Place.objects.filter(pk__in=pks))
+        self.reviews = list(Review.objects.filter(place__in=pks).values_list('place', 'pk')[:100])
+        self.photos = list(Photo.objects.filter(place__in=pks).values_list('place', 'pk')[:100])
+        
+        # Clients (anonymous and authenticated as one of the synthetic users, when available).
+        self.client = Client(HTTP_USER_AGENT='yplaces-benchmark')
+        self.user_client = Client(HTTP_USER_AGENT='yplaces-benchmark')
+        authenticated = self.user_client.login(**{ 'username': 'synthetic0@example.com', 'password': GenerateDataset.password })
+        
+        # Scenarios.
+        scenarios = self.get_scenarios(authenticated, options['writes'])
+        if options['scenarios']:
+            names = options['scenarios'].split(',')
+            scenarios = [scenario for scenario in scenarios if scenario[0] in names]
+        
+        # Run.
+        results = {
+            'date': datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+            'environment': {
+                'python': platform.python_version(),
+                'django': django.get_version(),
+                'database': connection.vendor
+            },
+            'dataset': {
+                'places': Place.objects.count(),
+                'active_places': Place.objects.filter(active=True).count(),
+                'reviews': Review.objects.count(),
+                'photos': Photo.objects.count()
+            },
+            'scenarios': {}
+        }
+        self.stdout.write('%-32s %9s %9s %9s %8s %10s' % ('', 'p50 (ms)', 'p95 (ms)', 'p99 (ms)', 'Queries', 'Peak (MB)'))
+        debug_cursor = connection.use_debug_cursor
+        connection.use_debug_cursor = True
+        try:
+            for name, function in scenarios:
+                result = self.measure(function, options['warmup'], options['requests'])
+                results['scenarios'][name] = result
+                if 'error' in result:
+                    self.stdout.write('%-32s %s' % (name, result['error']))
+                else:
+                    self.stdout.write('%-32s %9.1f %9.1f %9.1f %8.1f %10.1f' % (name, result['p50'], result['p95'], result['p99'], result['queries'],
+                                                                                result['peak_rss_kb'] / 1024))
+        finally:
+            connection.use_debug_cursor = debug_cursor
+        
+        # Save.
+        if options['output']:
+            with open(options['output'], 'w') as output:
+                json.dump(results, output, indent=2, sort_keys=True)
+            self.stdout.write('Results written to ' + options['output'])
+    
+    def measure(self, function, warmup, requests):
+        """
+        Runs the given scenario in a child process, returning its latency percentiles (ms), average number of queries
+        per call and peak RSS (KB, over the RSS it started with), or the error that stopped it.
+        """
+        # The child connects to the database on its own (sharing this process' connection would break it).
+        connection.close()
+        read, write = os.pipe()
+        pid = os.fork()
+        
+        # Child.
+        if pid == 0:
+            os.close(read)
+            try:
+                try:
+                    result = self.run(function, warmup, requests)
+                    connection.close()
+                except Exception as e:
+                    result = { 'error': str(e) }
+                os.write(write, json.dumps(result))
+            finally:
+                os._exit(0)
+        
+        # Parent.
+        os.close(write)
+        data = ''
+        chunk = os.read(read, 65536)
+        while chunk:
+            data += chunk
+            chunk = os.read(read, 65536)
+        os.close(read)
+        usage = os.wait4(pid, 0)[2]
+        if not data:
+            return { 'error': 'Scenario crashed' }
+        result = json.loads(data)
+        if 'error' not in result:
+            # Linux reports KB, OS X bytes.
+            unit = 1024.0 if os.uname()[0] == 'Darwin' else 1.0
+            result['peak_rss_kb'] = (usage.ru_maxrss - result.pop('start_rss')) / unit
+        return result
+    
+    def run(self, function, warmup, requests):
+        """
+        Calls the given function, returning its latency percentiles (ms), average number of queries per call and the
+        RSS (as reported by the OS) the calls started with.
+        """
+        start_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        for i in range(warmup):
+            function()
+        
+        latencies = []
+        queries = 0
+        for i in range(requests):
+            del connection.queries[:]
+            start = time.time()
+            function()
+            latencies.append((time.time() - start) * 1000)
+            queries += len(connection.queries)
+        
+        # Return.
+        return {
+            'requests': requests,
+            'p50': percentile(latencies, 50),
+            'p95': percentile(latencies, 95),
+            'p99': percentile(latencies, 99),
+            'mean': sum(latencies) / requests,
+            'queries': float(queries) / requests,
+            'start_rss': start_rss
+        }
+    
+    def get(self, url, params=None, client=None, status=200):
+        """
+        Returns a function that requests the given URL (a function of a random sample Place), checking the response's status.
+        """
+        def request():
+            place = self.random.choice(self.places)
+            response = (client or self.client).get(url(place), params(place) if params else {})
+            if response.status_code != status:
+                raise CommandError('%s returned %d' % (url(place), response.status_code))
+            if response.streaming:
+                ''.join(response.streaming_content)
+        return request
+    
+    def get_scenarios(self, authenticated, writes):
+        """
+        Returns the list of (name, function) scenarios.
+        """
+        api = self.api
+        location = lambda place: { 'latLng': '%f,%f' % (place.latitude, place.longitude) }
+        box = lambda place, size: '%f,%f,%f,%f' % (place.latitude - size, place.longitude - size, place.latitude + size, place.longitude + size)
+        scenarios = [
+            # API.
+            ('PlacesHandler.get', self.get(lambda place: reverse(api + 'index'))),
+            ('PlacesHandler.get (name)', self.get(lambda place: reverse(api + 'index'), lambda place: { 'name': place.name[:-1] })),
+            ('PlacesHandler.get (location)', self.get(lambda place: reverse(api + 'index'), lambda place: { 'location': place.city })),
+            ('PlacesHandler.get (radius)', self.get(lambda place: reverse(api + 'index'), lambda place: dict(location(place), radius=2))),
+            ('PlacesHandler.get (distance)', self.get(lambda place: reverse(api + 'index'), lambda place: dict(location(place), radius=2, order='distance'))),
+            ('PlacesHandler.get (relevance)', self.get(lambda place: reverse(api + 'index'), lambda place: dict(location(place), radius=5, name=place.name.split()[0], order='relevance'))),
+            ('PlacesHandler.get (cursor)', self.get(lambda place: reverse(api + 'index'), lambda place: { 'cursor': '' })),
+            ('PlacesHandler.get (stream)', self.get(lambda place: reverse(api + 'index'), lambda place: dict(location(place), radius=5, pagination='false'))),
+            ('PlacesNearestHandler.get', self.get(lambda place: reverse(api + 'nearest'), lambda place: dict(location(place), k=10))),
+            ('PlacesAutocompleteHandler.get', self.get(lambda place: reverse(api + 'autocomplete'), lambda place: { 'q': place.name[:self.random.randint(1, 6)] })),
+            ('PlacesClustersHandler.get', self.get(lambda place: reverse(api + 'clusters'), lambda place: { 'bounds': box(place, 0.5), 'zoom': 10 })),
+            ('PlacesMarkersHandler.get', self.get(lambda place: reverse(api + 'markers'))),
+            ('PlacesHeatmapHandler.get', self.get(lambda place: reverse(api + 'heatmap'), lambda place: { 'bounds': box(place, 1), 'resolution': 0.05 })),
+            ('PlaceIdHandler.get', self.get(lambda place: reverse(api + 'id', args=[place.pk]))),
+            ('PlaceNearbyHandler.get', self.get(lambda place: reverse(api + 'nearby', args=[place.pk]))),
+            ('PhotosHandler.get', self.get(lambda place: reverse(api + 'photos', args=[place.pk]))),
+            ('ReviewsHandler.get', self.get(lambda place: reverse(api + 'reviews', args=[place.pk]))),
+            
+            # Pages.
+            ('views.index', self.get(lambda place: reverse('yplaces:index'))),
+            ('views.search', self.get(lambda place: reverse('yplaces:search'), lambda place: { 'name': place.name[:-1], 'location': place.city })),
+            ('views.place_id', self.get(lambda place: reverse('yplaces:id', args=[place.pk]), status=302)),
+            ('views.place_slug', self.get(lambda place: reverse('yplaces:slug', args=[place.pk, slugify(place.name)]))),
+            ('views.photos', self.get(lambda place: reverse('yplaces:photos', args=[place.pk, slugify(place.name)]))),
+            
+            # Functions.
+            ('Place.search_radius', lambda: list(Place.search_radius((self.random.choice(self.places).latitude, self.random.choice(self.places).longitude), 2))),
+            ('Place.refresh_rating', lambda: self.random.choice(self.places).refresh_rating()),
+        ]
+        
+        # Photos and reviews.
+        if self.photos:
+            photo = lambda place: self.random.choice(self.photos)
+            scenarios.append(('PhotoIdHandler.get', self.get(lambda place: reverse(api + 'photo_id', args=photo(place)))))
+        if self.reviews:
+            review = lambda place: self.random.choice(self.reviews)
+            scenarios.append(('ReviewIdHandler.get', self.get(lambda place: reverse(api + 'review_id', args=review(place)))))
+        
+        # Pages that require a user.
+        if authenticated:
+            scenarios.append(('views.add', self.get(lambda place: reverse('yplaces:add'), client=self.user_client)))
+        
+        # Writes.
+        if writes:
+            if not authenticated:
+                raise CommandError('Writes require the synthetic users (see generate_dataset).')
+            scenarios.append(('ReviewsHandler.post (delete)', self.write_review))
+        return scenarios
+    
+    def write_review(self):
+        """
+        Creates a review and deletes it.
+        """
+        place = self.random.choice(self.places)
+        response = self.user_client.post(reverse(self.api + 'reviews', args=[place.pk]),
+                                         json.dumps({ 'rating': self.random.randint(1, 5), 'comment': 'Benchmark review.' }),
+                                         content_type='application/json')
+        if response.status_code != 201:
+            raise CommandError('Review creation returned %d' % response.status_code)
+        response = self.user_client.delete(reverse(self.api + 'review_id', args=[place.pk, json.loads(response.content)['id']]))
+        if response.status_code != 204:
+            raise CommandError('Review deletion returned %d' % response.status_code)
@@ -0,0 +1,90 @@
+import json
+import logging
+import struct
+import sys
+from array import array
+from django.conf import settings
+from django.core.cache import cache
+
+from models import Place, places_generation, ratings_generation
+from versions import Generation
+
+# Instantiate logger.
+logger = logging.getLogger(__name__)
+
+
+class Markers(object):
+    """
+    Compact feed of the markers of all active Places (i.e. ID, name, coordinates and rating) for map rendering,
+    as parallel arrays instead of one object per Place. It is built once per generation of the Places and ratings,
+    which also identify it (ETag), so clients can cache it until something changes.
+    
+    Formats:
+        json: { 'ids': [...], 'names': [...], 'latitudes': [...], 'longitudes': [...], 'ratings': [...], 'marker_image_url': '...' }
+        binary: Little-endian buffer with the number of Places N (uint32) followed by N ids (int32), N latitudes (float32),
+                N longitudes (float32), N name lengths in bytes (uint16), N ratings multiplied by 10 (uint8) and the
+                UTF-8 encoded names, one after the other.
+    
+    Settings (YPLACES):
+        markers_cache_timeout: For how long (seconds) each generation of the feed is cached (default: 86400).
+    """
+    
+    # Formats and respective content types.
+    formats = {
+        'json': 'application/json',
+        'binary': 'application/octet-stream'
+    }
+    
+    def __init__(self, format='json'):
+        """
+        Constructor.
+        """
+        self.format = format
+        self.timeout = settings.YPLACES.get('markers_cache_timeout', 60 * 60 * 24)
+        self.generations = Generation.get_many([places_generation, ratings_generation])
+    
+    def get_etag(self):
+        """
+        Returns the (strong) entity tag of the current feed.
+        """
+        return '"markers-%d-%d-%s"' % (self.generations[0], self.generations[1], self.format)
+    
+    def get_content(self):
+        """
+        Returns the current feed, from the cache if possible.
+        """
+        key = 'yplaces:markers:%d:%d:%s' % (self.generations[0], self.generations[1], self.format)
+        content = cache.get(key)
+        if content is None:
+            content = self.build()
+            cache.set(key, content, self.timeout)
+        return content
+    
+    def build(self):
+        """
+        Builds the feed.
+        """
+        rows = list(Place.objects.filter(active=True).order_by('pk').values_list('pk', 'name', 'latitude', 'longitude', 'rating__average'))
+        
+        # JSON.
+        if self.format == 'json':
+            return json.dumps({
+                'ids': [row[0] for row in rows],
+                'names': [row[1] for row in rows],
+                'latitudes': [row[2] for row in rows],
+                'longitudes': [row[3] for row in rows],
+                'ratings': [float(row[4] or 0) for row in rows],
+                'marker_image_url': Place().get_marker_image_url()
+            }, separators=(',', ':'))
+        
+        # Binary.
+        names = [row[1].encode('utf-8') for row in rows]
+        columns = [array('i', [row[0] for row in rows]),
+                   array('f', [row[2] for row in rows]),
+                   array('f', [row[3] for row in rows]),
+                   array('H', [len(name) for name in names]),
+                   array('B', [int(round((row[4] or 0) * 10)) for row in rows])]
+        if sys.byteorder == 'big':
+            for column in columns:
+                column.byteswap()
+        return struct.pack('<I', len(rows)) + ''.join([column.tostring() for column in columns]) + ''.join(names)
@@ -1,17 +1,46 @@
-import Image
+import hashlib
 import logging
+import math
 import os
+from django.core.cache import cache
+from django.core.exceptions import ObjectDoesNotExist
 from django.core.urlresolvers import reverse
-from django.db import models
+from django.db import DatabaseError, connections, models, transaction
+from django.db.backends.signals import connection_created
+from django.db.models import F, Q
+from django.db.models.signals import post_delete, post_init, post_save
 from django.conf import settings
 from django.utils.text import slugify
 
-from utils import Geo
+import imaging
+from utils import Geo, GeoGrid
+from versions import Generation
 
 # Instantiate logger.
 logger = logging.getLogger(__name__)
 
 
+def register_sqlite_functions(sender, connection, **kwargs):
+    """
+    SQLite doesn't (always) ship the math functions used to calculate distances inside queries, so
+    register them whenever a new connection is created.
+    """
+    if connection.vendor != 'sqlite':
+        return
+    
+    def safe(function):
+        def wrapper(value):
+            try:
+                return function(value)
+            except (TypeError, ValueError):
+                return None
+        return wrapper
+    
+    for name in ('sin', 'cos', 'asin', 'sqrt', 'floor'):
+        connection.connection.create_function(name, 1, safe(getattr(math, name)))
+connection_created.connect(register_sqlite_functions)
+
+
 class Place(models.Model):
     """
     Place.
@@ -31,6 +60,11 @@ class Place(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     created_by = models.ForeignKey(settings.AUTH_USER_MODEL)
     active = models.BooleanField(default=False)
+    geohash = models.CharField(max_length=Geo.geohash_precision, db_index=True, editable=False)
+    
+    class Meta:
+        # Cursor pagination (see 'yplaces.pagination').
+        index_together = [['name', 'id']]
     
     def __unicode__(self):
         """
@@ -38,6 +72,13 @@ class Place(models.Model):
         """
         return self.name
     
+    def save(self, *args, **kwargs):
+        """
+        Override method to make sure the Place's geohash always matches its coordinates.
+        """
+        self.geohash = Geo.geohash(self.latitude, self.longitude)
+        super(Place, self).save(*args, **kwargs)
+    
     def get_absolute_url(self):
         """
         Used to create sitemap.xml
@@ -52,10 +93,10 @@ class Place(models.Model):
             return self.rating
         else:
             return None
-        
+    
     def refresh_rating(self):
         """
-        Calculates Place's rating.
+        Recalculates Place's rating from all its reviews (with a single aggregate query).
         """
         # No Place rating details, create.
         if not hasattr(self, 'rating'):
@@ -63,56 +104,149 @@ class Place(models.Model):
         # Else, fetch Place's rating.
         else:
             rating = self.rating
-            
-        # Calculate Place's rating.
-        reviews = 0
-        total_ratings = 0
-        for review in self.review_set.all():
-            reviews += 1
-            total_ratings += review.rating
         
-        # Update Rating.
-        if reviews > 0:
-            rating.average = float(total_ratings) / reviews
-            rating.reviews = reviews
-            
-            # Calculate relative rating.
-            rating.relative = (rating.average*rating.reviews)/len(Place.objects.filter(active=True))
-            
-            # Shave.
-            rating.save()
+        # Calculate Place's rating, from the number of reviews per rating value.
+        rating.set_histogram(dict(self.review_set.values_list('rating').annotate(count=models.Count('id')).order_by()))
+        rating.refresh_values()
+        
+        # Shave.
+        rating.save()
         
         # Return rating.
         return self
     
+    def update_rating(self, added=None, removed=None):
+        """
+        Updates the Place's rating with the rating value of a review that was added and/or removed (e.g. a review
+        whose rating changed from 2 to 4 stars is added=4, removed=2). The resulting deltas are applied atomically,
+        so that concurrent reviews don't overwrite each other's changes.
+        """
+        # Deltas.
+        deltas = { 'total': 0, 'reviews': 0 }
+        for value, sign in ((added, 1), (removed, -1)):
+            if value is not None:
+                deltas['total'] += sign * value
+                deltas['reviews'] += sign
+                deltas['stars_%d' % value] = deltas.get('stars_%d' % value, 0) + sign
+        
+        # Make sure the Place has a rating (outside the transaction, as concurrent creations are handled with a savepoint).
+        Rating.objects.get_or_create(place=self)
+        
+        with transaction.commit_on_success():
+            # Lock rating, so that concurrent updates wait for this one to finish.
+            rating = Rating.objects.select_for_update().get(place=self)
+            
+            # Apply deltas and recalculate derived values.
+            Rating.objects.filter(pk=rating.pk).update(**dict([(field, F(field) + delta) for field, delta in deltas.items()]))
+            rating = Rating.objects.get(pk=rating.pk)
+            rating.refresh_values()
+            Rating.objects.filter(pk=rating.pk).update(average=rating.average, relative=rating.relative)
+        
+        # Keep this instance's cached rating up to date (ratings are updated in place, without signals).
+        self.rating = rating
+        place_generation(self.pk).bump()
+        ratings_generation.bump()
+        
+        # Return.
+        return self
+    
     @staticmethod
-    def search_radius(latLng, radius, querySet=None):
+    def search_radius(latLng, radius, querySet=None, annotate=False, order=False):
         """
         Searches for Places that are in a given radius of the provided coordinates.
         
         Args:
             latLng: Latitude and longitude.
             radius: Radius.
+            annotate: If True, the great-circle distance (km) is calculated inside the query, used to filter
+                      the results and made available in each Place as 'distance_km'.
+            order: If True (implies 'annotate'), the results are ordered by distance, nearest first.
         """
-        # If a query set is provided, use it.
-        if querySet:
+        # If a query set is provided, use it (comparing with None, as truth-testing it would evaluate it).
+        if querySet is not None:
             places = querySet
         # If not, start with a fresh one, with all Places.
         else:
             places = Place.objects.filter()
         
+        # Pre-filter by the geohash cells that cover the search area. Each cell is a prefix of the stored
+        # geohash, i.e. a prefix match over the geohash index (whatever the column's collation).
+        cells = Q()
+        for cell in Geo.geohash_cover(latLng, radius):
+            cells |= Q(geohash__startswith=cell)
+        places = places.filter(cells)
+        
         # Filter those that fit into the latitude/longitude square limits.
-        geo_box = Geo.box(latLng, radius)
+        geo_box = Geo.box(latLng, float(radius))
         places = places.filter(latitude__range=(geo_box['minLat'], geo_box['maxLat'])).filter(longitude__range=(geo_box['minLon'], geo_box['maxLon']))
         
-        # Finally, fetch those that are inside the given radius.
-        results = []
-        for place in places:
-            if Geo.distance(latLng, (place.latitude, place.longitude)) <= radius:
-                results.append(place)
+        # Finally, keep those that are inside the given radius.
+        table = Place._meta.db_table
+        
+        # a) Exact (haversine) distance, calculated by the database.
+        if annotate or order:
+            distance, params = Geo.distance_sql(latLng, table + '.latitude', table + '.longitude', connections[places.db].vendor)
+            places = places.extra(select={ 'distance_km': distance }, select_params=params,
+                                  where=[distance + ' <= %s'], params=params + [radius])
+            if order:
+                places = places.order_by('distance_km')
+        
+        # b) Inside such a small box the equirectangular projection is accurate enough and needs nothing but arithmetic.
+        else:
+            lat_scale = math.cos(math.radians(latLng[0]))
+            where = '((%(t)s.latitude - %%s) * (%(t)s.latitude - %%s)) + ((%(t)s.longitude - %%s) * %%s * (%(t)s.longitude - %%s) * %%s) <= %%s' % { 't': table }
+            places = places.extra(where=[where],
+                                  params=[latLng[0], latLng[0], latLng[1], lat_scale, latLng[1], lat_scale, math.degrees(float(radius) / Geo.earth_radius) ** 2])
+        
+        # Return.
+        return places
+    
+    @staticmethod
+    def aggregate_grid(bounds, resolution, querySet=None):
+        """
+        Aggregates Places over a fixed latitude/longitude grid, with a single GROUP BY on the quantised coordinates.
+        
+        Args:
+            bounds: South-west and north-east corners.
+            resolution: Size of each grid cell, in degrees.
+        
+        Returns:
+            A list of cells with their south-west corner, number of Places and average rating (of rated Places).
+        """
+        # If a query set is provided, use it.
+        if querySet is not None:
+            places = querySet
+        # If not, start with a fresh one, with all Places.
+        else:
+            places = Place.objects.filter()
+        
+        # Filter those inside the bounds.
+        (sw_lat, sw_lng), (ne_lat, ne_lng) = bounds
+        places = places.filter(latitude__range=(sw_lat, ne_lat)).filter(longitude__range=(sw_lng, ne_lng))
+        
+        # Group by cell.
+        table = Place._meta.db_table
+        cells = places.extra(select={ 'cell_lat': 'FLOOR(%s.latitude / %%s)' % table, 'cell_lng': 'FLOOR(%s.longitude / %%s)' % table },
+                             select_params=(resolution, resolution))
+        cells = cells.values('cell_lat', 'cell_lng').annotate(count=models.Count('id'), average=models.Avg('rating__average')).order_by()
         
         # Return.
-        return places.filter(pk__in=[place.pk for place in results])
+        return [{ 'latitude': round(int(cell['cell_lat']) * resolution, 10),
+                  'longitude': round(int(cell['cell_lng']) * resolution, 10),
+                  'count': cell['count'],
+                  'average': float(cell['average'] or 0) } for cell in cells]
+    
+    @staticmethod
+    def count_active():
+        """
+        Returns the number of active Places, cached for each generation of the Places.
+        """
+        key = 'yplaces:active_places:%d' % places_generation.get()
+        count = cache.get(key)
+        if count is None:
+            count = Place.objects.filter(active=True).count()
+            cache.set(key, count)
+        return count
     
     def get_marker_image_url(self):
         """
@@ -126,9 +260,12 @@ class Place(models.Model):
         """
         rating = self.get_rating()
         if rating:
-            return { 'average': float(rating.average), 'reviews': float(rating.reviews) }
+            histogram = rating.get_histogram()
+            return { 'average': float(rating.average), 'reviews': float(rating.reviews),
+                     'histogram': dict([(str(value), count) for value, count in histogram.items()]) }
         else:
-            return { 'average': 0, 'reviews': 0 }
+            return { 'average': 0, 'reviews': 0,
+                     'histogram': dict([(str(value), 0) for value, label in Review.RATING_VALUES]) }
 
 
 class Rating(models.Model):
@@ -138,7 +275,15 @@ class Rating(models.Model):
     place = models.OneToOneField(Place)
     average = models.FloatField(default=0)
     reviews = models.IntegerField(default=0)
-    relative = models.FloatField(default=0)
+    relative = models.FloatField(default=0, db_index=True)
+    total = models.IntegerField(default=0, db_index=True)
+    
+    # Number of reviews per rating value.
+    stars_1 = models.IntegerField(default=0)
+    stars_2 = models.IntegerField(default=0)
+    stars_3 = models.IntegerField(default=0)
+    stars_4 = models.IntegerField(default=0)
+    stars_5 = models.IntegerField(default=0)
     
     def __unicode__(self):
         """
@@ -146,6 +291,88 @@ class Rating(models.Model):
         """
         return self.place.name
     
+    def get_histogram(self):
+        """
+        Returns the number of reviews per rating value.
+        """
+        return dict([(value, getattr(self, 'stars_%d' % value)) for value, label in Review.RATING_VALUES])
+    
+    def set_histogram(self, histogram):
+        """
+        Sets the number of reviews per rating value (and, from them, the total and number of reviews).
+        """
+        self.total = 0
+        self.reviews = 0
+        for value, label in Review.RATING_VALUES:
+            count = histogram.get(value, 0)
+            setattr(self, 'stars_%d' % value, count)
+            self.total += value * count
+            self.reviews += count
+    
+    def refresh_values(self):
+        """
+        Calculates the average and relative ratings from the total (i.e. sum of all reviews' ratings) and number of reviews.
+        """
+        if self.reviews > 0:
+            self.average = float(self.total) / self.reviews
+        else:
+            self.average = 0
+        
+        # Relative rating (i.e. average * reviews, normalized by the number of active Places), unless normalized at read time.
+        if not Rating.is_normalized_at_read():
+            self.relative = self.calculate_relative()
+    
+    def calculate_relative(self):
+        """
+        Calculates the relative rating, i.e. average * reviews normalized by the number of active Places.
+        """
+        active_places = Place.count_active()
+        if active_places > 0:
+            return float(self.total) / active_places
+        return 0
+    
+    def get_relative(self):
+        """
+        Returns the relative rating. The stored value goes stale whenever the number of active Places changes (until
+        'refresh_relative_all' runs), and isn't stored at all when ratings are normalized at read time.
+        """
+        if Rating.is_normalized_at_read():
+            return self.calculate_relative()
+        return self.relative
+    
+    @staticmethod
+    def is_normalized_at_read():
+        """
+        Whether the relative rating is calculated when read (YPLACES setting 'relative_rating_at_read', default False)
+        instead of stored. As every rating is normalized by the same number, ranking by the total is then equivalent.
+        """
+        return settings.YPLACES.get('relative_rating_at_read', False)
+    
+    @staticmethod
+    def get_ranking_field():
+        """
+        Returns the (indexed) field Ratings should be ordered by when ranking Places by their relative rating.
+        """
+        if Rating.is_normalized_at_read():
+            return 'total'
+        return 'relative'
+    
+    @staticmethod
+    def refresh_relative_all():
+        """
+        Recalculates the relative rating of all Places with a single UPDATE (the number of active Places
+        changes whenever one is (de)activated, which makes every stored relative rating stale). Updates bypass
+        signals, so the ratings' generation is bumped (the Places' representations don't include the relative
+        rating, so their generations aren't).
+        """
+        active_places = Place.objects.filter(active=True).count()
+        if active_places > 0:
+            updated = Rating.objects.update(relative=F('total') / float(active_places))
+        else:
+            updated = Rating.objects.update(relative=0)
+        ratings_generation.bump()
+        return updated
+    
     def get_average_percentage(self):
         """
         Returns the Review's rating value in percentage.
@@ -157,10 +384,30 @@ class Photo(models.Model):
     """
     Place's photos.
     """
+    # Processing states (uploaded files are processed in the background, see 'yplaces.processing'; claimed photos are
+    # being processed, see 'process').
+    PROCESSING = 'processing'
+    CLAIMED = 'claimed'
+    READY = 'ready'
+    FAILED = 'failed'
+    STATES = (
+        (PROCESSING, 'Processing'),
+        (CLAIMED, 'Claimed'),
+        (READY, 'Ready'),
+        (FAILED, 'Failed')
+    )
+    
+    # Maximum width/height.
+    max_size = (1024, 768)
+    
     place = models.ForeignKey(Place)
-    file = models.ImageField(upload_to='yplaces/photos/')
+    file = models.ImageField(upload_to='yplaces/photos/', width_field='width', height_field='height')
+    width = models.IntegerField(null=True, editable=False)
+    height = models.IntegerField(null=True, editable=False)
     added_at = models.DateTimeField(auto_now_add=True)
     added_by = models.ForeignKey(settings.AUTH_USER_MODEL)
+    state = models.CharField(max_length=10, choices=STATES, default=READY, db_index=True)
+    formats = models.CharField(max_length=32, blank=True, default='', editable=False)
     
     class Meta:
         ordering = ['-added_at']
@@ -174,42 +421,241 @@ class Photo(models.Model):
     @staticmethod
     def new(place, photo_file, user):
         """
-        Creates a new photo, saves and resizes it.
+        Creates a new photo and saves it, waiting to be processed (see 'process').
         """
-        # Save photo.
-        photo = Photo(place=place, file=photo_file, added_by=user)
+        photo = Photo(place=place, file=photo_file, added_by=user, state=Photo.PROCESSING)
         photo.save()
-        
-        # Resize image, if necessary, to match maximum width/height.
+        return photo
+    
+    def process(self):
+        """
+        Resizes the photo, if necessary, to match maximum width/height, saves its renditions (and formats) and marks it
+        as ready (or as failed, if the uploaded file can't be processed). The photo is claimed first, so that it's only
+        processed once (e.g. by a thread and by 'process_photos'). Returns whether it was processed (False if it
+        wasn't waiting, or was claimed by someone else).
+        """
+        if not Photo.objects.filter(pk=self.pk, state=Photo.PROCESSING).update(state=Photo.CLAIMED):
+            return False
         try:
-            size = 1024, 768
-            im = Image.open(photo.file.path)
-            im.thumbnail(size, Image.ANTIALIAS)
-            im.save(photo.file.path, format='JPEG')
-        except IOError:
-            photo.destroy() # Delete photo.
-            logger.error('Error resizing place photo! User: ' + str(user.email) + ', Place: ' + str(place.name) + ', Place ID: ' + str(place.pk))
-            raise
+            self.width, self.height = imaging.resize(self.file.path, self.max_size)
+            self.store()
+            self.state = Photo.READY
+        except (IOError, OSError):
+            self.state = Photo.FAILED
+            logger.error('Error resizing place photo! Photo ID: ' + str(self.pk) + ', Place ID: ' + str(self.place_id), exc_info=1)
+        self.save(update_fields=['file', 'state', 'width', 'height', 'formats'])
+        return True
+    
+    @staticmethod
+    def get_content_name(path):
+        """
+        Returns the name (in the storage) of a photo with the contents of the given file, i.e. their SHA-1 hash (in a
+        folder named after its first two digits, so that folders don't grow too large).
+        """
+        digest = hashlib.sha1()
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(65536), ''):
+                digest.update(chunk)
+        digest = digest.hexdigest()
+        return os.path.join(Photo._meta.get_field('file').upload_to, digest[:2], digest + '.jpg')
+    
+    def store(self):
+        """
+        Moves the photo's (processed) file to the name of its contents (see 'get_content_name') and saves its renditions
+        there, unless an identical photo is already stored, in which case the file is deleted and the stored one (and
+        its renditions) shared. Returns whether the photo's contents were new.
+        """
+        previous = self.get_files()
+        path = self.file.path
+        self.file.name = Photo.get_content_name(path)
         
-        # Return.
-        return photo
+        def store(first):
+            if first:
+                if not os.path.isdir(os.path.dirname(self.file.path)):
+                    os.makedirs(os.path.dirname(self.file.path))
+                os.rename(path, self.file.path)
+            self.build_renditions(missing_only=not first)
+        first = PhotoFile.acquire(self.file.name, store)
+        
+        # Delete the files (e.g. renditions, or the file itself if it was a duplicate) left under the previous name.
+        for name in previous:
+            if self.file.storage.exists(name):
+                self.file.storage.delete(name)
+        return first
+    
+    @staticmethod
+    def get_rendition_widths():
+        """
+        Returns the widths of the photos' renditions (YPLACES setting 'photo_sizes', default (160, 480, 1024)).
+        """
+        return sorted(settings.YPLACES.get('photo_sizes', (160, 480, 1024)))
+    
+    def get_rendition_name(self, width):
+        """
+        Returns the name (in the storage) of the rendition with the given width, in a folder (named after the width)
+        next to the photo's file.
+        """
+        folder, name = os.path.split(self.file.name)
+        return os.path.join(folder, str(width), name)
+    
+    def get_sizes(self):
+        """
+        Returns the (width, name) of the photo's renditions (those narrower than the photo) and of the photo itself.
+        """
+        if not self.width:
+            return []
+        sizes = [(width, self.get_rendition_name(width)) for width in Photo.get_rendition_widths() if width < self.width]
+        return sizes + [(self.width, self.file.name)]
+    
+    def get_formats(self):
+        """
+        Returns the formats the photo (and its renditions) is available in, in order of preference (JPEG, always
+        available, last).
+        """
+        return [name for name in self.formats.split(',') if name] + ['jpeg']
+    
+    def get_size_urls(self, format='jpeg'):
+        """
+        Returns the URLs of the photo's renditions (and of the photo itself) in the given format, by width, once it's
+        ready.
+        """
+        if not self.is_ready():
+            return []
+        return [(width, self.file.storage.url(imaging.get_path(name, format))) for width, name in self.get_sizes()]
+    
+    def get_srcset(self, format='jpeg'):
+        """
+        Returns the photo's renditions in the given format as the value of an image's 'srcset' attribute.
+        """
+        return ', '.join(['%s %dw' % (url, width) for width, url in self.get_size_urls(format)])
+    
+    def get_sources(self):
+        """
+        Returns the MIME type and 'srcset' of each format, besides JPEG, the photo is available in (i.e. the 'source'
+        elements of a 'picture' whose 'img' is the JPEG).
+        """
+        return [(imaging.FORMATS[name][1], self.get_srcset(name)) for name in self.get_formats()[:-1]]
+    
+    def build_renditions(self, missing_only=False):
+        """
+        Saves the photo's renditions and, for them and the photo itself, the configured formats (optionally, only the
+        missing ones), from its file.
+        """
+        storage = self.file.storage
+        formats = ['jpeg'] + imaging.get_formats()
+        renditions = []
+        for width, name in self.get_sizes():
+            for format in formats:
+                if (width < self.width or format != 'jpeg') and (not missing_only or not storage.exists(imaging.get_path(name, format))):
+                    renditions.append((width, storage.path(imaging.get_path(name, format)), format))
+        for width, path, format in renditions:
+            if not os.path.isdir(os.path.dirname(path)):
+                os.makedirs(os.path.dirname(path))
+        if renditions:
+            imaging.render(self.file.path, renditions)
+        self.formats = ','.join(formats[1:])
+    
+    def is_ready(self):
+        """
+        Whether the photo was processed and can be shown.
+        """
+        return self.state == Photo.READY
+    
+    def get_state(self):
+        """
+        Returns the photo's state as shown to clients (claimed photos are still processing).
+        """
+        if self.state == Photo.CLAIMED:
+            return Photo.PROCESSING
+        return self.state
+    
+    def get_files(self):
+        """
+        Returns the names (in the storage) of the photo's file and of its renditions, in every format (that may exist).
+        """
+        names = [imaging.get_path(name, format) for width, name in self.get_sizes() for format in imaging.FORMATS if width < self.width or format != 'jpeg']
+        return [self.file.name] + names
+    
+    def delete_files(self):
+        """
+        Deletes the photo's file and its renditions.
+        """
+        for name in self.get_files():
+            if self.file.storage.exists(name):
+                self.file.storage.delete(name)
     
     def destroy(self):
         """
-        Deletes Photo model instance and respective file.
+        Deletes Photo model instance and respective file (unless it's shared with other, identical, photos).
         """
         # If there is a Review associated with the Photo, remove that connection first
         # (in order for the Review not be deleted)
         if hasattr(self, 'review'):
             self.review.unlink_photo()
         
-        # Delete file.
-        os.remove(self.file.path)
+        # Delete file (and its renditions), when this is its last reference.
+        PhotoFile.release(self.file.name, self.delete_files)
         
         # Delete model instance.
         self.delete()
 
 
+class PhotoFile(models.Model):
+    """
+    Processed photo files, stored under the hash of their contents (see 'Photo.get_content_name') so that identical
+    photos share the same file and renditions, with the number of Photos that reference each one.
+    """
+    name = models.CharField(max_length=100, unique=True)
+    references = models.IntegerField(default=0)
+    
+    def __unicode__(self):
+        """
+        String representation of the instance.
+        """
+        return self.name
+    
+    @staticmethod
+    def acquire(name, function):
+        """
+        Adds a reference to the file with the given name and calls the given function with whether it's the first one
+        (i.e. whether the file has to be stored), while other references to it wait. Returns whether it was the first.
+        """
+        while True:
+            # Make sure the file has a row (outside the transaction, as concurrent creations are handled with a savepoint).
+            PhotoFile.objects.get_or_create(name=name)
+            
+            with transaction.commit_on_success():
+                # Lock it (it may have been released by its last reference in the meantime).
+                try:
+                    stored = PhotoFile.objects.select_for_update().get(name=name)
+                except ObjectDoesNotExist:
+                    continue
+                
+                # Count reference and store (undone, if storing fails).
+                PhotoFile.objects.filter(pk=stored.pk).update(references=F('references') + 1)
+                function(stored.references == 0)
+                return stored.references == 0
+    
+    @staticmethod
+    def release(name, function):
+        """
+        Removes a reference to the file with the given name and, if it was the last one (or the file isn't reference
+        counted, e.g. it was stored before the files were), calls the given function (that deletes it) while other
+        references to it wait.
+        """
+        with transaction.commit_on_success():
+            try:
+                stored = PhotoFile.objects.select_for_update().get(name=name)
+            except ObjectDoesNotExist:
+                function()
+                return
+            if stored.references > 1:
+                PhotoFile.objects.filter(pk=stored.pk).update(references=F('references') - 1)
+            else:
+                stored.delete()
+                function()
+
+
 class Review(models.Model):
     """
     User review of a place.
@@ -233,6 +679,9 @@ class Review(models.Model):
     
     class Meta:
         ordering = ['-date']
+        
+        # Cursor pagination of each Place's reviews (see 'yplaces.pagination').
+        index_together = [['place', 'date', 'id']]
     
     def __unicode__(self):
         """
@@ -242,17 +691,34 @@ class Review(models.Model):
     
     def save(self, *args, **kwargs):
         """
-        Override method to make sure Place's Rating is refreshed whenever a Review is saved.
-        """
-        super(Review, self).save(*args, **kwargs)
-        self.place.refresh_rating()
+        Override method to make sure Place's Rating is updated whenever a Review is created or its rating changes
+        (along with the Review, in a single transaction). The previous rating is read from the locked row, so that
+        concurrent edits apply their differences one after the other.
+        """
+        with transaction.commit_on_success():
+            previous = None
+            if self.pk is not None:
+                previous = list(Review.objects.select_for_update().filter(pk=self.pk).values_list('rating', flat=True))
+                previous = previous[0] if previous else None
+            created = previous is None
+            super(Review, self).save(*args, **kwargs)
+            
+            # Apply the difference.
+            if created:
+                self.place.update_rating(added=self.rating)
+            elif previous != self.rating:
+                self.place.update_rating(added=self.rating, removed=previous)
     
     def destroy(self):
         """
-        Deletes the Review and refreshes the Place's rating.
+        Deletes the Review and updates the Place's rating (along with the deletion, in a single transaction), removing
+        the rating read from the locked row (nothing, if it was already deleted).
         """
-        self.delete()
-        self.place.refresh_rating()
+        with transaction.commit_on_success():
+            removed = list(Review.objects.select_for_update().filter(pk=self.pk).values_list('rating', flat=True))
+            self.delete()
+            if removed:
+                self.place.update_rating(removed=removed[0])
         return self
     
     def get_rating_percentage(self):
@@ -266,4 +732,226 @@ class Review(models.Model):
         If the Review is linked to a Photo, remove this link.
         """
         self.photo = None
-        self.save()
\ No newline at end of file
+        self.save()
+
+class Neighbour(models.Model):
+    """
+    One of the nearest active Places (within a maximum distance) of a Place, precomputed so that they
+    can be fetched with a single (indexed) query.
+    
+    Settings (YPLACES):
+        nearby_count: Number of neighbours stored per Place (default: 5).
+        nearby_max_distance: Maximum distance (km) of a neighbour (default: 25).
+    """
+    place = models.ForeignKey(Place, related_name='neighbours')
+    neighbour = models.ForeignKey(Place, related_name='+')
+    distance = models.FloatField()
+    rank = models.IntegerField()
+    
+    class Meta:
+        ordering = ['rank']
+        unique_together = (('place', 'rank'),)
+    
+    def __unicode__(self):
+        """
+        String representation of the model instance.
+        """
+        return self.place.name + ' / ' + self.neighbour.name
+    
+    @staticmethod
+    def get_settings():
+        """
+        Returns the number of neighbours per Place and their maximum distance.
+        """
+        return (settings.YPLACES.get('nearby_count', 5), settings.YPLACES.get('nearby_max_distance', 25))
+    
+    @staticmethod
+    def build_all(batch_size=1000):
+        """
+        (Re)builds the neighbours of all active Places, using a spatial grid instead of comparing every pair.
+        """
+        count, max_distance = Neighbour.get_settings()
+        
+        # Load all active Places into the grid.
+        grid = GeoGrid(max_distance)
+        places = list(Place.objects.filter(active=True).values_list('pk', 'latitude', 'longitude').iterator())
+        for pk, latitude, longitude in places:
+            grid.add(pk, latitude, longitude)
+        
+        # Replace all neighbours, in batches.
+        with transaction.commit_on_success():
+            Neighbour.objects.all().delete()
+            neighbours = []
+            for pk, latitude, longitude in places:
+                for rank, (distance, neighbour) in enumerate(grid.nearest(latitude, longitude, count, exclude=pk)):
+                    neighbours.append(Neighbour(place_id=pk, neighbour_id=neighbour, distance=distance, rank=rank))
+                if len(neighbours) >= batch_size:
+                    Neighbour.objects.bulk_create(neighbours)
+                    neighbours = []
+            Neighbour.objects.bulk_create(neighbours)
+        
+        # Return number of Places.
+        return len(places)
+    
+    @staticmethod
+    def refresh(pk, locations):
+        """
+        Updates the neighbours of the Places affected by a change to the Place with the given ID (e.g. created,
+        moved, (de)activated or deleted), given its previous and/or current location(s).
+        """
+        count, max_distance = Neighbour.get_settings()
+        
+        # Load the active Places that might be affected (i.e. within the maximum distance of the changed locations)
+        # together with their own candidate neighbours (i.e. within twice that distance).
+        grid = GeoGrid(max_distance)
+        coordinates = {}
+        for location in locations:
+            for place_pk, latitude, longitude in Place.search_radius(location, 2 * max_distance, Place.objects.filter(active=True)).values_list('pk', 'latitude', 'longitude'):
+                if place_pk not in coordinates:
+                    grid.add(place_pk, latitude, longitude)
+                    coordinates[place_pk] = (latitude, longitude)
+        affected = [place_pk for place_pk, location in coordinates.items()
+                    if place_pk != pk and min([Geo.distance(changed, location) for changed in locations]) <= max_distance]
+        
+        # The changed Place itself (if still active) and, of the affected ones, those that listed it, that have
+        # room for more neighbours or whose farthest neighbour is farther than it.
+        refresh = set([place_pk for place_pk in [pk] if place_pk in coordinates])
+        current = {}
+        for place_pk, neighbour_pk, distance in Neighbour.objects.filter(place__in=affected).values_list('place', 'neighbour', 'distance'):
+            current.setdefault(place_pk, []).append((neighbour_pk, distance))
+        for place_pk in affected:
+            neighbours = current.get(place_pk, [])
+            if len(neighbours) < count or pk in [neighbour_pk for neighbour_pk, distance in neighbours]:
+                refresh.add(place_pk)
+            elif pk in coordinates and Geo.distance(coordinates[pk], coordinates[place_pk]) < max([distance for neighbour_pk, distance in neighbours]):
+                refresh.add(place_pk)
+        
+        # Recalculate.
+        with transaction.commit_on_success():
+            Neighbour.objects.filter(place__in=refresh | set([pk])).delete()
+            neighbours = []
+            for place_pk in refresh:
+                latitude, longitude = coordinates[place_pk]
+                for rank, (distance, neighbour) in enumerate(grid.nearest(latitude, longitude, count, exclude=place_pk)):
+                    neighbours.append(Neighbour(place_id=place_pk, neighbour_id=neighbour, distance=distance, rank=rank))
+            Neighbour.objects.bulk_create(neighbours)
+
+
+#
+# Generations (see 'yplaces.versions'), so that processes caching derived data know when it is stale.
+#
+places_generation = Generation('places')
+
+
+def bump_places_generation(sender, **kwargs):
+    """
+    Any change to a Place (e.g. created, moved, (de)activated, deleted) starts a new generation.
+    """
+    places_generation.bump()
+post_save.connect(bump_places_generation, sender=Place)
+post_delete.connect(bump_places_generation, sender=Place)
+
+
+ratings_generation = Generation('ratings')
+
+
+def bump_ratings_generation(sender, **kwargs):
+    """
+    Any change to a rating starts a new generation.
+    """
+    ratings_generation.bump()
+post_save.connect(bump_ratings_generation, sender=Rating)
+post_delete.connect(bump_ratings_generation, sender=Rating)
+
+
+def place_generation(pk):
+    """
+    Generation of a single Place, bumped whenever the Place, its rating, photos or reviews change.
+    """
+    return Generation('place:%s' % pk)
+
+
+def bump_place_generation(sender, instance, **kwargs):
+    """
+    Starts a new generation of the changed Place (or of the Place of the changed rating, photo or review).
+    """
+    if sender == Place:
+        place_generation(instance.pk).bump()
+    else:
+        place_generation(instance.place_id).bump()
+post_save.connect(bump_place_generation, sender=Place)
+post_delete.connect(bump_place_generation, sender=Place)
+post_save.connect(bump_place_generation, sender=Rating)
+post_delete.connect(bump_place_generation, sender=Rating)
+post_save.connect(bump_place_generation, sender=Photo)
+post_delete.connect(bump_place_generation, sender=Photo)
+post_save.connect(bump_place_generation, sender=Review)
+post_delete.connect(bump_place_generation, sender=Review)
+
+
+
+#
+# Search index (see 'yplaces.search'), kept up to date with the Places saved and deleted by any process.
+#
+def update_search_index(sender, instance, **kwargs):
+    """
+    (Re)indexes a saved Place (failing to doesn't fail the save, e.g. before the index is created with
+    'build_search_index').
+    """
+    # Imported here, as it imports the models.
+    from search import get_backend
+    try:
+        get_backend().update(instance)
+    except DatabaseError:
+        logger.warning('Unable to index Place ' + str(instance.pk), exc_info=1)
+post_save.connect(update_search_index, sender=Place)
+
+
+def remove_from_search_index(sender, instance, **kwargs):
+    """
+    Removes a deleted Place from the search index (failing to doesn't fail the deletion).
+    """
+    # Imported here, as it imports the models.
+    from search import get_backend
+    try:
+        get_backend().remove(instance.pk)
+    except DatabaseError:
+        logger.warning('Unable to remove Place ' + str(instance.pk) + ' from the search index', exc_info=1)
+post_delete.connect(remove_from_search_index, sender=Place)
+
+
+#
+# Neighbours.
+#
+def track_place_location(sender, instance, **kwargs):
+    """
+    Keeps the location and status each Place was loaded (or last saved) with, in order to know if a save changes them.
+    (Read from the instance's dictionary, so that deferred fields are not loaded.)
+    """
+    if instance.pk:
+        instance._saved_location = (instance.__dict__.get('latitude'), instance.__dict__.get('longitude'), instance.__dict__.get('active'))
+    else:
+        instance._saved_location = None
+post_init.connect(track_place_location, sender=Place)
+
+
+def refresh_neighbours(sender, instance, created=False, **kwargs):
+    """
+    Refreshes the neighbours affected by a Place that was created, moved, (de)activated or deleted.
+    """
+    previous = getattr(instance, '_saved_location', None)
+    current = (instance.latitude, instance.longitude, instance.active)
+    
+    # Saved without changes.
+    if not created and previous == current and kwargs.get('signal') == post_save:
+        return
+    
+    # Refresh, around the previous and current locations.
+    locations = []
+    if previous and previous[0] is not None and previous[1] is not None:
+        locations.append((previous[0], previous[1]))
+    locations.append((current[0], current[1]))
+    Neighbour.refresh(instance.pk, locations)
+    instance._saved_location = current
+post_save.connect(refresh_neighbours, sender=Place)
+post_delete.connect(refresh_neighbours, sender=Place)
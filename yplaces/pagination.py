@@ -0,0 +1,137 @@
+import base64
+import json
+import logging
+from django.conf import settings
+from django.db.models import Q
+
+# Instantiate logger.
+logger = logging.getLogger(__name__)
+
+
+def get_per_page(request, default):
+    """
+    Returns the number of items per page requested with the 'per_page' parameter: invalid values fall back to the
+    given default (as in offset pagination) and values above the maximum (setting 'max_per_page', default: 100) are
+    clamped to it.
+    """
+    try:
+        per_page = int(request.GET.get('per_page', default))
+    except ValueError:
+        return default
+    if per_page <= 0:
+        return default
+    return min(per_page, settings.YPLACES.get('max_per_page', 100))
+
+
+class CursorPaginator(object):
+    """
+    Keyset (cursor) pagination: instead of an offset, each page is fetched from the position of the previous one,
+    i.e. WHERE (sort key, pk) > (last sort key, last pk) ORDER BY sort key, pk LIMIT n, which an index on the same
+    columns answers without going through the rows before it, however deep the page. Positions are exchanged with
+    the clients as opaque tokens ('next' and 'prev'), and the total number of items is only counted if requested.
+    """
+    
+    # Directions.
+    NEXT = 'n'
+    PREV = 'p'
+    
+    def __init__(self, ordering, per_page=30, serializer=None):
+        """
+        Constructor.
+        
+        Args:
+            ordering: Fields the results are sorted by (prefixed with '-' if descending), ending with a unique one (e.g. 'id').
+            per_page: Number of items per page.
+            serializer: Serializer of the items (when building API responses).
+        """
+        self.ordering = [(field.lstrip('-'), field.startswith('-')) for field in ordering]
+        self.per_page = per_page
+        self.serializer = serializer
+    
+    def encode(self, obj, direction):
+        """
+        Returns the token of the position of the given object, for fetching the page after (or before) it.
+        """
+        values = [obj._meta.get_field(field).value_to_string(obj) for field, descending in self.ordering]
+        return base64.urlsafe_b64encode(json.dumps([direction] + values))
+    
+    def decode(self, token, model):
+        """
+        Returns the direction and the sort key values of the given token. Raises ValueError if it is invalid.
+        """
+        try:
+            values = json.loads(base64.urlsafe_b64decode(str(token)))
+            direction = values.pop(0)
+            if direction not in (self.NEXT, self.PREV) or len(values) != len(self.ordering):
+                raise ValueError
+            return direction, [model._meta.get_field(field).to_python(value) for (field, descending), value in zip(self.ordering, values)]
+        except Exception:
+            raise ValueError('Invalid cursor')
+    
+    def paginate(self, queryset, token=None):
+        """
+        Returns the objects of the page at the given token's position (or the first page), along with the tokens
+        of the next and previous pages (None if there aren't any). Raises ValueError if the token is invalid.
+        """
+        direction = self.NEXT
+        ordering = self.ordering
+        
+        # Seek to the token's position (backwards, for the previous page).
+        if token:
+            direction, values = self.decode(token, queryset.model)
+            if direction == self.PREV:
+                ordering = [(field, not descending) for field, descending in ordering]
+            
+            # (a, b) > (x, y) == a > x OR (a = x AND b > y)
+            condition = Q()
+            for i, (field, descending) in enumerate(ordering):
+                term = Q(**{ '%s__%s' % (field, 'lt' if descending else 'gt'): values[i] })
+                for (previous, previous_descending), value in zip(ordering[:i], values[:i]):
+                    term &= Q(**{ previous: value })
+                condition |= term
+            queryset = queryset.filter(condition)
+        
+        # Fetch one more, to know if there are more pages in this direction.
+        objects = list(queryset.order_by(*[('-' if descending else '') + field for field, descending in ordering])[:self.per_page + 1])
+        more = len(objects) > self.per_page
+        objects = objects[:self.per_page]
+        if direction == self.PREV:
+            objects.reverse()
+        
+        # Tokens.
+        next_token = prev_token = None
+        if objects:
+            if more or direction == self.PREV:
+                next_token = self.encode(objects[-1], self.NEXT)
+            if token and (more or direction == self.NEXT):
+                prev_token = self.encode(objects[0], self.PREV)
+        
+        # Return.
+        return objects, next_token, prev_token
+    
+    def get_results(self, request, data, user=None, filters=None, total=False):
+        """
+        Returns the API response (collection, filters and pagination) of the page requested with the 'cursor'
+        parameter, optionally counting all items. Raises ValueError if the cursor is invalid.
+        """
+        # Check if items per page value was provided.
+        self.per_page = get_per_page(request, self.per_page)
+        
+        # Fetch page.
+        objects, next_token, prev_token = self.paginate(self.serializer.prepare(data, user), request.GET.get('cursor', None))
+        
+        # Build response.
+        results = {
+            'collection': self.serializer.to_simple_many(objects, user),
+            'filters': filters or {},
+            'pagination': {
+                'per_page': self.per_page,
+                'next': next_token,
+                'prev': prev_token
+            }
+        }
+        if total:
+            results['pagination']['total_items'] = data.count()
+        
+        # Return.
+        return results
@@ -0,0 +1,103 @@
+import logging
+import threading
+import time
+from multiprocessing.pool import ThreadPool
+from django.conf import settings
+from django.core.exceptions import ObjectDoesNotExist
+from django.db import DatabaseError, connection
+from django.utils.importlib import import_module
+
+from models import Photo
+
+# Instantiate logger.
+logger = logging.getLogger(__name__)
+
+
+def process_photo(pk, attempts=20, delay=0.1):
+    """
+    Processes the Photo with the given ID, if it's still waiting to be processed (and no one else claims it first, see
+    'Photo.process'), returning whether it was. As the request that uploaded it may not have committed it yet, it's
+    looked for a few times.
+    """
+    try:
+        for attempt in range(attempts):
+            try:
+                photo = Photo.objects.get(pk=pk)
+                break
+            except ObjectDoesNotExist:
+                time.sleep(delay)
+        else:
+            logger.warning('Photo ' + str(pk) + ' not found for processing')
+            return False
+        return photo.state == Photo.PROCESSING and photo.process()
+    except (IOError, OSError, DatabaseError):
+        logger.error('Error processing photo ' + str(pk), exc_info=1)
+        return False
+    finally:
+        # Threads have connections of their own.
+        connection.close()
+
+
+class SyncProcessor(object):
+    """
+    Processes photos right away, in the request that uploaded them.
+    """
+    
+    def submit(self, photo):
+        """
+        Processes (or schedules the processing of) the given Photo.
+        """
+        photo.process()
+
+
+class ThreadProcessor(object):
+    """
+    Processes photos in a pool of threads of the process that uploaded them (decoding and resizing images mostly runs
+    without holding the GIL). Photos left waiting by processes that stopped are processed by the 'process_photos' command.
+    
+    Settings (YPLACES):
+        photo_processing_workers: Number of threads (default: 2).
+    """
+    
+    def __init__(self):
+        """
+        Constructor.
+        """
+        self.lock = threading.Lock()
+        self.pool = None
+    
+    def submit(self, photo):
+        """
+        Processes (or schedules the processing of) the given Photo.
+        """
+        with self.lock:
+            if self.pool is None:
+                self.pool = ThreadPool(settings.YPLACES.get('photo_processing_workers', 2))
+        self.pool.apply_async(process_photo, (photo.pk,))
+
+
+class QueueProcessor(object):
+    """
+    Leaves photos waiting (i.e. the database is the queue) for a worker running the 'process_photos' command.
+    """
+    
+    def submit(self, photo):
+        """
+        Processes (or schedules the processing of) the given Photo.
+        """
+        pass
+
+
+# Processor of this process.
+_processor = None
+
+
+def get_processor():
+    """
+    Returns the configured photo processor (setting 'photo_processor', with the dotted path of its class).
+    """
+    global _processor
+    if _processor is None:
+        module, name = settings.YPLACES.get('photo_processor', 'yplaces.processing.ThreadProcessor').rsplit('.', 1)
+        _processor = getattr(import_module(module), name)()
+    return _processor
@@ -0,0 +1,141 @@
+import heapq
+import logging
+from django.conf import settings
+
+from models import Place, Rating
+from pagination import get_per_page
+from utils import Geo, Text
+
+# Instantiate logger.
+logger = logging.getLogger(__name__)
+
+
+class Ranking(object):
+    """
+    Ranks Places by relevance, i.e. a weighted sum of how well they match the searched name and location, how near they
+    are to the given coordinates and how well rated they are (each score between 0 and 1).
+    
+    Only a bounded number of candidates (the best text matches, when the search backend ranks them, or else the best
+    rated Places) is scored, in a single query for the few columns needed, and the best of them are kept in a heap.
+    
+    Settings (YPLACES):
+        relevance_weights: Weights of the 'text', 'distance' and 'rating' scores (default: 1.0 each).
+        relevance_candidates: Maximum number of matching Places that are scored (default: 500).
+        max_per_page: Maximum number of Places per page (default: 100).
+    """
+    
+    # Columns of each candidate (the last one being the ranking field of the ratings, see 'Rating.get_ranking_field').
+    columns = ('pk', 'name', 'address', 'city', 'state', 'country', 'latitude', 'longitude', 'rating__average')
+    
+    def __init__(self, name='', location='', latLng=None, radius=None):
+        """
+        Constructor.
+        """
+        self.name = Text.fold(name).split()
+        self.location = Text.fold(location).split()
+        self.latLng = latLng
+        self.radius = radius
+        self.weights = dict({ 'text': 1.0, 'distance': 1.0, 'rating': 1.0 }, **settings.YPLACES.get('relevance_weights', {}))
+        self.candidates = settings.YPLACES.get('relevance_candidates', 500)
+    
+    def match(self, terms, text):
+        """
+        Scores how well the given (folded) terms match the given text: the fraction of them that are words of the text
+        (or, scoring less, the start of one), plus a bonus when the text starts with them.
+        """
+        words = Text.fold(text).split()
+        if not terms or not words:
+            return 0.0
+        score = 0.0
+        for term in terms:
+            if term in words:
+                score += 1.0
+            elif [word for word in words if word.startswith(term)]:
+                score += 0.5
+        score /= len(terms)
+        if words[:len(terms)] == terms:
+            return 0.8 * score + 0.2
+        return 0.8 * score
+    
+    def score(self, place, max_relative):
+        """
+        Returns the relevance of the given candidate (a row of the columns above), and its distance (km) to the given
+        coordinates (if any).
+        """
+        pk, name, address, city, state, country, latitude, longitude, average, relative = place
+        score = 0.0
+        distance = None
+        
+        # Text (a name match weighs twice as much as a location one).
+        if self.name or self.location:
+            text = 2 * self.match(self.name, name) + self.match(self.location, ' '.join([address, city, state, country]))
+            score += self.weights['text'] * text / (2 * bool(self.name) + bool(self.location))
+        
+        # Distance (halved at half the radius, or at 1km).
+        if self.latLng:
+            scale = max(float(self.radius or 2) / 2, 0.001)
+            distance = Geo.distance(self.latLng, (latitude, longitude))
+            score += self.weights['distance'] * scale / (scale + distance)
+        
+        # Rating (average, and relative to the best rated candidate).
+        if max_relative > 0:
+            score += self.weights['rating'] * ((average or 0) / 5 + (relative or 0) / max_relative) / 2
+        else:
+            score += self.weights['rating'] * (average or 0) / 10
+        return (score, distance)
+    
+    def rank(self, queryset, k):
+        """
+        Returns the (ID, relevance, distance) of the k most relevant of the given Places (most relevant first, the
+        lowest ID first among equally relevant ones), along with the number of candidates.
+        """
+        # Candidates.
+        ranking_field = 'rating__' + Rating.get_ranking_field()
+        if 'relevance' in queryset.query.extra_select:
+            candidates = queryset.order_by('-relevance', 'pk')
+        else:
+            candidates = queryset.order_by('-' + ranking_field, 'pk')
+        candidates = list(candidates.values_list(*(self.columns + (ranking_field,)))[:self.candidates])
+        
+        # Score and keep the best.
+        max_relative = max([place[-1] or 0 for place in candidates] + [0])
+        scored = [self.score(place, max_relative) + (place[0],) for place in candidates]
+        best = heapq.nlargest(k, scored, key=lambda item: (item[0], -item[2]))
+        return ([(pk, score, distance) for score, distance, pk in best], len(candidates))
+    
+    def get_results(self, request, data, user=None, filters=None, serializer=None):
+        """
+        Returns the requested page (as the 'page' and 'per_page' parameters of the page number pagination) of the given
+        Places ranked by relevance, serialized with the given serializer. Only the ranked candidates are paginated
+        ('ranked_items'), while 'total_items' is the number of matching Places.
+        """
+        per_page = get_per_page(request, 30)
+        try:
+            page = max(1, int(request.GET.get('page', 1)))
+        except ValueError:
+            page = 1
+        
+        # Rank enough Places for the page (pages beyond the candidates are empty).
+        best, count = self.rank(data, page * per_page)
+        best = best[(page - 1) * per_page:]
+        places = serializer.prepare(Place.objects.all(), user).in_bulk([pk for pk, score, distance in best])
+        results = []
+        for pk, score, distance in best:
+            if pk in places:
+                places[pk].relevance = score
+                if distance is not None:
+                    places[pk].distance_km = distance
+                results.append(places[pk])
+        
+        # Return.
+        return {
+            'collection': serializer.to_simple_many(results, user),
+            'filters': filters or {},
+            'pagination': {
+                'page': page,
+                'per_page': per_page,
+                'total_pages': max(1, -(-count // per_page)),
+                'total_items': data.count() if count >= self.candidates else count,
+                'ranked_items': count
+            }
+        }
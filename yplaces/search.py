@@ -0,0 +1,253 @@
+import logging
+import re
+from django.conf import settings
+from django.db import DatabaseError, connections, transaction
+from django.db.models import Q
+from django.utils.importlib import import_module
+
+from models import Place
+
+# Instantiate logger.
+logger = logging.getLogger(__name__)
+
+
+class SimpleBackend(object):
+    """
+    Searches Places with case-insensitive substring matches (i.e. a scan of the whole table), without ranking them.
+    Needs no index, so it's the default.
+    """
+    
+    def setup(self):
+        """
+        Creates the structures the backend's index needs (if any).
+        """
+        pass
+    
+    def rebuild(self):
+        """
+        (Re)indexes all Places.
+        """
+        pass
+    
+    def update(self, place):
+        """
+        (Re)indexes the given Place.
+        """
+        pass
+    
+    def remove(self, pk):
+        """
+        Removes the Place with the given ID from the index.
+        """
+        pass
+    
+    def search(self, queryset, name='', location='', rank=True):
+        """
+        Filters the given Places by name and/or location (address, city, state or country). When ranking is supported
+        and requested, results are ordered by relevance (most relevant first) and have it in their 'relevance' attribute.
+        """
+        if name:
+            queryset = queryset.filter(Q(name__icontains=name))
+        if location:
+            queryset = queryset.filter(Q(address__icontains=location) | Q(city__icontains=location) | Q(state__icontains=location) | Q(country__icontains=location))
+        return queryset
+    
+    @staticmethod
+    def tokens(value):
+        """
+        Splits the given search terms into words.
+        """
+        return re.findall(r'\w+', value, re.UNICODE)
+
+
+class IndexBackend(SimpleBackend):
+    """
+    Base class of the backends that keep, in a shadow table (named below), a full-text document per Place with its name
+    and location. Words are matched by prefix (e.g. "caf" finds "Cafe Central"). Terms without any word (e.g. only
+    punctuation) fall back to substring matches.
+    """
+    table = 'yplaces_place_search'
+    
+    # SQL with the columns of the Places' documents: name, then location.
+    location_sql = "%(t)s.address || ' ' || %(t)s.city || ' ' || %(t)s.state || ' ' || %(t)s.country"
+    
+    def execute(self, statements, params=None):
+        """
+        Executes the given SQL statements (with the same parameters) and commits. They run in a savepoint, so that
+        if they fail (e.g. the index's table is missing) only they are undone, not the enclosing transaction.
+        """
+        using = Place.objects.db
+        sid = transaction.savepoint(using=using)
+        try:
+            cursor = connections[using].cursor()
+            for statement in statements:
+                cursor.execute(statement, params or [])
+        except DatabaseError:
+            transaction.savepoint_rollback(sid, using=using)
+            raise
+        transaction.savepoint_commit(sid, using=using)
+        transaction.commit_unless_managed(using=using)
+    
+    def index_sql(self, where=''):
+        """
+        Returns the SQL statements that (re)index the Places that match the given condition (all of them by default).
+        """
+        raise NotImplementedError
+    
+    def remove_sql(self):
+        """
+        Returns the SQL statements that remove the Place with the given ID (the only parameter) from the index.
+        """
+        raise NotImplementedError
+    
+    def rebuild(self):
+        """
+        (Re)indexes all Places.
+        """
+        self.execute(['DELETE FROM ' + self.table] + self.index_sql())
+    
+    def update(self, place):
+        """
+        (Re)indexes the given Place, replacing its document at once (so that it's never missing from the index).
+        """
+        self.execute(self.remove_sql() + self.index_sql(' WHERE ' + Place._meta.db_table + '.id = %s'), [place.pk])
+    
+    def remove(self, pk):
+        """
+        Removes the Place with the given ID from the index.
+        """
+        self.execute(self.remove_sql(), [pk])
+    
+    def search(self, queryset, name='', location='', rank=True):
+        """
+        Filters the given Places by name and/or location (address, city, state or country). When ranking is requested,
+        results are ordered by relevance (most relevant first) and have it in their 'relevance' attribute.
+        """
+        name_tokens, location_tokens = self.tokens(name), self.tokens(location)
+        if (name and not name_tokens) or (location and not location_tokens):
+            return super(IndexBackend, self).search(queryset, name, location)
+        if not name_tokens and not location_tokens:
+            return queryset
+        
+        # Join the documents of the matched Places.
+        where, params, relevance, relevance_params = self.match(name_tokens, location_tokens)
+        queryset = queryset.extra(tables=[self.table], where=[self.table + '.place_id = ' + Place._meta.db_table + '.id'] + where, params=params)
+        
+        # Rank.
+        if rank:
+            queryset = queryset.extra(select={ 'relevance': relevance }, select_params=relevance_params).order_by('-relevance', 'name')
+        return queryset
+    
+    def match(self, name_tokens, location_tokens):
+        """
+        Returns the conditions (and their parameters) that match the given words, followed by the SQL of the relevance
+        (higher is better) and its parameters.
+        """
+        raise NotImplementedError
+
+
+class SQLiteBackend(IndexBackend):
+    """
+    Searches Places with SQLite's FTS5 extension, ranking them with BM25 (a name match weighs more than a location one).
+    Accents are ignored.
+    """
+    
+    def setup(self):
+        """
+        Creates the FTS5 table (the Place's ID is the row ID, also aliased as 'place_id' for joins).
+        """
+        self.execute(["CREATE VIRTUAL TABLE IF NOT EXISTS %s USING fts5(place_id UNINDEXED, name, location, "
+                      "tokenize='unicode61 remove_diacritics 2', prefix='2 3')" % self.table])
+    
+    def index_sql(self, where=''):
+        """
+        Returns the SQL statements that (re)index the Places that match the given condition (all of them by default).
+        """
+        t = Place._meta.db_table
+        return ['INSERT INTO %s (rowid, place_id, name, location) SELECT %s.id, %s.id, %s.name, %s FROM %s%s' % (self.table, t, t, t, self.location_sql % { 't': t }, t, where)]
+    
+    def remove_sql(self):
+        """
+        Returns the SQL statements that remove the Place with the given ID (the only parameter) from the index.
+        """
+        return ['DELETE FROM %s WHERE rowid = %%s' % self.table]
+    
+    def match(self, name_tokens, location_tokens):
+        """
+        Returns the conditions (and their parameters) that match the given words, followed by the SQL of the relevance
+        (higher is better) and its parameters.
+        """
+        terms = ['name : "%s"*' % token for token in name_tokens] + ['location : "%s"*' % token for token in location_tokens]
+        return ([self.table + ' MATCH %s'], [' AND '.join(terms)], '-bm25(%s, 0, 10.0, 1.0)' % self.table, [])
+
+
+class PostgreSQLBackend(IndexBackend):
+    """
+    Searches Places with PostgreSQL's full-text search (name words weigh more than location ones), also matching names
+    that are similar to the searched one (e.g. misspelled) with trigrams, which requires the 'pg_trgm' extension.
+    """
+    
+    def setup(self):
+        """
+        Creates the table of documents and its indexes (GIN, both for the documents and the names' trigrams).
+        """
+        self.execute(['CREATE EXTENSION IF NOT EXISTS pg_trgm',
+                      'CREATE TABLE IF NOT EXISTS %s (place_id integer PRIMARY KEY REFERENCES %s (id) ON DELETE CASCADE, '
+                      'name text NOT NULL, document tsvector NOT NULL)' % (self.table, Place._meta.db_table),
+                      'CREATE INDEX IF NOT EXISTS %s_document ON %s USING gin (document)' % (self.table, self.table),
+                      'CREATE INDEX IF NOT EXISTS %s_name ON %s USING gin (name gin_trgm_ops)' % (self.table, self.table)])
+    
+    def index_sql(self, where=''):
+        """
+        Returns the SQL statements that (re)index the Places that match the given condition (all of them by default).
+        """
+        t = Place._meta.db_table
+        document = "setweight(to_tsvector('simple', %s.name), 'A') || setweight(to_tsvector('simple', %s), 'B')" % (t, self.location_sql % { 't': t })
+        return ['INSERT INTO %s (place_id, name, document) SELECT %s.id, lower(%s.name), %s FROM %s%s' % (self.table, t, t, document, t, where)]
+    
+    def remove_sql(self):
+        """
+        Returns the SQL statements that remove the Place with the given ID (the only parameter) from the index.
+        """
+        return ['DELETE FROM %s WHERE place_id = %%s' % self.table]
+    
+    def match(self, name_tokens, location_tokens):
+        """
+        Returns the conditions (and their parameters) that match the given words, followed by the SQL of the relevance
+        (higher is better) and its parameters.
+        """
+        query = ' & '.join(['%s:*A' % token for token in name_tokens] + ['%s:*B' % token for token in location_tokens])
+        where = []
+        params = []
+        relevance = "ts_rank(%s.document, to_tsquery('simple', %%s))" % self.table
+        relevance_params = [query]
+        
+        # Name: words or similar name.
+        if name_tokens:
+            name = ' '.join(name_tokens).lower()
+            where.append("(%(t)s.document @@ to_tsquery('simple', %%s) OR %(t)s.name %%%% %%s)" % { 't': self.table })
+            params += [' & '.join(['%s:*A' % token for token in name_tokens]), name]
+            relevance += ' + similarity(%s.name, %%s)' % self.table
+            relevance_params.append(name)
+        
+        # Location: words.
+        if location_tokens:
+            where.append("%s.document @@ to_tsquery('simple', %%s)" % self.table)
+            params.append(' & '.join(['%s:*B' % token for token in location_tokens]))
+        return (where, params, relevance, relevance_params)
+
+
+# Backend of this process.
+_backend = None
+
+
+def get_backend():
+    """
+    Returns the configured search backend (setting 'search_backend', with the dotted path of its class).
+    """
+    global _backend
+    if _backend is None:
+        module, name = settings.YPLACES.get('search_backend', 'yplaces.search.SimpleBackend').rsplit('.', 1)
+        _backend = getattr(import_module(module), name)()
+    return _backend
+
@@ -0,0 +1,181 @@
+import heapq
+import logging
+import math
+import threading
+from array import array
+from django.db.models.signals import post_delete, post_save
+
+from models import Place, places_generation
+from utils import Geo
+
+# Instantiate logger.
+logger = logging.getLogger(__name__)
+
+
+def to_vector(latitude, longitude):
+    """
+    Converts the given coordinates into a point (x, y, z) on the unit sphere.
+    """
+    lat, lon = math.radians(latitude), math.radians(longitude)
+    return (math.cos(lat) * math.cos(lon), math.cos(lat) * math.sin(lon), math.sin(lat))
+
+
+def chord_to_km(chord):
+    """
+    Converts the straight-line distance between two points on the unit sphere into the great-circle distance (km).
+    """
+    return 2 * Geo.earth_radius * math.asin(min(1.0, chord / 2))
+
+
+class NearestIndex(object):
+    """
+    Process-local index that answers "which are the k active Places nearest to these coordinates".
+    
+    Places are kept as points on the unit sphere (where the straight-line distance grows with the great-circle one),
+    in a KD-tree stored implicitly in compact arrays: each range of the arrays is a subtree whose root is the median
+    element, split along the axis given by its depth. Changes made in this process are applied incrementally (new or
+    moved Places are kept in a small overflow list, removed ones are skipped) until they are worth a rebuild. Changes
+    made by other processes are detected through the Places' generation, in which case the index is rebuilt.
+    """
+    
+    # Rebuild when the pending changes exceed this fraction of the indexed Places (or the minimum below).
+    REBUILD_RATIO = 0.1
+    REBUILD_MINIMUM = 64
+    
+    def __init__(self):
+        """
+        Constructor.
+        """
+        self.lock = threading.RLock()
+        self.generation = None
+        self.ids = array('l')
+        self.coordinates = [array('d'), array('d'), array('d')]
+        self.overflow = {}
+        self.removed = set()
+    
+    def build(self):
+        """
+        (Re)builds the index with all active Places.
+        """
+        with self.lock:
+            generation = places_generation.get()
+            points = [(pk,) + to_vector(latitude, longitude) for pk, latitude, longitude in Place.objects.filter(active=True).values_list('pk', 'latitude', 'longitude').iterator()]
+            
+            # Lay out the tree: sort each range by its axis and recurse into both halves of the median.
+            stack = [(0, len(points), 0)]
+            while stack:
+                start, end, depth = stack.pop()
+                if end - start <= 1:
+                    continue
+                axis = (depth % 3) + 1
+                points[start:end] = sorted(points[start:end], key=lambda point: point[axis])
+                middle = (start + end) // 2
+                stack.append((start, middle, depth + 1))
+                stack.append((middle + 1, end, depth + 1))
+            
+            # Store.
+            self.ids = array('l', [point[0] for point in points])
+            self.coordinates = [array('d', [point[axis] for point in points]) for axis in (1, 2, 3)]
+            self.overflow = {}
+            self.removed = set()
+            self.generation = generation
+            logger.debug('Nearest index built with ' + str(len(points)) + ' places (generation ' + str(generation) + ')')
+    
+    def is_stale(self):
+        """
+        Checks if the index was never built, if other processes changed the Places or if enough changes are pending.
+        """
+        pending = len(self.overflow) + len(self.removed)
+        return self.generation is None or self.generation != places_generation.get() or \
+            pending > max(self.REBUILD_MINIMUM, self.REBUILD_RATIO * len(self.ids))
+    
+    def update(self, pk, latitude=None, longitude=None, active=False):
+        """
+        Applies the change of a single Place, made by this process.
+        """
+        with self.lock:
+            # Nothing to update.
+            if self.generation is None:
+                return
+            
+            # The change has already bumped the generation. If it was the only change since this index's
+            # generation, the index stays in sync; otherwise, someone else changed the Places too.
+            generation = places_generation.get()
+            if generation != self.generation + 1:
+                self.generation = None
+                return
+            self.generation = generation
+            
+            # Apply change.
+            self.removed.add(pk)
+            self.overflow.pop(pk, None)
+            if active:
+                self.overflow[pk] = to_vector(latitude, longitude)
+    
+    def nearest(self, latLng, k):
+        """
+        Returns a list of (Place ID, distance in km) pairs of the k Places nearest to the given coordinates.
+        """
+        with self.lock:
+            if self.is_stale():
+                self.build()
+            
+            target = to_vector(latLng[0], latLng[1])
+            ids = self.ids
+            xs, ys, zs = self.coordinates
+            removed = self.removed
+            
+            # Max-heap (negated squared distances) with the best k so far.
+            best = []
+            
+            def consider(pk, distance):
+                if len(best) < k:
+                    heapq.heappush(best, (-distance, pk))
+                elif distance < -best[0][0]:
+                    heapq.heapreplace(best, (-distance, pk))
+            
+            # Pending changes.
+            for pk, point in self.overflow.items():
+                consider(pk, sum([(point[axis] - target[axis]) ** 2 for axis in range(3)]))
+            
+            # Walk the tree, nearest side first, skipping subtrees that are farther (from the splitting plane) than the worst result.
+            stack = [(0, len(ids), 0, 0.0)]
+            while stack:
+                start, end, depth, bound = stack.pop()
+                if start >= end or (len(best) == k and bound >= -best[0][0]):
+                    continue
+                middle = (start + end) // 2
+                pk = ids[middle]
+                if pk not in removed:
+                    consider(pk, (xs[middle] - target[0]) ** 2 + (ys[middle] - target[1]) ** 2 + (zs[middle] - target[2]) ** 2)
+                axis = depth % 3
+                delta = target[axis] - self.coordinates[axis][middle]
+                if delta < 0:
+                    near, far = (start, middle), (middle + 1, end)
+                else:
+                    near, far = (middle + 1, end), (start, middle)
+                stack.append(far + (depth + 1, delta * delta))
+                stack.append(near + (depth + 1, 0.0))
+            
+            # Return, nearest first.
+            return [(pk, chord_to_km(math.sqrt(-distance))) for distance, pk in sorted(best, reverse=True)]
+
+
+# Index of this process.
+nearest_index = NearestIndex()
+
+
+def update_nearest_index(sender, instance, **kwargs):
+    """
+    Keeps the index up to date with the changes made by this process.
+    """
+    nearest_index.update(instance.pk, instance.latitude, instance.longitude, instance.active)
+post_save.connect(update_nearest_index, sender=Place)
+
+
+def remove_from_nearest_index(sender, instance, **kwargs):
+    """
+    Keeps the index up to date with the Places deleted by this process.
+    """
+    nearest_index.update(instance.pk)
+post_delete.connect(remove_from_nearest_index, sender=Place)
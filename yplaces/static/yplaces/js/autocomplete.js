@@ -0,0 +1,80 @@
+/*
+ * Suggests places (and cities) while typing in the search form's name field. Requests are delayed until typing pauses,
+ * and the responses of outdated requests are ignored.
+ */
+function initializeAutocomplete() {
+
+    var form = $('nav form[role="search"]');
+    var input = form.find('input[name="name"]');
+    var menu = $('<ul class="dropdown-menu autocomplete"></ul>');
+    var timer = null;
+    var request = null;
+    var last = null;
+
+    // Menu, below the name field.
+    input.attr('autocomplete', 'off');
+    input.parent().css('position', 'relative').append(menu);
+
+    // Fetch suggestions when typing pauses.
+    input.on('keyup', function(e) {
+        var prefix = $.trim(input.val());
+        if(prefix == last) {
+            return;
+        }
+        last = prefix;
+        clearTimeout(timer);
+        if(request) {
+            request.abort();
+            request = null;
+        }
+        if(prefix.length == 0) {
+            menu.hide();
+            return;
+        }
+        timer = setTimeout(function() {
+            request = $.getJSON(autocomplete_api_url, { q: prefix, k: 5 }, function(data, status, xhr) {
+                request = null;
+                if(prefix == last) {
+                    renderSuggestions(data);
+                }
+            });
+        }, 150);
+    });
+
+    // Hide the menu when the field loses focus (after a click on the menu is handled).
+    input.on('blur', function() {
+        setTimeout(function() { menu.hide(); }, 200);
+    });
+
+    // Render suggestions.
+    function renderSuggestions(data) {
+        menu.empty();
+        for(var i=0; i<data.places.length; i++) {
+            var place = data.places[i];
+            var link = $('<a></a>').attr('href', place_href.replace('1', place.id).replace('place-slug', place.slug));
+            link.append($('<strong></strong>').text(place.name)).append(' ').append($('<small></small>').text(place.city));
+            menu.append($('<li></li>').append(link));
+        }
+        if(data.places.length > 0 && data.cities.length > 0) {
+            menu.append('<li class="divider"></li>');
+        }
+        for(var i=0; i<data.cities.length; i++) {
+            var city = data.cities[i];
+            var link = $('<a href="#"></a>').attr('data-city', city.name);
+            link.append($('<i class="fa fa-map-marker"></i>')).append(' ').append($('<span></span>').text(city.name + ', ' + city.country));
+            link.on('click', function(e) {
+                // Search places in the chosen city.
+                e.preventDefault();
+                input.val('');
+                form.find('input[name="location"]').val($(this).attr('data-city'));
+                form.submit();
+            });
+            menu.append($('<li></li>').append(link));
+        }
+        if(data.places.length > 0 || data.cities.length > 0) {
+            menu.show();
+        } else {
+            menu.hide();
+        }
+    }
+}
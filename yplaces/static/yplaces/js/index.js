@@ -79,7 +79,8 @@ function searchNearby(latitude, longitude, radius) {
     var data = {
         latLng: latitude + ',' + longitude,
         radius: radius,
-        pagination: false
+        pagination: false,
+        fields: 'id,name,slug,address,postal_code,city,latitude,longitude,rating,marker_image_url,active'
     }
 
     // Submit API request.
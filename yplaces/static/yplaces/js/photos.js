@@ -42,7 +42,7 @@ function initializePhotoModal() {
             contentType: false,
             processData: false,
             success: function(data, status, xhr) {
-                alert(gettext('Picture uploaded'));
+                alert(gettext('Picture uploaded, it will be shown as soon as it is processed'));
                 $(this).button('reset');
                 window.location = request_path;
             }.bind(this),
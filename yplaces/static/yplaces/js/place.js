@@ -23,6 +23,73 @@ function initializeMap(){
 }
 
 
+/*
+ * Render Review.
+ */
+function renderReview(data) {
+    var html = '<li><div class="avatar">';
+    html += '<img src="' + data.user.photo_url + '" class="img-rounded"></div>';
+    html += '<div class="comment"><div class="star-rating-sm"><div style="width:' + (data.rating*100/5) + '%"></div></div>';
+    html += '<div class="message">' + data.comment + '<br>';
+    if(data.photo && data.photo.state == 'ready') {
+        html += '<picture>';
+        for(var i=0; i<data.photo.formats.length-1; i++) {
+            html += '<source type="' + data.photo.formats[i].type + '" srcset="' + data.photo.formats[i].srcset + '" sizes="260px">';
+        }
+        html += '<img src="' + data.photo.image_url + '" srcset="' + data.photo.srcset + '" sizes="260px" style="width: 50%; margin: 10px 0 10px 0;" class="img-thumbnail">';
+        html += '</picture>';
+        html += '<br>';
+    }
+    html += '<span>' + data.user.name + ' // ' + data.date + '</span></div></div>';
+    html += '<div class="clear"></div></li>';
+    return html;
+}
+
+
+/*
+ * Initialize Reviews (the first page is rendered with the page, the following ones are fetched as the user scrolls).
+ */
+function initializeReviews() {
+
+    var loading = false;
+
+    function loadReviews() {
+        if(loading || !reviews_cursor) {
+            return;
+        }
+        loading = true;
+        $('#moreReviews').button('loading');
+        $.ajax({
+            url: reviews_api_url,
+            type: 'GET',
+            data: { cursor: reviews_cursor, per_page: 10 },
+            dataType: 'JSON',
+            success: function(data, status, xhr) {
+                for(var i=0; i<data.collection.length; i++) {
+                    $('.place .left-container .reviews ul').append(renderReview(data.collection[i]));
+                }
+                reviews_cursor = data.pagination.next;
+                if(!reviews_cursor) {
+                    $('#moreReviews').parent().hide();
+                }
+            },
+            complete: function(xhr, status) {
+                loading = false;
+                $('#moreReviews').button('reset');
+            }
+        });
+    }
+
+    // Load more when clicking the button or scrolling near the end of the page.
+    $('#moreReviews').on('click', loadReviews);
+    $(window).on('scroll', function() {
+        if($(window).scrollTop() + $(window).height() > $(document).height() - 200) {
+            loadReviews();
+        }
+    });
+}
+
+
 /*
  * Initialize Review Modal.
  */
@@ -154,17 +221,7 @@ function initializeReviewModal() {
         alert(gettext('Thank you for your review'));
 
         // Render comment.
-        var html = '<li><div class="avatar">';
-        html += '<img src="' + data.user.photo_url + '" class="img-rounded"></div>';
-        html += '<div class="comment"><div class="star-rating-sm"><div style="width:' + (data.rating*100/5) + '%"></div></div>';
-        html += '<div class="message">' + data.comment + '<br>';
-        if(data.photo) {
-            html += '<img src="' + data.photo.image_url + '" style="width: 50%; margin: 10px 0 10px 0;" class="img-thumbnail">';
-            html += '<br>';
-        }
-        html += '<span>' + data.user.name + ' // ' + data.date + '</span></div></div>';
-        html += '<div class="clear"></div></li>';
-        $('.place .left-container .reviews ul').prepend(html);
+        $('.place .left-container .reviews ul').prepend(renderReview(data));
         $('.place .left-container .reviews ul').show();
 
         // Update Place's average rating.
@@ -0,0 +1,115 @@
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.urlresolvers import reverse
+from django.test import TestCase
+from django.test.client import Client
+from django.test.utils import override_settings
+from django.utils.text import slugify
+
+from instrumentation import LocalCollector
+from models import Place, Photo, Review
+
+
+class QueryBudgetsTest(TestCase):
+    """
+    Checks the number of SQL queries of the main pages and API endpoints (API calls include the one that logs them),
+    which mustn't depend on the number of results, so that N+1 queries fail the tests.
+    """
+    
+    # Number of Places created, and of reviews per Place.
+    places = 12
+    reviews = 3
+    
+    def setUp(self):
+        """
+        Creates a small dataset: active Places (and an inactive one) near each other, with reviews and a photo each.
+        """
+        cache.clear()
+        User = get_user_model()
+        users = []
+        for i in range(self.reviews):
+            user = User(**{ User.USERNAME_FIELD: 'test%d@example.com' % i })
+            if hasattr(user, 'name'):
+                user.name = 'Test User %d' % i
+            user.set_password('test')
+            user.save()
+            users.append(user)
+        
+        for i in range(self.places + 1):
+            place = Place(name='Test Place %d' % i, address='Street %d' % i, postal_code='1000', city='Lisbon',
+                          state='Lisbon', country='Portugal', latitude=38.71 + i * 0.001, longitude=-9.14,
+                          description='Test place.', created_by=users[0], active=i < self.places)
+            place.save()
+            for j, user in enumerate(users):
+                Review(place=place, user=user, rating=1 + (i + j) % 5, comment='Test review %d.' % j).save()
+            Photo(place=place, file='yplaces/photos/test_%d.jpg' % i, width=64, height=48, added_by=user).save()
+        
+        self.place = Place.objects.filter(active=True).order_by('pk')[0]
+        self.api = settings.YPLACES['api_url_namespace'] + ':yplaces:'
+        self.client = Client(HTTP_USER_AGENT='yplaces-tests')
+    
+    def get(self, url, params=None):
+        """
+        Requests the given URL, checking that it succeeds.
+        """
+        response = self.client.get(url, params or {})
+        self.assertEqual(response.status_code, 200)
+        return response
+    
+    def test_places(self):
+        """
+        PlacesHandler.get, with page number pagination, radius search and cursor pagination.
+        """
+        with self.assertNumQueries(4):
+            self.get(reverse(self.api + 'index'))
+        with self.assertNumQueries(4):
+            self.get(reverse(self.api + 'index'), { 'latLng': '%f,%f' % (self.place.latitude, self.place.longitude), 'radius': 5 })
+        with self.assertNumQueries(2):
+            self.get(reverse(self.api + 'index'), { 'cursor': '' })
+    
+    def test_reviews(self):
+        """
+        ReviewsHandler.get, with page number and cursor pagination.
+        """
+        with self.assertNumQueries(6):
+            self.get(reverse(self.api + 'reviews', args=[self.place.pk]))
+        with self.assertNumQueries(4):
+            self.get(reverse(self.api + 'reviews', args=[self.place.pk]), { 'cursor': '' })
+    
+    def test_index(self):
+        """
+        views.index.
+        """
+        with self.assertNumQueries(2):
+            self.get(reverse('yplaces:index'))
+    
+    def test_place_slug(self):
+        """
+        views.place_slug.
+        """
+        with self.assertNumQueries(5):
+            self.get(reverse('yplaces:slug', args=[self.place.pk, slugify(self.place.name)]))
+    
+    def test_local_collector(self):
+        """
+        InstrumentationMiddleware sends the metrics of yplaces requests (and only those) to the metrics sink.
+        """
+        collector = LocalCollector()
+        middleware = settings.MIDDLEWARE_CLASSES + ('yplaces.instrumentation.InstrumentationMiddleware',)
+        with override_settings(MIDDLEWARE_CLASSES=middleware, YPLACES=dict(settings.YPLACES, metrics_sink=collector)):
+            client = Client(HTTP_USER_AGENT='yplaces-tests')
+            url = reverse(self.api + 'index')
+            response = client.get(url)
+            self.assertEqual(response.status_code, 200)
+            client.get('/this-is-not-a-yplaces-url')
+        
+        self.assertEqual(len(collector.records), 1)
+        metrics = collector.records[0]
+        self.assertEqual(metrics['path'], url)
+        self.assertEqual(metrics['status'], 200)
+        self.assertEqual(metrics['queries'], 4)
+        self.assertEqual(metrics['size'], len(response.content))
+        self.assertTrue(metrics['view'].startswith('yplaces.'))
+        for metric in ('db_time', 'serialization', 'time'):
+            self.assertTrue(metrics[metric] >= 0)
@@ -1,4 +1,6 @@
+import heapq
 import math
+import unicodedata
 
 
 class Geo:
@@ -7,6 +9,10 @@ class Geo:
     """
     earth_radius = 6371
     
+    # Geohash base32 alphabet and the precision stored in the database.
+    geohash_alphabet = '0123456789bcdefghjkmnpqrstuvwxyz'
+    geohash_precision = 12
+    
     @staticmethod
     def distance(origin, destination):
         """
@@ -15,16 +21,41 @@ class Geo:
         lat1, lon1 = origin
         lat2, lon2 = destination
         radius = Geo.earth_radius # km
-    
+        
         dlat = math.radians(lat2-lat1)
         dlon = math.radians(lon2-lon1)
         a = math.sin(dlat/2) * math.sin(dlat/2) + math.cos(math.radians(lat1)) \
             * math.cos(math.radians(lat2)) * math.sin(dlon/2) * math.sin(dlon/2)
         c = 2 * math.atan2(math.sqrt(a), math.sqrt(1-a))
         d = radius * c
-    
+        
         return d
-
+    
+    @staticmethod
+    def distance_sql(origin, latitude_column, longitude_column, vendor):
+        """
+        Returns the SQL expression (and respective parameters) that calculates the distance (km) between the
+        given coordinates and the ones in the given columns, i.e. the same haversine formula as 'distance'.
+        
+        Only SIN, COS, ASIN and SQRT are required from the database (SQLite doesn't ship them, so they have to
+        be registered in each connection). Rounding errors are clamped, as ASIN(>1) fails in some databases.
+        """
+        lat, lon = math.radians(origin[0]), math.radians(origin[1])
+        columns = { 'lat': latitude_column, 'lon': longitude_column, 'k': repr(math.pi / 180) }
+        sin_dlat = 'SIN((%(lat)s * %(k)s - %%s) / 2)' % columns
+        sin_dlon = 'SIN((%(lon)s * %(k)s - %%s) / 2)' % columns
+        a = '%s * %s + %%s * COS(%s * %s) * %s * %s' % (sin_dlat, sin_dlat, latitude_column, columns['k'], sin_dlon, sin_dlon)
+        
+        # Smallest of two values.
+        if vendor == 'sqlite':
+            least = 'MIN'
+        else:
+            least = 'LEAST'
+        
+        # Return.
+        sql = '2 * %s * ASIN(%s(1, SQRT(%s)))' % (Geo.earth_radius, least, a)
+        return sql, [lat, lat, math.cos(lat), lon, lon]
+    
     @staticmethod
     def box(origin, radius):
         """
@@ -39,11 +70,173 @@ class Geo:
         # Compensate for degrees longitude getting smaller with increasing latitude
         maxLon = origin[1] + math.degrees(radius/earth_r/math.cos(math.radians(origin[0])))
         minLon = origin[1] - math.degrees(radius/earth_r/math.cos(math.radians(origin[0])))
-
+        
         # Return.
         return {
             'maxLat': maxLat,
             'minLat': minLat,
             'maxLon': maxLon,
             'minLon': minLon
-        }
\ No newline at end of file
+        }
+    
+    @staticmethod
+    def geohash(latitude, longitude, precision=None):
+        """
+        Encodes the given coordinates into a geohash of the given precision (number of characters).
+        """
+        if precision is None:
+            precision = Geo.geohash_precision
+        
+        # Normalize coordinates (longitude wraps around, latitude is clamped).
+        longitude = ((longitude + 180.0) % 360.0) - 180.0
+        latitude = max(-90.0, min(90.0, latitude))
+        
+        lat_interval = [-90.0, 90.0]
+        lon_interval = [-180.0, 180.0]
+        geohash = []
+        bits = 0
+        bit_count = 0
+        even = True
+        while len(geohash) < precision:
+            # Even bits refine longitude, odd bits refine latitude.
+            if even:
+                interval, value = lon_interval, longitude
+            else:
+                interval, value = lat_interval, latitude
+            mid = (interval[0] + interval[1]) / 2
+            if value >= mid:
+                bits = (bits << 1) | 1
+                interval[0] = mid
+            else:
+                bits = bits << 1
+                interval[1] = mid
+            even = not even
+            
+            # Every 5 bits make a character.
+            bit_count += 1
+            if bit_count == 5:
+                geohash.append(Geo.geohash_alphabet[bits])
+                bits = 0
+                bit_count = 0
+        
+        # Return.
+        return ''.join(geohash)
+    
+    @staticmethod
+    def geohash_cell_size(precision):
+        """
+        Returns the (height, width), in degrees, of a geohash cell with the given precision.
+        """
+        lat_bits = (5 * precision) // 2
+        lon_bits = 5 * precision - lat_bits
+        return (180.0 / (2 ** lat_bits), 360.0 / (2 ** lon_bits))
+    
+    @staticmethod
+    def geohash_cover(origin, radius, max_cells=16):
+        """
+        Returns the list of geohash cells that cover the circle with the given radius (km) around
+        the given coordinates, using the finest precision that needs no more than 'max_cells' cells.
+        """
+        geo_box = Geo.box(origin, float(radius))
+        min_lat = max(-90.0, geo_box['minLat'])
+        max_lat = min(90.0, geo_box['maxLat'])
+        min_lon = geo_box['minLon']
+        max_lon = geo_box['maxLon']
+        
+        # Pick the finest precision whose grid covers the box with, at most, the given number of cells.
+        precision = 1
+        for candidate in range(Geo.geohash_precision, 0, -1):
+            height, width = Geo.geohash_cell_size(candidate)
+            rows = int(math.floor(max_lat / height) - math.floor(min_lat / height)) + 1
+            columns = int(math.floor(max_lon / width) - math.floor(min_lon / width)) + 1
+            if rows * columns <= max_cells:
+                precision = candidate
+                break
+        
+        # Walk the box, one cell at a time.
+        height, width = Geo.geohash_cell_size(precision)
+        cells = set()
+        lat = min_lat
+        while True:
+            lon = min_lon
+            while True:
+                cells.add(Geo.geohash(lat, lon, precision))
+                if lon >= max_lon:
+                    break
+                lon = min(lon + width, max_lon)
+            if lat >= max_lat:
+                break
+            lat = min(lat + height, max_lat)
+        
+        # Return.
+        return sorted(cells)
+
+
+class GeoGrid:
+    """
+    In-memory grid of points (e.g. Places' coordinates), bucketed by latitude/longitude cells, used to find the
+    points nearest to a given one without comparing every pair.
+    """
+    
+    def __init__(self, max_distance):
+        """
+        Constructor.
+        
+        Args:
+            max_distance: Maximum distance (km) of the searches, which is also the height of each cell.
+        """
+        self.max_distance = float(max_distance)
+        self.cell_size = math.degrees(self.max_distance / Geo.earth_radius)
+        self.cells = {}
+    
+    def cell(self, latitude, longitude):
+        """
+        Returns the cell of the given coordinates.
+        """
+        return (int(math.floor(latitude / self.cell_size)), int(math.floor(longitude / self.cell_size)))
+    
+    def add(self, key, latitude, longitude):
+        """
+        Adds a point, identified by the given key.
+        """
+        self.cells.setdefault(self.cell(latitude, longitude), []).append((key, latitude, longitude))
+    
+    def nearby(self, latitude, longitude):
+        """
+        Returns the points in the cells that intersect the search box of the given coordinates.
+        """
+        geo_box = Geo.box((latitude, longitude), self.max_distance)
+        min_cell = self.cell(geo_box['minLat'], geo_box['minLon'])
+        max_cell = self.cell(geo_box['maxLat'], geo_box['maxLon'])
+        points = []
+        for row in range(min_cell[0], max_cell[0] + 1):
+            for column in range(min_cell[1], max_cell[1] + 1):
+                points.extend(self.cells.get((row, column), []))
+        return points
+    
+    def nearest(self, latitude, longitude, count, exclude=None):
+        """
+        Returns a list of (distance, key) pairs, nearest first, of the (at most) 'count' points that are within
+        the maximum distance from the given coordinates.
+        """
+        distances = []
+        for key, lat, lon in self.nearby(latitude, longitude):
+            if key != exclude:
+                distance = Geo.distance((latitude, longitude), (lat, lon))
+                if distance <= self.max_distance:
+                    distances.append((distance, key))
+        return heapq.nsmallest(count, distances)
+
+
+class Text:
+    """
+    Methods regarding text.
+    """
+    
+    @staticmethod
+    def fold(value):
+        """
+        Returns the given text in lower case and without accents (e.g. u"Caf\xe9" becomes "cafe"), as a UTF-8 string.
+        """
+        value = unicodedata.normalize('NFKD', unicode(value))
+        return u''.join([c for c in value if not unicodedata.combining(c)]).lower().encode('utf-8')
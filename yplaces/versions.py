@@ -0,0 +1,98 @@
+import logging
+import threading
+import time
+from django.core.cache import cache
+from django.core.signals import request_finished
+from django.db import transaction
+
+# Instantiate logger.
+logger = logging.getLogger(__name__)
+
+# How long (seconds) generations are kept in the cache. If one is evicted it restarts from the current time (in
+# microseconds), so that values already used (e.g. in cache keys and ETags) aren't used again for different data.
+TIMEOUT = 60 * 60 * 24 * 30
+
+# Generations bumped by this thread inside a transaction, to be bumped again once it ends (see 'Generation.bump').
+_pending = threading.local()
+
+
+def seed():
+    """
+    Returns the value missing generations (re)start from: the current time, in microseconds, which is larger than any
+    value a generation that started before could have reached (unless it was bumped over a million times per second).
+    """
+    return int(time.time() * 1000000)
+
+
+class Generation(object):
+    """
+    Counter, shared through Django's cache, that is bumped whenever the data it represents changes. Processes that
+    keep their own copy of that data (e.g. in-memory indexes) compare it with the generation they were built from in
+    order to know when they are stale. For this to work across processes, the cache must be a shared one (e.g. memcached).
+    """
+    
+    def __init__(self, name):
+        """
+        Constructor.
+        """
+        self.key = 'yplaces:generation:' + name
+    
+    def get(self):
+        """
+        Returns the current generation.
+        """
+        flush()
+        value = cache.get(self.key)
+        if value is None:
+            value = seed()
+            cache.add(self.key, value, TIMEOUT)
+            value = cache.get(self.key, value)
+        return value
+    
+    def bump(self):
+        """
+        Increments the generation, returning the new value. Inside a transaction, it's incremented again once the
+        transaction ends, as other processes may meanwhile derive (and cache) data from the rows it hasn't committed
+        yet under the new generation.
+        """
+        value = self.increment()
+        if transaction.is_managed():
+            if not hasattr(_pending, 'generations'):
+                _pending.generations = {}
+            _pending.generations[self.key] = self
+        else:
+            flush()
+        return value
+    
+    def increment(self):
+        """
+        Increments the generation, returning the new value.
+        """
+        try:
+            return cache.incr(self.key)
+        # Key was evicted (or never set).
+        except ValueError:
+            cache.add(self.key, seed(), TIMEOUT)
+            return cache.incr(self.key)
+    
+    @staticmethod
+    def get_many(generations):
+        """
+        Returns the current values of the given generations (in the same order), fetched from the cache at once.
+        """
+        flush()
+        values = cache.get_many([generation.key for generation in generations])
+        return [values[generation.key] if generation.key in values else generation.get() for generation in generations]
+
+
+def flush(**kwargs):
+    """
+    Increments again the generations this thread bumped inside a transaction, once it has ended (i.e. outside of
+    transaction management), e.g. when the request finishes.
+    """
+    generations = getattr(_pending, 'generations', None)
+    if generations and not transaction.is_managed():
+        _pending.generations = {}
+        for generation in generations.values():
+            generation.increment()
+request_finished.connect(flush)
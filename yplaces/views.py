@@ -5,14 +5,15 @@ from django.core.exceptions import ObjectDoesNotExist
 from django.core.paginator import PageNotAnInteger, EmptyPage
 from django.core.paginator import Paginator
 from django.core.urlresolvers import reverse
-from django.db.models import Q
 from django.http.response import HttpResponseRedirect, Http404
 from django.shortcuts import render_to_response
 from django.template.context import RequestContext
 from django.utils.text import slugify
 from django.utils.translation import ugettext as _
 
-from models import Place, Rating, Review
+from models import Place, Rating, Photo, Review
+from pagination import CursorPaginator
+from search import get_backend as get_search_backend
 
 # Instantiate logger.
 logger = logging.getLogger(__name__)
@@ -35,10 +36,10 @@ def index(request):
         description = ''
     
     # Top places.
-    top_rating = Rating.objects.all().order_by('-relative')[:5]
+    top_rating = Rating.objects.select_related('place').order_by('-' + Rating.get_ranking_field())[:5]
     
     # Fetch latest reviews.
-    reviews = Review.objects.all().order_by('-date')[:5]    
+    reviews = Review.objects.select_related('user', 'place').order_by('-date')[:5]
     
     # Render page.
     return render_to_response('yplaces/index.html',
@@ -46,7 +47,8 @@ def index(request):
                                'description': description,
                                'top_rating': top_rating,
                                'reviews': reviews,
-                               'places_api_url': settings.HOST_URL + reverse(settings.YPLACES['api_url_namespace'] + ':yplaces:index') },
+                               'places_api_url': settings.HOST_URL + reverse(settings.YPLACES['api_url_namespace'] + ':yplaces:index'),
+                               'autocomplete_api_url': settings.HOST_URL + reverse(settings.YPLACES['api_url_namespace'] + ':yplaces:autocomplete') },
                               context_instance=RequestContext(request))
 
 
@@ -70,20 +72,11 @@ def search(request):
     # Lets start with all..
     results = Place.objects.filter(active=True).order_by('name')
     
-    # Search by name.
-    try:
-        name = request.GET['name']
-        results = results.filter(Q(name__icontains=name))
-    except KeyError:
-        name = ''
+    # Search by name and location (ranked by relevance, when the search backend supports it).
+    name = request.GET.get('name', '')
+    location = request.GET.get('location', '')
+    results = get_search_backend().search(results, name=name, location=location)
     
-    # Search by location.
-    try:
-        location = request.GET['location']
-        results = results.filter(Q(address__icontains=location) | Q(city__icontains=location) | Q(state__icontains=location) | Q(country__icontains=location))
-    except KeyError:
-        location = ''
-        
     # Fetch X items and paginate.
     paginator = Paginator(results, 10)
     try:
@@ -103,7 +96,8 @@ def search(request):
     return render_to_response('yplaces/search.html',
                               { 'search_name': name,
                                 'search_location': location,
-                                'search_results': result_page },
+                                'search_results': result_page,
+                                'autocomplete_api_url': settings.HOST_URL + reverse(settings.YPLACES['api_url_namespace'] + ':yplaces:autocomplete') },
                               context_instance=RequestContext(request))
 
 
@@ -150,18 +144,24 @@ def place_slug(request, pk, slug):
     # Highlighted Photos.
     photos = [None, None, None]
     no_photos = True
-    for idx, photo in enumerate(place.photo_set.all()):
+    for idx, photo in enumerate(place.photo_set.filter(state=Photo.READY)):
         if idx < 3:
             photos[idx] = photo
             no_photos = False
         else:
             break
 
+    # First page of reviews (the following ones are fetched from the API, as the user scrolls).
+    reviews, reviews_cursor, previous = CursorPaginator(('-date', '-id'), per_page=10).paginate(place.review_set.select_related('user', 'photo'))
+    
     # Render page
     return render_to_response('yplaces/place.html',
                               { 'place': place,
                                'rating': place.get_rating(),
                                'photos': photos, 'no_photos': no_photos,
+                               'reviews': reviews,
+                               'reviews_cursor': reviews_cursor,
+                               'nearby': place.neighbours.select_related('neighbour'),
                                'reviews_api_url': settings.HOST_URL + reverse(settings.YPLACES['api_url_namespace'] + ':yplaces:reviews', args=[place.pk]),
                                'host_url': settings.HOST_URL },
                               context_instance=RequestContext(request))
@@ -205,5 +205,6 @@ def photos(request, pk, slug):
     return render_to_response('yplaces/photos.html',
                               { 'place': place,
                                'rating': place.get_rating(),
+                               'photos': place.photo_set.filter(state=Photo.READY).select_related('added_by'),
                                'photos_api_url': settings.HOST_URL + reverse(settings.YPLACES['api_url_namespace'] + ':yplaces:photos', args=[place.pk]) },
                               context_instance=RequestContext(request))
\ No newline at end of file